@@ -0,0 +1,456 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import secrets
+from telegram import Update
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import (
+    ContextTypes,
+    CommandHandler,
+    Application,
+    filters
+)
+import db_manager
+import lifecycle
+import rate_limiter
+import broadcast
+import drivers
+import vpn_connector
+import server_registry
+import quota
+import migration
+import profiling
+import export
+
+logger = logging.getLogger(__name__)
+
+# Команды администратора доступны только из чата с ADMIN_USER_ID
+admin_filter = filters.User(user_id=secrets.ADMIN_USER_ID) if secrets.ADMIN_USER_ID else filters.User(user_id=[])
+
+
+# Долгие команды идут фоновыми задачами: обновления обрабатываются по одному, и пока
+# обработчик занят, остальные пользователи ждут. Имя команды -> задача
+_background: dict[str, asyncio.Task] = {}
+
+
+def _background_running(name: str) -> bool:
+    task = _background.get(name)
+    return task is not None and not task.done()
+
+
+def _start_background(application: Application, name: str, coroutine) -> None:
+    _background[name] = lifecycle.track(application.create_task(coroutine, name=name))
+
+
+async def _notify(bot, chat_id: int, text: str) -> None:
+    try:
+        await bot.send_message(chat_id=chat_id, text=text, parse_mode=None,
+                               rate_limit_args={"priority": rate_limiter.PRIORITY_NOTIFICATION})
+    except TelegramError as e:
+        logger.error(f"Failed to send admin report to {chat_id}: {e}")
+
+
+def _command_argument(update: Update) -> str:
+    """Возвращает текст после команды с сохранением переносов строк."""
+    parts = (update.message.text or "").split(maxsplit=1)
+    return parts[1].strip() if len(parts) > 1 else ""
+
+
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    text = _command_argument(update)
+    if not text:
+        await update.message.reply_text("Использование: /broadcast <текст сообщения>", parse_mode=None)
+        return
+
+    # Предпросмотр администратору заодно проверяет разметку до отправки всем пользователям
+    try:
+        await update.message.reply_text(text)
+    except BadRequest as e:
+        await update.message.reply_text(f"Сообщение не удалось отправить: {e}. Рассылка не запущена.", parse_mode=None)
+        return
+
+    with db_manager.get_db() as db:
+        new_broadcast = db_manager.create_broadcast(db, text=text, created_by=update.effective_user.id)
+    broadcast.start_broadcast(context.application, new_broadcast.id)
+    await update.message.reply_text(
+        f"📣 Рассылка #{new_broadcast.id} запущена. Отменить: /broadcast_cancel {new_broadcast.id}",
+        parse_mode=None
+    )
+
+
+async def broadcast_cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    argument = _command_argument(update)
+    if not argument.isdigit():
+        await update.message.reply_text("Использование: /broadcast_cancel <номер рассылки>", parse_mode=None)
+        return
+
+    with db_manager.get_db() as db:
+        cancelled = db_manager.finish_broadcast(db, int(argument), status='cancelled')
+    if not cancelled:
+        await update.message.reply_text(f"Рассылка #{argument} не найдена.", parse_mode=None)
+        return
+    await update.message.reply_text(
+        f"Рассылка #{cancelled.id}: {cancelled.status}. Доставлено: {cancelled.sent_count}.",
+        parse_mode=None
+    )
+
+
+def _resolve_user_id(db, argument: str) -> int | None:
+    """Находит пользователя по Telegram ID, @username или email ключа в панели."""
+    if argument.isdigit():
+        return int(argument)
+    if "@" in argument and not argument.startswith("@"):
+        subscription = db_manager.get_subscription_by_identifier(db, argument)
+        if subscription:
+            return subscription.user_id
+    user = db_manager.find_user_by_username(db, argument)
+    if user:
+        return user.id
+    # SS-ключи не содержат "@" в email, поэтому последней пробуем точный поиск по key_identifier
+    subscription = db_manager.get_subscription_by_identifier(db, argument)
+    return subscription.user_id if subscription else None
+
+
+def _format_subscription(sub: db_manager.Subscription) -> str:
+    status = "активен" if sub.is_active else "отозван"
+    return f"#{sub.id} {sub.protocol.upper()} сервер {sub.server_id} — {status}\n   {sub.key_identifier} (от {sub.created_at:%Y-%m-%d})"
+
+
+async def _revoke(subscriptions: list[db_manager.Subscription]) -> tuple[list[db_manager.Subscription], list[db_manager.Subscription]]:
+    """Удаляет ключи в панели параллельно, затем одной транзакцией отключает удалённые в БД."""
+    results = await asyncio.gather(
+        *(drivers.delete_key(sub.server_id, sub.protocol, sub.key_identifier) for sub in subscriptions),
+        return_exceptions=True
+    )
+    revoked = [sub for sub, result in zip(subscriptions, results) if result is True]
+    failed = [sub for sub, result in zip(subscriptions, results) if result is not True]
+    for sub, result in zip(subscriptions, results):
+        if isinstance(result, Exception):
+            logger.error(f"Failed to delete key {sub.key_identifier} on the panel: {result}", exc_info=result)
+    with db_manager.get_db() as db:
+        db_manager.deactivate_subscriptions(db, [sub.id for sub in revoked])
+    return revoked, failed
+
+
+def _revoke_report(revoked: list[db_manager.Subscription], failed: list[db_manager.Subscription]) -> str:
+    lines = [f"Отозвано ключей: {len(revoked)}"]
+    lines += [f"  ✅ {sub.key_identifier}" for sub in revoked]
+    if failed:
+        lines.append(f"Не удалось удалить в панели: {len(failed)}")
+        lines += [f"  ❌ {sub.key_identifier}" for sub in failed]
+    return "\n".join(lines)
+
+
+async def keys_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    argument = _command_argument(update)
+    if not argument:
+        await update.message.reply_text("Использование: /keys <Telegram ID | @username | email ключа>", parse_mode=None)
+        return
+
+    with db_manager.get_db() as db:
+        user_id = _resolve_user_id(db, argument)
+        user = db_manager.get_user(db, user_id) if user_id else None
+        subscriptions = db_manager.get_user_keys(db, user_id, active_only=False) if user_id else []
+
+    if not user_id or (not user and not subscriptions):
+        await update.message.reply_text(f"Пользователь «{argument}» не найден.", parse_mode=None)
+        return
+
+    username = f"@{user.username}" if user and user.username else "без username"
+    lines = [f"👤 {user_id} ({username}), ключей: {len(subscriptions)}"]
+    lines += [_format_subscription(sub) for sub in subscriptions]
+    await update.message.reply_text("\n".join(lines), parse_mode=None)
+
+
+async def revoke_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    key_identifier = _command_argument(update)
+    if not key_identifier:
+        await update.message.reply_text("Использование: /revoke <email ключа>", parse_mode=None)
+        return
+
+    with db_manager.get_db() as db:
+        subscription = db_manager.get_subscription_by_identifier(db, key_identifier)
+    if not subscription or not subscription.is_active:
+        await update.message.reply_text(f"Активный ключ «{key_identifier}» не найден.", parse_mode=None)
+        return
+
+    revoked, failed = await _revoke([subscription])
+    logger.info(f"Admin {update.effective_user.id} revoked key {key_identifier}: {'ok' if revoked else 'failed'}.")
+    await update.message.reply_text(_revoke_report(revoked, failed), parse_mode=None)
+
+
+async def revoke_all_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    argument = _command_argument(update)
+    if not argument:
+        await update.message.reply_text("Использование: /revoke_all <Telegram ID | @username>", parse_mode=None)
+        return
+
+    with db_manager.get_db() as db:
+        user_id = _resolve_user_id(db, argument)
+        subscriptions = db_manager.get_user_keys(db, user_id) if user_id else []
+    if not subscriptions:
+        await update.message.reply_text(f"У пользователя «{argument}» нет активных ключей.", parse_mode=None)
+        return
+
+    revoked, failed = await _revoke(subscriptions)
+    logger.info(f"Admin {update.effective_user.id} revoked {len(revoked)}/{len(subscriptions)} keys of user {user_id}.")
+    await update.message.reply_text(_revoke_report(revoked, failed), parse_mode=None)
+
+
+async def traffic_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    argument = _command_argument(update)
+    if not argument:
+        await update.message.reply_text("Использование: /traffic <email ключа | Telegram ID | @username>", parse_mode=None)
+        return
+
+    with db_manager.get_db() as db:
+        subscription = db_manager.get_subscription_by_identifier(db, argument)
+        if subscription:
+            subscriptions = [subscription]
+        else:
+            user_id = _resolve_user_id(db, argument)
+            subscriptions = db_manager.get_user_keys(db, user_id) if user_id else []
+    if not subscriptions:
+        await update.message.reply_text(f"Ключи «{argument}» не найдены.", parse_mode=None)
+        return
+
+    traffic = await asyncio.gather(
+        *(drivers.get_key_traffic(sub.server_id, sub.protocol, sub.key_identifier) for sub in subscriptions)
+    )
+    lines = []
+    for sub, stats in zip(subscriptions, traffic):
+        if not stats:
+            lines.append(f"{sub.key_identifier}: нет данных")
+            continue
+        limit = vpn_connector.format_bytes(stats['total']) if stats['total'] else "без лимита"
+        state = "" if stats['enable'] else " (отключён)"
+        lines.append(
+            f"{sub.key_identifier}{state}\n   ↑ {vpn_connector.format_bytes(stats['up'])}  ↓ {vpn_connector.format_bytes(stats['down'])}  лимит: {limit}"
+        )
+    await update.message.reply_text("\n".join(lines), parse_mode=None)
+
+
+def _quota_report(user: db_manager.User, usage: db_manager.TrafficUsage | None) -> str:
+    limit_gb = quota.limit_gb_for_user(user)
+    if user.traffic_limit_gb is not None:
+        source = "личный"
+    elif user.plan and user.plan in getattr(secrets, "TRAFFIC_PLANS", {}):
+        source = f"тариф {user.plan}"
+    else:
+        source = "по умолчанию"
+    limit = f"{limit_gb} ГБ" if limit_gb else "без лимита"
+    used = vpn_connector.format_bytes(usage.used_bytes) if usage else "нет данных"
+    state = "приостановлены" if usage and usage.quota_disabled else "активны"
+    return f"👤 {user.id}: лимит {limit} ({source}), использовано {used}, ключи {state}"
+
+
+async def quota_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    parts = _command_argument(update).split()
+    if not parts or len(parts) > 2:
+        plans = ", ".join(getattr(secrets, "TRAFFIC_PLANS", {})) or "нет"
+        await update.message.reply_text(
+            f"Использование: /quota <Telegram ID | @username> [ГБ | тариф | default]\nТарифы: {plans}",
+            parse_mode=None
+        )
+        return
+
+    with db_manager.get_db() as db:
+        user_id = _resolve_user_id(db, parts[0])
+        user = db_manager.get_user(db, user_id) if user_id else None
+        if not user:
+            await update.message.reply_text(f"Пользователь «{parts[0]}» не найден.", parse_mode=None)
+            return
+
+        if len(parts) == 2:
+            value = parts[1]
+            if value.isdigit():
+                traffic_limit_gb, plan = int(value), None
+            elif value == "default":
+                traffic_limit_gb, plan = None, None
+            elif value in getattr(secrets, "TRAFFIC_PLANS", {}):
+                traffic_limit_gb, plan = None, value
+            else:
+                await update.message.reply_text(f"Неизвестный тариф «{value}».", parse_mode=None)
+                return
+            user = db_manager.set_traffic_limit(db, user.id, traffic_limit_gb, plan)
+            logger.info(f"Admin {update.effective_user.id} set traffic limit of user {user.id}: {value}.")
+            # Пересчитываем сразу, чтобы отключить или включить ключи без ожидания плановой проверки
+            # (пользователя для пересчёта отметил set_traffic_limit)
+            if context.job_queue:
+                context.job_queue.run_once(quota.quota_job, 0)
+
+        report = _quota_report(user, db_manager.get_traffic_usage(db, user.id))
+    await update.message.reply_text(report, parse_mode=None)
+
+
+def _apply_servers_reload() -> bool:
+    if not server_registry.reload_if_changed():
+        return False
+    db_manager.sync_servers()
+    return True
+
+
+async def reload_servers_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    _apply_servers_reload()
+
+
+async def reload_servers_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not getattr(secrets, "SERVERS_CONFIG_FILE", None):
+        await update.message.reply_text("SERVERS_CONFIG_FILE не задан — серверы берутся из secrets.py и меняются только перезапуском.", parse_mode=None)
+        return
+    reloaded = _apply_servers_reload()
+    servers = server_registry.all_servers()
+    status = "Реестр серверов перезагружен." if reloaded else "Файл не изменился или содержит ошибки (подробности в логе)."
+    lines = [status] + [f"#{s.id} {s.name} ({s.region}) {s.ip}: {', '.join(sorted(s.protocols))}" for s in servers]
+    await update.message.reply_text("\n".join(lines), parse_mode=None)
+
+
+async def relink_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    argument = _command_argument(update)
+    if argument and not argument.isdigit():
+        await update.message.reply_text("Использование: /relink [ID сервера]", parse_mode=None)
+        return
+    server_id = int(argument) if argument else None
+    if server_id is not None and server_registry.get(server_id) is None:
+        await update.message.reply_text(f"Сервер #{server_id} не найден в реестре.", parse_mode=None)
+        return
+
+    if _background_running("relink"):
+        await update.message.reply_text("Обновление ссылок уже идёт.", parse_mode=None)
+        return
+
+    logger.info(f"Admin {update.effective_user.id} started key link regeneration (server {server_id or 'all'}).")
+    _start_background(context.application, "relink", _relink_and_report(context.bot, update.effective_chat.id, server_id))
+    await update.message.reply_text("🔗 Обновляю ссылки ключей, результат придёт сюда.", parse_mode=None)
+
+
+async def _relink_and_report(bot, chat_id: int, server_id: int | None) -> None:
+    try:
+        result = await vpn_connector.regenerate_key_links(server_id)
+    except Exception as e:
+        logger.error(f"Key link regeneration failed: {e}", exc_info=True)
+        await _notify(bot, chat_id, f"Не удалось обновить ссылки: {e}")
+        return
+    lines = [f"Проверено ключей: {result.checked}, ссылок обновлено: {result.updated}."]
+    if result.unparsed:
+        lines.append(f"Не удалось разобрать ссылок: {result.unparsed}.")
+    if result.failed_inbounds:
+        lines.append(f"Панель не ответила для инбаундов: {', '.join(map(str, result.failed_inbounds))} — повторите позже.")
+    await _notify(bot, chat_id, "\n".join(lines))
+
+
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 120
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    argument = _command_argument(update)
+    if argument and not argument.isdigit():
+        await update.message.reply_text(f"Использование: /profile [секунд, до {PROFILE_MAX_SECONDS}]", parse_mode=None)
+        return
+    seconds = min(int(argument or PROFILE_DEFAULT_SECONDS), PROFILE_MAX_SECONDS) or PROFILE_DEFAULT_SECONDS
+    if not profiling.available():
+        await update.message.reply_text("Профайлер недоступен: нужен Unix и event loop в главном потоке.", parse_mode=None)
+        return
+    if profiling.is_running() or _background_running("profile"):
+        await update.message.reply_text("Профилирование уже идёт.", parse_mode=None)
+        return
+
+    # Профайлер работает в фоне: тем временем бот обрабатывает обновления, задержку которых и ищем
+    logger.info(f"Admin {update.effective_user.id} started profiling the event loop for {seconds}s.")
+    _start_background(context.application, "profile", _profile_and_report(context.bot, update.effective_chat.id, seconds))
+    await update.message.reply_text(f"⏱ Профилирую event loop {seconds} с, результат придёт сюда.", parse_mode=None)
+
+
+async def _profile_and_report(bot, chat_id: int, seconds: int) -> None:
+    result = await profiling.profile_event_loop(seconds)
+    if result is None:
+        await _notify(bot, chat_id, "Профилирование уже идёт.")
+        return
+    # Лимит длины сообщения Telegram — 4096 символов
+    await _notify(bot, chat_id, result.summary()[:4000])
+
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    argument = _command_argument(update).lower()
+    if argument and argument not in export.DATASETS:
+        await update.message.reply_text(f"Использование: /export [{' | '.join(export.DATASETS)}]", parse_mode=None)
+        return
+    datasets = [argument] if argument else list(export.DATASETS)
+    # Выгрузка идёт в фоне: бот тем временем обрабатывает остальные обновления
+    if not export.start(context.application, update.effective_chat.id, datasets):
+        await update.message.reply_text("Выгрузка уже идёт.", parse_mode=None)
+        return
+    logger.info(f"Admin {update.effective_user.id} started export of {', '.join(datasets)}.")
+    await update.message.reply_text(f"📦 Готовлю выгрузку: {', '.join(datasets)}. Файлы придут сюда.", parse_mode=None)
+
+
+async def migrate_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    parts = _command_argument(update).split()
+    if len(parts) != 2 or not all(part.isdigit() for part in parts):
+        await update.message.reply_text("Использование: /migrate <ID сервера-источника> <ID сервера-назначения>", parse_mode=None)
+        return
+    source_id, target_id = map(int, parts)
+    source, target = server_registry.get(source_id), server_registry.get(target_id)
+    if source is None or target is None or source_id == target_id:
+        await update.message.reply_text("Укажите два разных сервера из реестра.", parse_mode=None)
+        return
+    protocols = migration.migratable_protocols(source, target)
+    if not protocols:
+        await update.message.reply_text("У серверов нет общих протоколов 3x-ui (vless, shadowsocks).", parse_mode=None)
+        return
+
+    with db_manager.get_db() as db:
+        # Приостановленный перенос той же пары продолжается, а не начинается заново
+        existing = db.query(db_manager.Migration).filter(
+            db_manager.Migration.source_server_id == source_id,
+            db_manager.Migration.target_server_id == target_id,
+            db_manager.Migration.status == 'running'
+        ).first()
+        current = existing or db_manager.create_migration(db, source_id, target_id, created_by=update.effective_user.id)
+        migration_id = current.id
+    migration.start_migration(context.application, migration_id)
+    action = "продолжен" if existing else "запущен"
+    await update.message.reply_text(
+        f"🚚 Перенос #{migration_id} ({source.name} → {target.name}, {', '.join(protocols)}) {action}. "
+        f"Отменить: /migrate_cancel {migration_id}",
+        parse_mode=None
+    )
+
+
+async def migrate_cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    argument = _command_argument(update)
+    if not argument.isdigit():
+        await update.message.reply_text("Использование: /migrate_cancel <номер переноса>", parse_mode=None)
+        return
+
+    with db_manager.get_db() as db:
+        cancelled = db_manager.finish_migration(db, int(argument), status='cancelled')
+    if not cancelled:
+        await update.message.reply_text(f"Перенос #{argument} не найден.", parse_mode=None)
+        return
+    await update.message.reply_text(
+        f"Перенос #{cancelled.id}: {cancelled.status}. Перенесено ключей: {cancelled.migrated_count}.",
+        parse_mode=None
+    )
+
+
+def register_handlers(application: Application) -> None:
+    logger.info("Registering admin handlers...")
+
+    application.add_handler(CommandHandler("broadcast", broadcast_command, filters=admin_filter))
+    application.add_handler(CommandHandler("broadcast_cancel", broadcast_cancel_command, filters=admin_filter))
+    application.add_handler(CommandHandler("keys", keys_command, filters=admin_filter))
+    application.add_handler(CommandHandler("revoke", revoke_command, filters=admin_filter))
+    application.add_handler(CommandHandler("revoke_all", revoke_all_command, filters=admin_filter))
+    application.add_handler(CommandHandler("traffic", traffic_command, filters=admin_filter))
+    application.add_handler(CommandHandler("reload_servers", reload_servers_command, filters=admin_filter))
+    application.add_handler(CommandHandler("quota", quota_command, filters=admin_filter))
+    application.add_handler(CommandHandler("relink", relink_command, filters=admin_filter))
+    application.add_handler(CommandHandler("migrate", migrate_command, filters=admin_filter))
+    application.add_handler(CommandHandler("migrate_cancel", migrate_cancel_command, filters=admin_filter))
+    application.add_handler(CommandHandler("profile", profile_command, filters=admin_filter))
+    application.add_handler(CommandHandler("export", export_command, filters=admin_filter))
+
+    if getattr(secrets, "SERVERS_CONFIG_FILE", None) and application.job_queue:
+        application.job_queue.run_repeating(reload_servers_job, interval=secrets.SERVERS_RELOAD_INTERVAL, first=secrets.SERVERS_RELOAD_INTERVAL)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Каждый драйвер протокола отдельно: выдача и удаление ключей против локальной имитации сервера.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_drivers --keys 500 --latency 0.02
+    python -m benchmarks.bench_drivers --protocol outline
+
+Для каждого драйвера: create() по одному ключу с ограниченной параллельностью,
+create_many() той же пачкой и delete() всех выданных ключей.
+"""
+import argparse
+import asyncio
+import logging
+import tempfile
+import time
+
+from benchmarks.bench_load import _prepare_environment
+
+
+async def run(args: argparse.Namespace) -> None:
+    import db_manager
+    import drivers
+    import server_registry
+    import vpn_connector
+    from benchmarks.fake_outline import FakeOutline
+    from benchmarks.fake_panel import FakePanel
+
+    server_registry.load()
+    # Сервер Outline добавляется к серверам 3x-ui из secrets.py
+    server_registry._snapshot = server_registry.build([dict(server.raw) for server in server_registry.all_servers()] + [
+        {"id": 99, "name": "Outline", "region": "bench", "ip": "127.0.0.1", "outline_api_url": "http://fake-outline/secret"}
+    ])
+    db_manager.init_db()
+    panel, outline = FakePanel(latency=args.latency), FakeOutline(latency=args.latency)
+    await vpn_connector.set_transport(panel.transport())
+    await drivers.get("outline").set_transport(outline.transport())
+    await vpn_connector.warm_up()
+
+    protocols = [args.protocol] if args.protocol else drivers.protocols()
+    for protocol in protocols:
+        driver = drivers.get(protocol)
+        server = server_registry.first_for_protocol(protocol)
+        if server is None or not driver.is_configured(server):
+            print(f"== {protocol}: no configured server, skipped ==")
+            continue
+        print(f"== {protocol} ({type(driver).__name__}), {args.keys} keys, panel latency {args.latency * 1000:.0f} ms ==")
+        print(f"health:          {await driver.health(server)}")
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        user_ids = iter(range(1_000_000, 2_000_000))
+
+        async def create_one():
+            async with semaphore:
+                return await driver.create(server, next(user_ids), "bench")
+
+        started = time.perf_counter()
+        created = await asyncio.gather(*(create_one() for _ in range(args.keys)))
+        elapsed = time.perf_counter() - started
+        print(f"create:          {elapsed:6.2f}s  ({args.keys / elapsed:,.0f} keys/s, {sum(1 for link, _ in created if link)} ok)")
+
+        requests = [drivers.KeyRequest(user_telegram_id=next(user_ids), user_username="bench") for _ in range(args.keys)]
+        started = time.perf_counter()
+        created_many = await driver.create_many(server, requests, concurrency=args.concurrency)
+        elapsed = time.perf_counter() - started
+        mode = "bulk" if driver.capabilities.bulk_create else "one by one"
+        print(f"create_many:     {elapsed:6.2f}s  ({args.keys / elapsed:,.0f} keys/s, {sum(1 for link, _ in created_many if link)} ok, {mode})")
+
+        async def delete_one(key_identifier: str) -> bool:
+            async with semaphore:
+                return await driver.delete(server, key_identifier)
+
+        identifiers = [key_identifier for link, key_identifier in created + created_many if link]
+        started = time.perf_counter()
+        deleted = await asyncio.gather(*(delete_one(key_identifier) for key_identifier in identifiers))
+        elapsed = time.perf_counter() - started
+        print(f"delete:          {elapsed:6.2f}s  ({len(identifiers) / elapsed:,.0f} keys/s, {sum(deleted)} ok)")
+
+    print(f"panel requests:   {panel.requests}")
+    print(f"outline requests: {outline.requests}")
+    await drivers.close_all()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--protocol", help="Только этот драйвер (по умолчанию — все зарегистрированные)")
+    parser.add_argument("--keys", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.01, help="Задержка ответа имитаций, с")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as db_dir:
+        _prepare_environment(db_dir)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
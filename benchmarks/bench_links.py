@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Сборка ссылок ключей по шаблонам и массовая пересборка после смены IP сервера.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_links --keys 100000
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import tempfile
+import time
+import uuid
+
+from sqlalchemy import insert
+
+from benchmarks.bench_load import _prepare_environment
+
+
+async def run(args: argparse.Namespace) -> None:
+    import db_manager
+    import link_templates
+    import server_registry
+    import vpn_connector
+    from benchmarks.fake_panel import FakePanel
+
+    server_registry.load()
+    db_manager.init_db()
+    server = server_registry.first_for_protocol("vless")
+    panel = FakePanel(latency=0)
+    await vpn_connector.set_transport(panel.transport())
+    port = (await vpn_connector._xui_get_inbound(server.vless.inbound_id))["port"]
+
+    credentials = [str(uuid.uuid4()) for _ in range(args.keys)]
+    started = time.perf_counter()
+    links = [link_templates.render(server, "vless", port, credential, f"tg_{n}_bench@bot.local")
+             for n, credential in enumerate(credentials)]
+    elapsed = time.perf_counter() - started
+    print(f"== {args.keys} VLESS keys ==")
+    print(f"render:          {elapsed:6.2f}s  ({args.keys / elapsed:,.0f} links/s)")
+
+    expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=365)
+    with db_manager.get_db() as db:
+        db.execute(insert(db_manager.User), [{"id": n, "username": f"user{n}"} for n in range(1, args.keys + 1)])
+        db.execute(insert(db_manager.Subscription), [
+            {"user_id": n + 1, "server_id": server.id, "protocol": "vless", "key_data": link,
+             "key_identifier": f"tg_{n}_bench@bot.local", "expires_at": expires_at}
+            for n, link in enumerate(links)
+        ])
+        db.commit()
+
+    # Смена IP и SNI: реестр получает новую запись сервера, шаблон собирается заново
+    server_registry._snapshot = server_registry.build([dict(server.raw, ip="203.0.113.7", xui_vless_sni="new.example.com")])
+    started = time.perf_counter()
+    result = await vpn_connector.regenerate_key_links(server.id)
+    print(f"relink:          {time.perf_counter() - started:6.2f}s  checked {result.checked}  updated {result.updated}")
+    started = time.perf_counter()
+    result = await vpn_connector.regenerate_key_links(server.id)
+    print(f"relink (no-op):  {time.perf_counter() - started:6.2f}s  checked {result.checked}  updated {result.updated}")
+    await vpn_connector.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=100_000)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as db_dir:
+        _prepare_environment(db_dir)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
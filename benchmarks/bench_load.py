@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Сквозной нагрузочный прогон выдачи ключей против имитаций панели и Telegram.
+
+Запуск из корня репозитория (сеть не нужна, база создаётся во временном каталоге):
+    python -m benchmarks.bench_load --users 200 --concurrency 50 --latency 0.02
+    python -m benchmarks.bench_load --mode connector --users 500 --locked-rate 0.05
+    python -m benchmarks.bench_load --mode connector --users 2000 --client-latency 0.00002 --max-per-inbound 500 --spare-ports 3
+
+Режим handlers подаёт нажатия кнопок в update_queue бота: как и в боте, обновления
+обрабатываются по одному, а --concurrency пользователей нажимают одновременно и ждут в
+очереди. Задержка в этом режиме включает ожидание в очереди. Режим connector вызывает
+drivers.create_key напрямую, --concurrency вызовов одновременно. В отчёте — ключей в
+секунду, перцентили задержки и задержка event loop.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+import secrets
+
+
+def _prepare_environment(db_dir: str) -> None:
+    # До импорта db_manager: движок БД создаётся при импорте модуля
+    secrets.DATABASE_URL = f"sqlite:///{os.path.join(db_dir, 'bench.db')}"
+    secrets.BOT_TOKEN = "123456:" + "A" * 35
+    secrets.XUI_API_URL = "http://fake-panel"
+    secrets.ADMIN_USER_ID = 0
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class LoopLagMonitor:
+    """Измеряет, насколько позже запланированного просыпается event loop."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def _report(title: str, latencies: list[float], succeeded: int, elapsed: float, lag: LoopLagMonitor, panel) -> None:
+    ms = lambda value: f"{value * 1000:.1f} ms"  # noqa: E731
+    print(f"== {title} ==")
+    print(f"keys issued:     {succeeded}/{len(latencies)} in {elapsed:.2f}s -> {succeeded / elapsed:.1f} keys/s")
+    if latencies:
+        print(f"latency:         p50 {ms(percentile(latencies, 0.5))}  p95 {ms(percentile(latencies, 0.95))}  "
+              f"p99 {ms(percentile(latencies, 0.99))}  max {ms(max(latencies))}")
+    if lag.samples:
+        print(f"event loop lag:  mean {ms(statistics.fmean(lag.samples))}  p99 {ms(percentile(lag.samples, 0.99))}  max {ms(max(lag.samples))}")
+    print(f"panel requests:  {dict(sorted(panel.requests.items()))}")
+
+
+async def run(args: argparse.Namespace) -> None:
+    import db_manager
+    import server_registry
+    import vpn_connector
+    import drivers
+    import bot_handlers
+    from benchmarks.fake_panel import FakePanel
+    from benchmarks.telegram_driver import TelegramDriver
+
+    server_registry.load()
+    if args.max_per_inbound:
+        # Шардирование: порог клиентов и свободные порты для копий основного инбаунда
+        secrets.XUI_MAX_CLIENTS_PER_INBOUND = args.max_per_inbound
+        server_registry._snapshot = server_registry.build([
+            dict(server.raw, **{f"xui_{args.protocol}_spare_ports": [20000 + i for i in range(args.spare_ports)]})
+            for server in server_registry.all_servers()
+        ])
+    db_manager.init_db()
+    panel = FakePanel(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                      locked_rate=args.locked_rate, seed=args.seed, client_latency=args.client_latency)
+    await vpn_connector.set_transport(panel.transport())
+    if not args.cold:
+        # Как в post_init бота: логин и метаданные инбаундов до первого запроса
+        await vpn_connector.warm_up()
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+    succeeded = 0
+    lag = LoopLagMonitor()
+
+    if args.mode == "handlers":
+        driver = TelegramDriver(bot_handlers.register_handlers, with_rate_limiter=args.rate_limiter)
+        await driver.start()
+
+        async def one(user_id: int) -> None:
+            async with semaphore:
+                await driver.feed(driver.command_update(user_id, "start"))
+                # --taps > 1: пользователь несколько раз подряд нажимает ту же кнопку
+                taps = await asyncio.gather(*(
+                    driver.feed(driver.callback_update(user_id, f"get_key_{args.protocol}")) for _ in range(args.taps)
+                ))
+                latencies.append(max(taps))
+
+        lag.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(100_000 + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        await lag.stop()
+        await driver.stop()
+        print(f"bot api calls:   {dict(sorted(driver.bot_api.calls.items()))}")
+        with db_manager.get_db() as db:
+            succeeded = db.query(db_manager.Subscription).count()
+    else:
+        server = server_registry.first_for_protocol(args.protocol)
+
+        async def one(user_id: int) -> None:
+            nonlocal succeeded
+            async with semaphore:
+                started = time.perf_counter()
+                key_data, _ = await drivers.create_key(server.id, args.protocol, user_id, f"user{user_id}")
+                latencies.append(time.perf_counter() - started)
+                succeeded += 1 if key_data else 0
+
+        lag.start()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(100_000 + i) for i in range(args.users)))
+        elapsed = time.perf_counter() - started
+        await lag.stop()
+
+    await vpn_connector.close()
+    print(f"inbound clients: {({inbound_id: len(inbound['clients']) for inbound_id, inbound in panel.inbounds.items()})}")
+    _report(f"{args.mode}, {args.protocol}, {args.users} users, concurrency {args.concurrency}", latencies, succeeded, elapsed, lag, panel)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=["handlers", "connector"], default="handlers")
+    parser.add_argument("--protocol", choices=["vless", "shadowsocks"], default="vless")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.01, help="Задержка ответа панели, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке, с")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 500")
+    parser.add_argument("--locked-rate", type=float, default=0.0, help="Доля ответов 'database is locked'")
+    parser.add_argument("--client-latency", type=float, default=0.0, help="Добавка к задержке запроса инбаунда на каждого его клиента, с")
+    parser.add_argument("--max-per-inbound", type=int, default=0, help="XUI_MAX_CLIENTS_PER_INBOUND (0 — все клиенты в одном инбаунде)")
+    parser.add_argument("--spare-ports", type=int, default=0, help="Сколько портов для новых инбаундов дать серверу (с --max-per-inbound)")
+    parser.add_argument("--rate-limiter", action="store_true", help="Включить PriorityRateLimiter (handlers)")
+    parser.add_argument("--taps", type=int, default=1, help="Сколько раз каждый пользователь нажимает кнопку ключа (handlers)")
+    parser.add_argument("--cold", action="store_true", help="Не прогревать сессию панели перед прогоном")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as db_dir:
+        _prepare_environment(db_dir)
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
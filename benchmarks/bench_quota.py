@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Время проверки квот трафика на большом числе клиентов (имитация панели, временная база).
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_quota --users 50000
+
+Первая проверка пересчитывает всех, повторная без изменений трафика — никого,
+третья — только пользователей, у которых трафик изменился (часть из них превышает лимит).
+"""
+import argparse
+import asyncio
+import datetime
+import logging
+import random
+import tempfile
+import time
+import uuid
+
+import secrets
+
+from benchmarks.bench_load import _prepare_environment
+
+_GB = 1024 ** 3
+
+
+async def run(args: argparse.Namespace) -> None:
+    import db_manager
+    import quota
+    import server_registry
+    import vpn_connector
+    from benchmarks.fake_panel import FakePanel
+
+    server_registry.load()
+    db_manager.init_db()
+    server = server_registry.first_for_protocol("vless")
+    rng = random.Random(args.seed)
+    panel = FakePanel(latency=0)
+    expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=365)
+
+    clients = []
+    with db_manager.get_db() as db:
+        for user_id in range(1, args.users + 1):
+            email = f"tg_{user_id}_bench@bot.local"
+            db.add(db_manager.User(id=user_id, username=f"user{user_id}"))
+            db.add(db_manager.Subscription(user_id=user_id, server_id=server.id, protocol="vless", key_data="vless://bench",
+                                           key_identifier=email, expires_at=expires_at))
+            clients.append({"id": str(uuid.uuid4()), "email": email, "enable": True, "totalGB": args.limit_gb * _GB,
+                            "tgId": str(user_id), "flow": "xtls-rprx-vision"})
+            panel.set_traffic(server.vless.inbound_id, email, rng.randrange(0, args.limit_gb * _GB // 2), 0)
+        db.commit()
+    panel.add_clients(server.vless.inbound_id, clients)
+    await vpn_connector.set_transport(panel.transport())
+
+    async def sweep(title: str) -> None:
+        before = panel.requests.get("/panel/api/inbounds/updateClient/{}", 0)
+        started = time.perf_counter()
+        notifications = await quota.run_sweep()
+        elapsed = time.perf_counter() - started
+        updated = panel.requests.get("/panel/api/inbounds/updateClient/{}", 0) - before
+        print(f"{title:<34} {elapsed:6.2f}s  notifications {len(notifications):>6}  panel updates {updated:>5}")
+
+    print(f"== quota sweep: {args.users} clients, limit {args.limit_gb} GB ==")
+    await sweep("first sweep (all users)")
+    await sweep("no traffic changes")
+    changed = rng.sample(range(1, args.users + 1), max(1, int(args.users * args.changed)))
+    for n, user_id in enumerate(changed):
+        # Каждый десятый из изменившихся выходит за лимит
+        used = args.limit_gb * _GB + 1 if n % 10 == 0 else rng.randrange(0, args.limit_gb * _GB)
+        panel.set_traffic(server.vless.inbound_id, f"tg_{user_id}_bench@bot.local", used, 0)
+    await sweep(f"{len(changed)} users changed")
+    await vpn_connector.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--limit-gb", type=int, default=10)
+    parser.add_argument("--changed", type=float, default=0.01, help="Доля пользователей с изменившимся трафиком")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as db_dir:
+        _prepare_environment(db_dir)
+        secrets.DEFAULT_TRAFFIC_LIMIT_GB = args.limit_gb
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""Прогон PriorityRateLimiter против FakeBotApiRequest.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_rate_limiter --broadcast 300 --interactive 20
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from telegram.ext import ExtBot
+
+import rate_limiter
+from benchmarks.fake_bot_api import FakeBotApiRequest
+
+
+async def run(broadcast: int, interactive: int) -> None:
+    fake_api = FakeBotApiRequest()
+    bot = ExtBot(token="123:fake", request=fake_api, get_updates_request=FakeBotApiRequest(), rate_limiter=rate_limiter.PriorityRateLimiter())
+    await bot.initialize()
+
+    async def background(chat_id: int) -> None:
+        await bot.send_message(chat_id=chat_id, text="broadcast", rate_limit_args={"priority": rate_limiter.PRIORITY_BACKGROUND})
+
+    interactive_latencies = []
+
+    async def reply(chat_id: int) -> None:
+        started = time.perf_counter()
+        await bot.send_message(chat_id=chat_id, text="reply")
+        interactive_latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    tasks = [asyncio.create_task(background(100_000 + i)) for i in range(broadcast)]
+    for i in range(interactive):
+        await asyncio.sleep(0.25)
+        tasks.append(asyncio.create_task(reply(1 + i)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    await bot.shutdown()
+
+    sent = len(fake_api.sent_log)
+    print(f"Sent {sent} messages in {elapsed:.2f}s ({sent / elapsed:.1f} msg/s), 429 responses: {sum(fake_api.rejected.values())}")
+    if interactive_latencies:
+        print(f"Interactive latency: median {statistics.median(interactive_latencies) * 1000:.0f} ms, max {max(interactive_latencies) * 1000:.0f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--broadcast", type=int, default=300)
+    parser.add_argument("--interactive", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(run(args.broadcast, args.interactive))
+
+
+if __name__ == "__main__":
+    main()
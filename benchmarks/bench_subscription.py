@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Пропускная способность эндпоинта ссылок-подписок.
+
+Сервер запускается в отдельном процессе (одно ядро) на временной базе с заранее
+созданными пользователями и ключами, генератор нагрузки держит keep-alive соединения
+и запрашивает случайные подписки, часть — с If-None-Match.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_subscription --users 1000 --connections 50 --duration 5
+"""
+import argparse
+import asyncio
+import datetime
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+import secrets
+
+
+def _prepare_environment(db_dir: str) -> None:
+    secrets.DATABASE_URL = f"sqlite:///{os.path.join(db_dir, 'bench.db')}"
+    secrets.SUBSCRIPTION_PUBLIC_URL = "http://127.0.0.1"
+    secrets.SUBSCRIPTION_HOST = "127.0.0.1"
+
+
+def _seed(users: int, keys_per_user: int) -> list[str]:
+    import db_manager
+    db_manager.init_db()
+    tokens = []
+    expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=365)
+    with db_manager.get_db() as db:
+        for user_id in range(1, users + 1):
+            db.add(db_manager.User(id=user_id, username=f"user{user_id}"))
+            for n in range(keys_per_user):
+                db.add(db_manager.Subscription(
+                    user_id=user_id, server_id=1, protocol="vless", key_identifier=f"tg_{user_id}_{n}@bot.local",
+                    key_data=f"vless://{user_id:08d}-0000-4000-8000-{n:012d}@255.255.255.255:443?type=tcp&security=reality#tg_{user_id}_{n}",
+                    expires_at=expires_at,
+                ))
+        db.commit()
+        for user_id in range(1, users + 1):
+            tokens.append(db_manager.get_or_create_sub_token(db, user_id))
+    return tokens
+
+
+def _serve(db_dir: str, port: int, ready) -> None:
+    _prepare_environment(db_dir)
+    secrets.SUBSCRIPTION_PORT = port
+    import subscription_links
+
+    async def main() -> None:
+        await subscription_links.start_server()
+        ready.set()
+        await asyncio.Event().wait()
+
+    asyncio.run(main())
+
+
+async def _client(port: int, tokens: list[str], etags: dict, conditional: float, deadline: float, rng: random.Random, stats: dict) -> None:
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        while time.perf_counter() < deadline:
+            token = rng.choice(tokens)
+            request = f"GET /sub/{token} HTTP/1.1\r\nHost: bench\r\n"
+            if token in etags and rng.random() < conditional:
+                request += f"If-None-Match: {etags[token]}\r\n"
+            writer.write((request + "\r\n").encode())
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("latin-1").split("\r\n")
+            status = int(lines[0].split(" ")[1])
+            headers = {name.lower(): value.strip() for name, _, value in (line.partition(":") for line in lines[1:] if line)}
+            if "content-length" in headers:
+                await reader.readexactly(int(headers["content-length"]))
+            if "etag" in headers:
+                etags[token] = headers["etag"]
+            stats[status] = stats.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def _load(port: int, tokens: list[str], args: argparse.Namespace) -> None:
+    etags: dict[str, str] = {}
+    stats: dict[int, int] = {}
+    rng = random.Random(args.seed)
+    deadline = time.perf_counter() + args.duration
+    started = time.perf_counter()
+    await asyncio.gather(*(_client(port, tokens, etags, args.conditional, deadline, rng, stats) for _ in range(args.connections)))
+    elapsed = time.perf_counter() - started
+    total = sum(stats.values())
+    print(f"== subscription endpoint: {args.users} users, {args.connections} connections ==")
+    print(f"requests:  {total} in {elapsed:.2f}s -> {total / elapsed:.0f} req/s")
+    print(f"statuses:  {dict(sorted(stats.items()))}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--keys-per-user", type=int, default=3)
+    parser.add_argument("--connections", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--conditional", type=float, default=0.9, help="Доля запросов с If-None-Match")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        _prepare_environment(db_dir)
+        tokens = _seed(args.users, args.keys_per_user)
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(target=_serve, args=(db_dir, args.port, ready), daemon=True)
+        server.start()
+        try:
+            if not ready.wait(30):
+                raise SystemExit("Subscription server did not start.")
+            asyncio.run(_load(args.port, tokens, args))
+        finally:
+            server.terminate()
+            server.join()
+
+
+if __name__ == "__main__":
+    main()
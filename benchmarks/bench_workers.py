@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Выдача ключей в режиме нескольких воркеров (python main.py --workers N) на общей базе.
+
+Запуск из корня репозитория (сеть не нужна, база SQLite создаётся во временном каталоге):
+    python -m benchmarks.bench_workers --workers 1 2 4 --users 400 --latency 0.02
+    python -m benchmarks.bench_workers --workers 1 4 --database-url postgresql://bench@localhost/bench
+
+Для каждого числа воркеров запускается workers.WorkerPool; у каждого воркера своя имитация
+панели и Bot API. Главный процесс, как workers.run, раскладывает по очередям воркеров /start
+и нажатие «Получить ключ» каждого пользователя и ждёт, пока в базе появятся все ключи.
+Воркер, как и бот, обрабатывает обновления по одному, поэтому пропускная способность
+растёт с числом воркеров, пока её не ограничит база.
+"""
+import argparse
+import functools
+import logging
+import os
+import tempfile
+import time
+
+import secrets
+from benchmarks.bench_load import _prepare_environment
+
+
+def _configure_worker_environment(db_dir: str, database_url: str | None) -> None:
+    _prepare_environment(db_dir)
+    if database_url:
+        secrets.DATABASE_URL = database_url
+    # Лимиты Bot API сняты: измеряем сам бот, а не ограничения Telegram
+    secrets.BOT_API_MESSAGES_PER_SECOND = 10**9
+    secrets.BOT_API_PRIVATE_CHAT_MESSAGES_PER_SECOND = 10**9
+    secrets.SUBSCRIPTION_PUBLIC_URL = None
+    secrets.HEALTH_PORT = None
+
+
+async def _setup(latency: float):
+    from telegram.ext import ApplicationBuilder
+    import vpn_connector
+    from benchmarks.fake_bot_api import FakeBotApiRequest
+    from benchmarks.fake_panel import FakePanel
+
+    await vpn_connector.set_transport(FakePanel(latency=latency).transport())
+    return (ApplicationBuilder()
+            .request(FakeBotApiRequest(overall_limit=10**9, per_chat_limit=10**9))
+            .get_updates_request(FakeBotApiRequest()))
+
+
+def _worker(index: int, count: int, queue, ready, db_dir: str, database_url: str | None, latency: float, verbose: bool) -> None:
+    # Логи воркеров (vpn_bot.log) — во временный каталог
+    os.chdir(db_dir)
+    _configure_worker_environment(db_dir, database_url)
+    import main  # noqa: F401 — настраивает логирование, как у бота
+    import workers
+    logging.getLogger().setLevel(logging.INFO if verbose else logging.WARNING)
+    workers.worker_main(index, count, queue, ready, functools.partial(_setup, latency))
+
+
+def _clear_database() -> None:
+    import db_manager
+    with db_manager.engine.begin() as conn:
+        for table in reversed(db_manager.Base.metadata.sorted_tables):
+            if table.name != db_manager.Server.__tablename__:
+                conn.execute(table.delete())
+
+
+def _count_keys() -> int:
+    import db_manager
+    with db_manager.get_db() as db:
+        return db.query(db_manager.Subscription).count()
+
+
+def run_once(args: argparse.Namespace, count: int, db_dir: str) -> float:
+    import workers
+    from benchmarks.telegram_driver import callback_update_data, command_update_data
+
+    _clear_database()
+    pool = workers.WorkerPool(count, target=_worker, args=(db_dir, args.database_url, args.latency, args.verbose))
+    pool.start()
+    try:
+        if not pool.wait_ready(120):
+            raise RuntimeError("workers did not start in 120 s")
+        started = time.perf_counter()
+        update_ids = iter(range(1, 2 * args.users + 1))
+        for i in range(args.users):
+            user_id = 100_000 + i
+            pool.put(user_id, command_update_data(next(update_ids), user_id, "start"))
+            pool.put(user_id, callback_update_data(next(update_ids), user_id, f"get_key_{args.protocol}"))
+        issued = 0
+        deadline = started + args.timeout
+        while time.perf_counter() < deadline:
+            issued = _count_keys()
+            if issued >= args.users:
+                break
+            time.sleep(0.02)
+        elapsed = time.perf_counter() - started
+    finally:
+        pool.stop(60)
+    print(f"{count} worker(s): {issued}/{args.users} keys in {elapsed:.2f}s -> {issued / elapsed:.1f} keys/s")
+    return issued / elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Числа воркеров для прогонов")
+    parser.add_argument("--protocol", choices=["vless", "shadowsocks"], default="vless")
+    parser.add_argument("--users", type=int, default=400)
+    parser.add_argument("--latency", type=float, default=0.02, help="Задержка ответа панели, с")
+    parser.add_argument("--database-url", default=None, help="Общая база воркеров (по умолчанию SQLite во временном каталоге)")
+    parser.add_argument("--timeout", type=float, default=300, help="Сколько ждать выдачи всех ключей в одном прогоне, с")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.CRITICAL)
+    with tempfile.TemporaryDirectory() as db_dir:
+        _configure_worker_environment(db_dir, args.database_url)
+        import db_manager
+        import server_registry
+        server_registry.load()
+        # Схему создаёт главный процесс, как в main.py до запуска воркеров
+        db_manager.init_db()
+        results = {count: run_once(args, count, db_dir) for count in args.workers}
+
+    base_count = args.workers[0]
+    print("== scaling ==")
+    for count, rate in results.items():
+        print(f"{count} worker(s): {rate:.1f} keys/s, x{rate / results[base_count]:.2f} vs {base_count}")
+
+
+if __name__ == "__main__":
+    main()
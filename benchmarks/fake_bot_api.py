@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""Локальная имитация Bot API для проверок без Telegram.
+
+FakeBotApiRequest подключается к боту вместо HTTP-транспорта
+(``ApplicationBuilder().request(...)``) и, как настоящий Telegram, отвечает 429 с
+``retry_after`` при превышении общего лимита или лимита на чат.
+"""
+import asyncio
+import collections
+import itertools
+import json
+import time
+
+from telegram.request import BaseRequest, RequestData
+
+_UNLIMITED_METHODS = frozenset({"answerCallbackQuery", "getMe", "getUpdates", "deleteWebhook", "close", "logOut"})
+
+
+class FakeBotApiRequest(BaseRequest):
+
+    def __init__(self, overall_limit: int = 30, per_chat_limit: int = 1, window: float = 1.0, latency: float = 0.0, retry_after: int = 1):
+        self.overall_limit = overall_limit
+        self.per_chat_limit = per_chat_limit
+        self.window = window
+        self.latency = latency
+        self.retry_after = retry_after
+        self.calls = collections.Counter()
+        self.rejected = collections.Counter()
+        self.sent_log: list[tuple[float, str, object]] = []
+        self.blocked_chats: set[int] = set()
+        self._overall_hits: collections.deque[float] = collections.deque()
+        self._chat_hits: dict[object, collections.deque[float]] = collections.defaultdict(collections.deque)
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self) -> float | None:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    def _over_limit(self, hits: collections.deque, limit: int, now: float) -> bool:
+        while hits and now - hits[0] >= self.window:
+            hits.popleft()
+        return len(hits) >= limit
+
+    @staticmethod
+    def _reply(code: int, payload: dict) -> tuple[int, bytes]:
+        return code, json.dumps(payload).encode("utf-8")
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: RequestData | None = None,
+        read_timeout=BaseRequest.DEFAULT_NONE,
+        write_timeout=BaseRequest.DEFAULT_NONE,
+        connect_timeout=BaseRequest.DEFAULT_NONE,
+        pool_timeout=BaseRequest.DEFAULT_NONE,
+    ) -> tuple[int, bytes]:
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        chat_id = params.get("chat_id")
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        now = time.monotonic()
+        if api_method not in _UNLIMITED_METHODS and chat_id is not None:
+            chat_hits = self._chat_hits[chat_id]
+            if self._over_limit(self._overall_hits, self.overall_limit, now) or self._over_limit(chat_hits, self.per_chat_limit, now):
+                self.rejected[api_method] += 1
+                return self._reply(429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                })
+            self._overall_hits.append(now)
+            chat_hits.append(now)
+            if int(chat_id) in self.blocked_chats:
+                return self._reply(403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"})
+            self.sent_log.append((now, api_method, chat_id))
+
+        return self._reply(200, {"ok": True, "result": self._result(api_method, params)})
+
+    def _result(self, api_method: str, params: dict) -> object:
+        if api_method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot",
+                    "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+        if api_method in ("sendMessage", "editMessageText", "sendDocument"):
+            chat_id = params.get("chat_id", 0)
+            return {
+                "message_id": params.get("message_id") or next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private" if int(chat_id) > 0 else "group"},
+                "text": params.get("text", ""),
+            }
+        if api_method == "getUpdates":
+            return []
+        return True
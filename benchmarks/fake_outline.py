@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Локальная имитация management API Outline Server для прогонов без сети.
+
+Подключается к драйверу через ``await drivers.get("outline").set_transport(outline.transport())``.
+"""
+import asyncio
+import json
+import re
+
+import httpx
+
+_KEY_PATH = re.compile(r"/access-keys/(\d+)$")
+_DATA_LIMIT_PATH = re.compile(r"/access-keys/(\d+)/data-limit$")
+
+
+class FakeOutline:
+
+    def __init__(self, latency: float = 0.005):
+        self.latency = latency
+        self.keys: dict[str, dict] = {}
+        self.transfer: dict[str, int] = {}
+        self.requests: dict[str, int] = {}
+        self._next_id = 0
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        route = f"{request.method} " + re.sub(r"/\d+(?=/|$)", "/{}", path)
+        self.requests[route] = self.requests.get(route, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if request.method == "POST" and path.endswith("/access-keys"):
+            key_id = str(self._next_id)
+            self._next_id += 1
+            name = json.loads(request.content or b"{}").get("name", "")
+            self.keys[key_id] = {"id": key_id, "name": name, "password": f"pw{key_id}", "port": 12345, "method": "chacha20-ietf-poly1305",
+                                 "accessUrl": f"ss://Y2hhY2hhMjAtaWV0Zi1wb2x5MTMwNTpwdw@127.0.0.1:12345/?outline=1#{key_id}"}
+            return httpx.Response(201, json=self.keys[key_id])
+
+        match = _DATA_LIMIT_PATH.search(path)
+        if match and request.method == "PUT":
+            if match.group(1) not in self.keys:
+                return httpx.Response(404)
+            self.keys[match.group(1)]["dataLimit"] = json.loads(request.content)["limit"]
+            return httpx.Response(204)
+
+        match = _KEY_PATH.search(path)
+        if match and request.method == "DELETE":
+            if self.keys.pop(match.group(1), None) is None:
+                return httpx.Response(404)
+            return httpx.Response(204)
+
+        if path.endswith("/metrics/transfer"):
+            return httpx.Response(200, json={"bytesTransferredByUserId": self.transfer})
+        if path.endswith("/server"):
+            return httpx.Response(200, json={"name": "fake-outline", "serverId": "fake"})
+        return httpx.Response(404)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""Локальная имитация API панели 3x-ui для нагрузочных прогонов без сети.
+
+FakePanel подключается к vpn_connector через ``vpn_connector.set_transport(panel.transport())``
+и хранит клиентов инбаундов в памяти. Задержку ответа, долю ошибок 500 и ответов
+"database is locked" можно настраивать; client_latency добавляет к запросам инбаунда задержку
+на каждого его клиента (панель переписывает и разбирает JSON со всеми клиентами).
+"""
+import asyncio
+import json
+import random
+import re
+
+import httpx
+
+_INBOUND_PATH = re.compile(r"/panel/api/inbounds/get/(\d+)$")
+_DEL_CLIENT_PATH = re.compile(r"/panel/api/inbounds/(\d+)/delClient/(.+)$")
+_TRAFFIC_PATH = re.compile(r"/panel/api/inbounds/getClientTraffics/(.+)$")
+_UPDATE_CLIENT_PATH = re.compile(r"/panel/api/inbounds/updateClient/(.+)$")
+
+
+class FakePanel:
+
+    def __init__(self, inbounds: dict[int, dict] | None = None, latency: float = 0.005, jitter: float = 0.0,
+                 error_rate: float = 0.0, locked_rate: float = 0.0, seed: int | None = None, client_latency: float = 0.0):
+        # inbound_id -> {"port": ..., "protocol": ...}
+        inbounds = inbounds or {1: {"port": 443, "protocol": "vless"}, 2: {"port": 8388, "protocol": "shadowsocks"}}
+        self.inbounds = {
+            inbound_id: {"port": meta["port"], "protocol": meta["protocol"], "clients": {}, "traffic": {}}
+            for inbound_id, meta in inbounds.items()
+        }
+        self.latency = latency
+        self.client_latency = client_latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.locked_rate = locked_rate
+        self.random = random.Random(seed)
+        self.requests: dict[str, int] = {}
+        self.logins = 0
+
+    def transport(self) -> httpx.MockTransport:
+        return httpx.MockTransport(self.handle)
+
+    def add_clients(self, inbound_id: int, clients: list[dict]) -> None:
+        for client in clients:
+            self.inbounds[inbound_id]["clients"][client["email"]] = client
+
+    def set_traffic(self, inbound_id: int, email: str, up: int, down: int) -> None:
+        self.inbounds[inbound_id]["traffic"][email] = (up, down)
+
+    @staticmethod
+    def _ok(obj=None, msg: str = "") -> httpx.Response:
+        return httpx.Response(200, json={"success": True, "msg": msg, "obj": obj})
+
+    @staticmethod
+    def _fail(msg: str) -> httpx.Response:
+        return httpx.Response(200, json={"success": False, "msg": msg, "obj": None})
+
+    def _inbound_obj(self, inbound_id: int) -> dict:
+        inbound = self.inbounds[inbound_id]
+        clients = list(inbound["clients"].values())
+        return {
+            "id": inbound_id,
+            "port": inbound["port"],
+            "protocol": inbound["protocol"],
+            "remark": f"inbound-{inbound_id}",
+            "enable": True,
+            "settings": json.dumps({"clients": clients, "decryption": "none"}),
+            "clientStats": [self._traffic(inbound_id, client["email"]) for client in clients],
+        }
+
+    def _traffic(self, inbound_id: int, email: str) -> dict:
+        client = self.inbounds[inbound_id]["clients"].get(email, {})
+        up, down = self.inbounds[inbound_id]["traffic"].get(email, (0, 0))
+        return {"inboundId": inbound_id, "email": email, "enable": client.get("enable", True),
+                "up": up, "down": down, "total": client.get("totalGB", 0), "expiryTime": 0}
+
+    def _target_clients(self, request: httpx.Request) -> dict:
+        """Клиенты инбаунда, к которому относится запрос (пусто, если инбаунд не определить)."""
+        match = _INBOUND_PATH.search(request.url.path) or _DEL_CLIENT_PATH.search(request.url.path)
+        if match:
+            inbound_id = int(match.group(1))
+        elif request.url.path.endswith("/addClient") or _UPDATE_CLIENT_PATH.search(request.url.path):
+            inbound_id = int(json.loads(request.content).get("id", 0))
+        else:
+            return {}
+        return self.inbounds.get(inbound_id, {}).get("clients", {})
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        route = re.sub(r"/(delClient|getClientTraffics|updateClient)/.+$", r"/\1/{}", re.sub(r"/\d+(?=/|$)", "/{}", path))
+        self.requests[route] = self.requests.get(route, 0) + 1
+
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if self.client_latency:
+            delay += self.client_latency * len(self._target_clients(request))
+        if delay:
+            await asyncio.sleep(delay)
+
+        if path.endswith("/login"):
+            self.logins += 1
+            return httpx.Response(200, json={"success": True, "msg": "Login successfully", "obj": None},
+                                  headers={"set-cookie": "3x-ui=fake-session; Path=/; Max-Age=3600"})
+        if "3x-ui=fake-session" not in request.headers.get("cookie", ""):
+            return httpx.Response(401, text="unauthorized")
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            return httpx.Response(500, text="internal error")
+        if self.locked_rate and self.random.random() < self.locked_rate:
+            return self._fail("database is locked")
+
+        if path.endswith("/panel/inbound/addClient"):
+            body = json.loads(request.content)
+            inbound = self.inbounds.get(int(body["id"]))
+            if inbound is None:
+                return self._fail("Inbound not found")
+            new_clients = json.loads(body["settings"])["clients"]
+            for client in new_clients:
+                if client["email"] in inbound["clients"]:
+                    return self._fail(f"Something went wrong! Failed: Duplicate email: {client['email']}")
+            for client in new_clients:
+                inbound["clients"][client["email"]] = client
+            return self._ok(msg="Client(s) added Successfully")
+
+        match = _INBOUND_PATH.search(path)
+        if match:
+            inbound_id = int(match.group(1))
+            if inbound_id not in self.inbounds:
+                return self._fail("Inbound not found")
+            return self._ok(self._inbound_obj(inbound_id))
+
+        if path.endswith("/panel/api/inbounds/add"):
+            body = json.loads(request.content)
+            if any(inbound["port"] == body["port"] for inbound in self.inbounds.values()):
+                return self._fail(f"Port already exists: {body['port']}")
+            inbound_id = max(self.inbounds, default=0) + 1
+            self.inbounds[inbound_id] = {"port": body["port"], "protocol": body["protocol"], "clients": {}, "traffic": {}}
+            for client in json.loads(body.get("settings") or "{}").get("clients", []):
+                self.inbounds[inbound_id]["clients"][client["email"]] = client
+            return self._ok(dict(self._inbound_obj(inbound_id), remark=body.get("remark")), msg="Create Successfully")
+
+        if path.endswith("/panel/api/inbounds/list"):
+            return self._ok([self._inbound_obj(inbound_id) for inbound_id in self.inbounds])
+
+        match = _DEL_CLIENT_PATH.search(path)
+        if match:
+            inbound = self.inbounds.get(int(match.group(1)))
+            client_key = match.group(2)
+            if inbound is None:
+                return self._fail("Inbound not found")
+            for email, client in list(inbound["clients"].items()):
+                if client_key in (email, client.get("id")):
+                    del inbound["clients"][email]
+                    inbound["traffic"].pop(email, None)
+                    return self._ok(msg="Client deleted Successfully")
+            return self._fail("Client Not Found")
+
+        match = _UPDATE_CLIENT_PATH.search(path)
+        if match:
+            body = json.loads(request.content)
+            inbound = self.inbounds.get(int(body["id"]))
+            if inbound is None:
+                return self._fail("Inbound not found")
+            client_key = match.group(1)
+            updated = json.loads(body["settings"])["clients"][0]
+            client = inbound["clients"].get(updated["email"])
+            if client is None or client_key not in (updated["email"], client.get("id")):
+                return self._fail("Client Not Found")
+            inbound["clients"][updated["email"]] = updated
+            return self._ok(msg="Client updated Successfully")
+
+        match = _TRAFFIC_PATH.search(path)
+        if match:
+            email = match.group(1)
+            for inbound_id, inbound in self.inbounds.items():
+                if email in inbound["clients"]:
+                    return self._ok(self._traffic(inbound_id, email))
+            return self._ok(None)
+
+        return httpx.Response(404, text="not found")
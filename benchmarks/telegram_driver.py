@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""Синтетические обновления Telegram для прогона обработчиков бота без сети."""
+import asyncio
+import itertools
+import time
+
+from telegram import Update
+from telegram.ext import Application, ApplicationBuilder, Defaults
+from telegram.constants import ParseMode
+
+import lifecycle
+import rate_limiter
+from benchmarks.fake_bot_api import FakeBotApiRequest
+
+FAKE_TOKEN = "123456:" + "A" * 35
+
+
+def callback_update_data(update_id: int, user_id: int, data: str) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user,
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "menu",
+            },
+        },
+    }
+
+
+def command_update_data(update_id: int, user_id: int, command: str) -> dict:
+    text = f"/{command}"
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}],
+        },
+    }
+
+
+class _TrackedApplication(lifecycle.BotApplication):
+    """BotApplication, который сообщает драйверу, что обработка обновления закончилась."""
+
+    async def process_update(self, update: object) -> None:
+        try:
+            await super().process_update(update)
+        finally:
+            waiter = self.processed.pop(update.update_id, None)
+            if waiter is not None and not waiter.done():
+                waiter.set_result(None)
+
+
+class TelegramDriver:
+    """Собирает Application с имитацией Bot API и подаёт в него сгенерированные обновления.
+
+    Обновления идут через update_queue и обработчик обновлений, как при polling. concurrent_updates
+    не задаётся, как и в main.build_application, поэтому обновления обрабатываются по одному.
+    """
+
+    def __init__(self, register, with_rate_limiter: bool = False, bot_api: FakeBotApiRequest | None = None):
+        # Лимиты имитации по умолчанию сняты: измеряем сам бот, а не ограничения Telegram
+        self.bot_api = bot_api or FakeBotApiRequest(overall_limit=10**9, per_chat_limit=10**9)
+        builder = (
+            ApplicationBuilder()
+            .application_class(_TrackedApplication)
+            .token(FAKE_TOKEN)
+            .request(self.bot_api)
+            .get_updates_request(FakeBotApiRequest())
+            .defaults(Defaults(parse_mode=ParseMode.MARKDOWN))
+            .updater(None)
+        )
+        if with_rate_limiter:
+            builder = builder.rate_limiter(rate_limiter.PriorityRateLimiter())
+        self.application: Application = builder.build()
+        # update_id -> future, которую _TrackedApplication завершает после обработки
+        self.application.processed = {}
+        register(self.application)
+        self._update_ids = itertools.count(1)
+
+    async def start(self) -> None:
+        await self.application.initialize()
+        await self.application.start()
+
+    async def stop(self) -> None:
+        await self.application.stop()
+        await self.application.shutdown()
+
+    def callback_update(self, user_id: int, data: str) -> Update:
+        return Update.de_json(callback_update_data(next(self._update_ids), user_id, data), self.application.bot)
+
+    def command_update(self, user_id: int, command: str) -> Update:
+        return Update.de_json(command_update_data(next(self._update_ids), user_id, command), self.application.bot)
+
+    async def feed(self, update: Update) -> float:
+        """Кладёт обновление в update_queue и ждёт конца его обработки. Возвращает время
+        в секундах, включая ожидание в очереди, — как его видит пользователь."""
+        waiter = asyncio.get_running_loop().create_future()
+        self.application.processed[update.update_id] = waiter
+        started = time.perf_counter()
+        await self.application.update_queue.put(update)
+        await waiter
+        return time.perf_counter() - started
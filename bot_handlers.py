@@ -11,9 +11,17 @@ from telegram.ext import (
     Application
 )
 from sqlalchemy.orm import Session # pylint: disable=unused-import
+import config
 import keyboards
 import db_manager
-import vpn_connector
+import drivers
+import key_counts
+import rate_limiter
+import server_registry
+import subscription_links
+import quota
+import coalescing
+import lifecycle
 import os 
 import telegram.helpers
 
@@ -24,7 +32,11 @@ async def notify_admin(message: str, context: ContextTypes.DEFAULT_TYPE) -> None
     """Отправляет сообщение администратору."""
     if secrets.ADMIN_USER_ID != 0:
         try:
-            await context.bot.send_message(chat_id=secrets.ADMIN_USER_ID, text=f"⚠️ Бот-уведомление:\n{message}")
+            await context.bot.send_message(
+                chat_id=secrets.ADMIN_USER_ID,
+                text=f"⚠️ Бот-уведомление:\n{message}",
+                rate_limit_args={"priority": rate_limiter.PRIORITY_NOTIFICATION}
+            )
             logger.info("Admin notified.")
         except Exception as e:
             logger.error(f"Failed to notify admin ({secrets.ADMIN_USER_ID}): {e}")
@@ -40,7 +52,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     
     if update.callback_query:
         await update.callback_query.answer()
-        await update.callback_query.edit_message_text(secrets.WELCOME_MESSAGE, reply_markup=reply_markup)
+        await coalescing.edit_message(update.callback_query, secrets.WELCOME_MESSAGE, reply_markup=reply_markup)
     else: 
         await update.message.reply_text(secrets.WELCOME_MESSAGE, reply_markup=reply_markup)
 
@@ -50,7 +62,8 @@ async def choose_protocol_for_key(update: Update, context: ContextTypes.DEFAULT_
     await query.answer()
     
     keyboard = keyboards.protocol_selection_keyboard()
-    await query.edit_message_text(
+    await coalescing.edit_message(
+        query,
         "Выберите протокол для нового ключа:",
         reply_markup=keyboard
     )
@@ -66,73 +79,87 @@ async def handle_get_key_protocol_selected(update: Update, context: ContextTypes
     logger.info(f"User {user_id} ({user_username}) requests a new {protocol} key.")
     
     with db_manager.get_db() as db:
-        keys_count = db_manager.count_user_keys(db, user_id)
+        keys_count = key_counts.total(db, user_id)
+        traffic_limit_gb = quota.limit_gb_for_user(db_manager.get_user(db, user_id))
+        traffic_usage = db_manager.get_traffic_usage(db, user_id)
+
+    if traffic_usage and traffic_usage.quota_disabled:
+        logger.warning(f"User {user_id} has exhausted the traffic quota, refusing a new key.")
+        await coalescing.edit_message(
+            query,
+            secrets.QUOTA_BLOCKED_KEY_MESSAGE,
+            reply_markup=keyboards.back_to_menu_keyboard()
+        )
+        return
     
-    if keys_count >= secrets.MAX_KEYS_PER_USER:
+    if keys_count >= config.get_settings().max_keys_per_user:
         logger.warning(f"User {user_id} has reached the key limit ({keys_count} keys).")
-        await query.edit_message_text(
+        await coalescing.edit_message(
+            query,
             secrets.KEY_LIMIT_REACHED_MESSAGE,
             reply_markup=keyboards.back_to_menu_keyboard()
         )
         return
         
-    await query.edit_message_text(f"⏳ Генерирую ваш {protocol.upper()} ключ, пожалуйста, подождите...")
+    await coalescing.edit_message(query, f"⏳ Генерирую ваш {protocol.upper()} ключ, пожалуйста, подождите...")
     
-    server_config = None
-    for s_conf in secrets.SERVERS:
-        if protocol == "vless" and "xui_vless_inbound_id" in s_conf:
-            server_config = s_conf
-            break
-        elif protocol == "shadowsocks" and "xui_shadowsocks_inbound_id" in s_conf:
-            server_config = s_conf
-            break
+    driver = drivers.get(protocol)
+    server = server_registry.first_for_protocol(protocol)
             
-    if not server_config:
+    if not server or driver is None:
         logger.error(f"No suitable server found for protocol {protocol}.")
         await notify_admin(f"Не найден сервер для протокола {protocol} при генерации ключа для пользователя {user_id}.", context)
-        await query.edit_message_text(
+        await coalescing.edit_message(
+            query,
             secrets.KEY_GENERATION_ERROR,
             reply_markup=keyboards.back_to_menu_keyboard()
         )
         return
 
     try:
-        server_id = server_config['id']
+        server_id = server.id
     
-        key_data, key_identifier = await vpn_connector.create_key(
-            server_id=server_id,
-            protocol=protocol, 
-            user_telegram_id=user_id,
-            user_username=user_username 
-        )
-        
-        if not key_data or not key_identifier:
-            logger.error(f"Failed to create {protocol} key for user {user_id}. vpn_connector returned None.")
-            await notify_admin(f"Ошибка генерации {protocol.upper()} ключа для пользователя {user_id}. Подробности:\n{secrets.KEY_GENERATION_ERROR}", context) 
-            await query.edit_message_text(
-                secrets.KEY_GENERATION_ERROR,
-                reply_markup=keyboards.back_to_menu_keyboard()
-            )
-            return
-            
-        expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=365 * 100) # Ключ действителен 100 лет
-        
-        with db_manager.get_db() as db:
-            db_manager.add_subscription(
-                db_session=db,
-                user_id=user_id,
+        # Ключ в панели и запись о нём в базе: остановка бота дожидается конца этой пары
+        async with lifecycle.in_flight("issuance"):
+            key_data, key_identifier = await drivers.create_key(
                 server_id=server_id,
                 protocol=protocol, 
-                key_data=key_data,
-                key_identifier=key_identifier,
-                expires_at=expires_at
+                user_telegram_id=user_id,
+                user_username=user_username,
+                # Лимит передаём, только если сервер протокола умеет его соблюдать
+                total_traffic_gb=(traffic_limit_gb or None) if driver.capabilities.traffic_limit else None
             )
-            keys_count += 1
         
-        keys_left = secrets.MAX_KEYS_PER_USER - keys_count
+            if not key_data or not key_identifier:
+                logger.error(f"Failed to create {protocol} key for user {user_id}. The {protocol} driver returned None.")
+                await notify_admin(f"Ошибка генерации {protocol.upper()} ключа для пользователя {user_id}. Подробности:\n{secrets.KEY_GENERATION_ERROR}", context) 
+                await coalescing.edit_message(
+                    query,
+                    secrets.KEY_GENERATION_ERROR,
+                    reply_markup=keyboards.back_to_menu_keyboard()
+                )
+                return
+            
+            expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=365 * 100) # Ключ действителен 100 лет
+        
+            with db_manager.get_db() as db:
+                db_manager.add_subscription(
+                    db_session=db,
+                    user_id=user_id,
+                    server_id=server_id,
+                    protocol=protocol, 
+                    key_data=key_data,
+                    key_identifier=key_identifier,
+                    expires_at=expires_at
+                )
+                # Счётчик, а не keys_count + 1: за время выдачи ключ мог появиться и из другого запроса
+                keys_count = key_counts.total(db, user_id)
+        
+        keys_left = config.get_settings().max_keys_per_user - keys_count
         success_message = secrets.KEY_SUCCESS_MESSAGE.format(key=key_data, keys_left=keys_left)
         
-        await query.edit_message_text(
+        await coalescing.edit_message(
+            query,
             success_message,
             reply_markup=keyboards.back_to_menu_keyboard(include_instructions=True), 
             parse_mode='Markdown' 
@@ -143,7 +170,8 @@ async def handle_get_key_protocol_selected(update: Update, context: ContextTypes
         error_message = f"Critical error in handle_get_key_protocol_selected for user {user_id} and protocol {protocol}: {e}"
         logger.error(error_message, exc_info=True)
         await notify_admin(f"{error_message}\n\nTraceback:\n{traceback.format_exc()}", context)
-        await query.edit_message_text(
+        await coalescing.edit_message(
+            query,
             secrets.GENERIC_ERROR,
             reply_markup=keyboards.back_to_menu_keyboard()
         )
@@ -156,11 +184,11 @@ async def handle_my_keys(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     user_id = update.effective_user.id
     logger.info(f"User {user_id} requests their key list.")
     
-    with db_manager.get_db() as db:
-        keys = db_manager.get_user_keys(db, user_id)
+    keys = await subscription_links.get_user_keys(user_id)
         
     if not keys:
-        await query.edit_message_text(
+        await coalescing.edit_message(
+            query,
             secrets.NO_KEYS_MESSAGE,
             reply_markup=keyboards.back_to_menu_keyboard()
         )
@@ -170,14 +198,20 @@ async def handle_my_keys(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     for i, key in enumerate(keys, 1):
         created_date = key.created_at.strftime("%Y-%m-%d")
         
-        server_info = next((s for s in secrets.SERVERS if s["id"] == key.server_id), None)
-        server_name = server_info["name"] if server_info else "Неизвестный сервер"
-        server_region = server_info["region"] if server_info and "region" in server_info else "Неизвестный регион"
+        server_info = server_registry.get(key.server_id)
+        server_name = server_info.name if server_info else "Неизвестный сервер"
+        server_region = server_info.region if server_info else "Неизвестный регион"
         message_text += f"**{i}. Протокол: {key.protocol.upper()} ({server_name} - {server_region})**\n" 
         message_text += f"**ID в панели (Email):** `{key.key_identifier}`\n" 
         message_text += f"**Ключ от {created_date}**:\n`{key.key_data}`\n\n"
+
+    if subscription_links.is_enabled():
+        token = await subscription_links.get_or_create_token(user_id)
+        if token:
+            message_text += secrets.SUBSCRIPTION_LINK_MESSAGE.format(url=subscription_links.subscription_url(token))
         
-    await query.edit_message_text(
+    await coalescing.edit_message(
+        query,
         message_text,
         reply_markup=keyboards.back_to_menu_keyboard(),
         parse_mode='Markdown' 
@@ -189,7 +223,8 @@ async def handle_instructions(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     instructions_message = f"🔗 **Инструкция по подключению:**\n\nПожалуйста, ознакомьтесь с подробными шагами по настройке VPN на вашем устройстве, перейдя по ссылке:\n\n[Подробная инструкция]({secrets.INSTRUCTION_LINK})\n\n"
     
-    await query.edit_message_text(
+    await coalescing.edit_message(
+        query,
         instructions_message,
         reply_markup=keyboards.back_to_menu_keyboard(),
         parse_mode='Markdown'
@@ -212,7 +247,8 @@ async def handle_contact_admin(update: Update, context: ContextTypes.DEFAULT_TYP
     else:
         contact_message = "👨‍💻 **Связь с администратором:**\n\nК сожалению, контакт администратора не указан. Пожалуйста, попробуйте позже."
 
-    await query.edit_message_text(
+    await coalescing.edit_message(
+        query,
         contact_message,
         reply_markup=keyboards.back_to_menu_keyboard(),
         parse_mode='MarkdownV2' 
@@ -224,12 +260,13 @@ def register_handlers(application: Application) -> None:
     logger.info("Registering bot handlers...")
 
     application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CallbackQueryHandler(choose_protocol_for_key, pattern='^get_key_button$')) # Новая кнопка
-    application.add_handler(CallbackQueryHandler(handle_get_key_protocol_selected, pattern='^get_key_vless$'))
-    application.add_handler(CallbackQueryHandler(handle_get_key_protocol_selected, pattern='^get_key_shadowsocks$')) 
-    application.add_handler(CallbackQueryHandler(handle_my_keys, pattern='^my_keys$'))
-    application.add_handler(CallbackQueryHandler(start_command, pattern='^main_menu$'))
-    application.add_handler(CallbackQueryHandler(handle_instructions, pattern='^instructions$'))
-    application.add_handler(CallbackQueryHandler(handle_contact_admin, pattern='^contact_admin$'))
+    # Повторные нажатия той же кнопки, пока первое обрабатывается, не запускают обработчик ещё раз
+    application.add_handler(CallbackQueryHandler(coalescing.coalesce(choose_protocol_for_key), pattern='^get_key_button$')) # Новая кнопка
+    # Кнопка каждого зарегистрированного драйвера: get_key_<протокол>
+    application.add_handler(CallbackQueryHandler(coalescing.coalesce(handle_get_key_protocol_selected), pattern=f"^get_key_({'|'.join(drivers.protocols())})$"))
+    application.add_handler(CallbackQueryHandler(coalescing.coalesce(handle_my_keys), pattern='^my_keys$'))
+    application.add_handler(CallbackQueryHandler(coalescing.coalesce(start_command), pattern='^main_menu$'))
+    application.add_handler(CallbackQueryHandler(coalescing.coalesce(handle_instructions), pattern='^instructions$'))
+    application.add_handler(CallbackQueryHandler(coalescing.coalesce(handle_contact_admin), pattern='^contact_admin$'))
 
     logger.info("Handlers registered.")
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+
+from telegram import Bot
+from telegram.error import BadRequest, Forbidden, TelegramError
+from telegram.ext import Application
+
+import secrets
+import coordination
+import db_manager
+import lifecycle
+import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Запущенные в этом процессе рассылки: broadcast_id -> задача
+_running: dict[int, asyncio.Task] = {}
+
+
+async def deliver(bot: Bot, user_id: int, text: str, semaphore: asyncio.Semaphore) -> tuple[int, str]:
+    """Отправка с фоновым приоритетом: 'sent', 'blocked' или 'failed'."""
+    async with semaphore:
+        try:
+            await bot.send_message(
+                chat_id=user_id,
+                text=text,
+                rate_limit_args={"priority": rate_limiter.PRIORITY_BACKGROUND, "max_retries": 5}
+            )
+            return user_id, 'sent'
+        except Forbidden:
+            logger.info(f"User {user_id} blocked the bot, marking as blocked.")
+            return user_id, 'blocked'
+        except BadRequest as e:
+            if "chat not found" in str(e).lower():
+                return user_id, 'blocked'
+            logger.warning(f"Broadcast message to {user_id} rejected: {e}")
+            return user_id, 'failed'
+        except TelegramError as e:
+            logger.warning(f"Broadcast message to {user_id} failed: {e}")
+            return user_id, 'failed'
+
+
+async def run_broadcast(bot: Bot, broadcast_id: int) -> db_manager.Broadcast | None:
+    """Рассылает сообщение всем незаблокированным пользователям, начиная с сохранённого курсора.
+
+    Чтение пачек и запись результатов идут в to_thread, чтобы не блокировать event loop.
+    """
+    broadcast = await asyncio.to_thread(db_manager.get_broadcast, broadcast_id)
+    if not broadcast or broadcast.status != 'running':
+        return broadcast
+    text, cursor_user_id = broadcast.text, broadcast.cursor_user_id
+
+    logger.info(f"Broadcast {broadcast_id} started from user_id > {cursor_user_id}.")
+    semaphore = asyncio.Semaphore(secrets.BROADCAST_CONCURRENCY)
+
+    while True:
+        broadcast, user_ids, delivered = await asyncio.to_thread(
+            db_manager.get_broadcast_chunk, broadcast_id, secrets.BROADCAST_CHUNK_SIZE, cursor_user_id
+        )
+        if broadcast is None or broadcast.status != 'running':
+            logger.info(f"Broadcast {broadcast_id} is {broadcast.status if broadcast else 'deleted'}, stopping.")
+            return broadcast
+        if not user_ids:
+            break
+        if lifecycle.is_draining():
+            logger.info(f"Broadcast {broadcast_id} paused for shutdown, resumes after restart.")
+            return broadcast
+        if not await coordination.acquire(f"broadcast-{broadcast_id}"):
+            logger.warning(f"Broadcast {broadcast_id} was taken over by another worker, stopping.")
+            return broadcast
+
+        results = await asyncio.gather(*(
+            deliver(bot, user_id, text, semaphore) for user_id in user_ids if user_id not in delivered
+        ))
+
+        await asyncio.to_thread(db_manager.record_broadcast_chunk, broadcast_id, list(results), user_ids[-1])
+        cursor_user_id = user_ids[-1]
+
+    broadcast = await asyncio.to_thread(_finish, broadcast_id)
+    logger.info(f"Broadcast {broadcast_id} finished: sent {broadcast.sent_count}, failed {broadcast.failed_count}, blocked {broadcast.blocked_count}.")
+    return broadcast
+
+
+def _finish(broadcast_id: int) -> db_manager.Broadcast | None:
+    with db_manager.get_db() as db:
+        return db_manager.finish_broadcast(db, broadcast_id)
+
+
+async def _run_and_report(bot: Bot, broadcast_id: int) -> None:
+    try:
+        # В режиме --workers рассылку выполняет один воркер — тот, кто взял её аренду
+        async with coordination.lock(f"broadcast-{broadcast_id}") as locked:
+            broadcast = await run_broadcast(bot, broadcast_id) if locked else None
+        if broadcast and broadcast.status == 'completed' and broadcast.created_by:
+            await bot.send_message(
+                chat_id=broadcast.created_by,
+                text=(f"📣 Рассылка #{broadcast_id} завершена.\n"
+                      f"Доставлено: {broadcast.sent_count}\nОшибок: {broadcast.failed_count}\nЗаблокировали бота: {broadcast.blocked_count}"),
+                rate_limit_args={"priority": rate_limiter.PRIORITY_NOTIFICATION}
+            )
+    except Exception as e:
+        logger.error(f"Broadcast {broadcast_id} crashed: {e}", exc_info=True)
+    finally:
+        _running.pop(broadcast_id, None)
+
+
+def start_broadcast(application: Application, broadcast_id: int) -> None:
+    if broadcast_id in _running:
+        return
+    _running[broadcast_id] = lifecycle.track(
+        application.create_task(_run_and_report(application.bot, broadcast_id), name=f"broadcast-{broadcast_id}")
+    )
+
+
+def resume_broadcasts(application: Application) -> None:
+    """Продолжает рассылки, прерванные перезапуском бота."""
+    with db_manager.get_db() as db:
+        broadcast_ids = [row.id for row in db.query(db_manager.Broadcast.id).filter(db_manager.Broadcast.status == 'running')]
+    for broadcast_id in broadcast_ids:
+        logger.info(f"Resuming broadcast {broadcast_id} after restart.")
+        start_broadcast(application, broadcast_id)
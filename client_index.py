@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Индекс клиентов инбаундов 3x-ui в памяти.
+
+Для каждого инбаунда хранит email клиентов и их tgId, чтобы при выдаче ключа за O(1)
+проверять коллизии email и находить клиентов того же пользователя, не скачивая инбаунд.
+Наполняется из ответов панели (inbounds/get), собственными добавлениями и удалениями,
+а при старте восстанавливается из базы и одной синхронизацией с панелью в warm-up.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Iterable
+
+import db_manager
+import server_registry
+from inbound_parser import ClientRecord
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(slots=True)
+class IndexedClient:
+    email: str
+    tg_id: int | None
+    # UUID для VLESS или пароль (соль) для Shadowsocks — нужен, чтобы заново собрать ссылку
+    credential: str | None = None
+    enable: bool = True
+    # Клиент записан у нас в базе как активный ключ. Клиенты панели без такой записи —
+    # «сироты» (например, ключ создан, но не сохранён в базу), их можно выдать повторно.
+    in_db: bool = False
+    # Клиент был в панели при последней синхронизации
+    in_panel: bool = False
+
+
+class InboundIndex:
+    __slots__ = ("clients", "by_tg_id", "synced")
+
+    def __init__(self):
+        self.clients: dict[str, IndexedClient] = {}
+        self.by_tg_id: dict[int, set[str]] = {}
+        # Была ли хотя бы одна полная синхронизация с панелью
+        self.synced = False
+
+    def add(self, client: IndexedClient) -> None:
+        previous = self.clients.get(client.email)
+        if previous is not None and previous.tg_id != client.tg_id:
+            self._unlink(previous)
+        self.clients[client.email] = client
+        if client.tg_id is not None:
+            self.by_tg_id.setdefault(client.tg_id, set()).add(client.email)
+
+    def remove(self, email: str) -> IndexedClient | None:
+        client = self.clients.pop(email, None)
+        if client is not None:
+            self._unlink(client)
+        return client
+
+    def _unlink(self, client: IndexedClient) -> None:
+        emails = self.by_tg_id.get(client.tg_id)
+        if emails is not None:
+            emails.discard(client.email)
+            if not emails:
+                del self.by_tg_id[client.tg_id]
+
+
+_indexes: dict[int, InboundIndex] = {}
+
+
+def _index(inbound_id: int) -> InboundIndex:
+    index = _indexes.get(inbound_id)
+    if index is None:
+        index = _indexes[inbound_id] = InboundIndex()
+    return index
+
+
+def contains(inbound_id: int, email: str) -> bool:
+    return email in _index(inbound_id).clients
+
+
+def emails_for(inbound_id: int, tg_id: int) -> frozenset[str]:
+    return frozenset(_index(inbound_id).by_tg_id.get(tg_id, ()))
+
+
+def is_synced(inbound_id: int) -> bool:
+    return _index(inbound_id).synced
+
+
+def in_panel(inbound_id: int, email: str) -> bool:
+    client = _index(inbound_id).clients.get(email)
+    return client is not None and client.in_panel
+
+
+def count_for(inbound_id: int, tg_id: int) -> int:
+    return len(_index(inbound_id).by_tg_id.get(tg_id, ()))
+
+
+def size(inbound_id: int) -> int:
+    """Клиентов в инбаунде, включая зарезервированных, но ещё не добавленных в панель."""
+    return len(_index(inbound_id).clients)
+
+
+def register(inbound_id: int, email: str, tg_id: int | None, credential: str | None = None, in_db: bool = True) -> None:
+    """Запоминает клиента, которого добавляем мы сами (до запроса в панель — как резерв email)."""
+    _index(inbound_id).add(IndexedClient(email=email, tg_id=tg_id, credential=credential, in_db=in_db))
+
+
+def forget(inbound_id: int, email: str) -> None:
+    _index(inbound_id).remove(email)
+
+
+def claim_orphan(inbound_id: int, tg_id: int) -> IndexedClient | None:
+    """Забирает включённого клиента пользователя, которого нет в базе, чтобы выдать его повторно.
+
+    Без await внутри: два одновременных запроса не получат одного и того же клиента.
+    """
+    index = _index(inbound_id)
+    for email in index.by_tg_id.get(tg_id, ()):
+        client = index.clients[email]
+        if not client.in_db and client.enable and client.credential:
+            client.in_db = True
+            return client
+    return None
+
+
+def claim(inbound_id: int, email: str) -> bool:
+    """Отмечает клиента панели как записанного в базу. False — его уже забрал другой запрос."""
+    client = _index(inbound_id).clients.get(email)
+    if client is None or client.in_db:
+        return False
+    client.in_db = True
+    return True
+
+
+def sync_inbound(inbound_id: int, records: Iterable[ClientRecord], credential_field: str = "id") -> None:
+    """Приводит индекс инбаунда к списку клиентов из панели.
+
+    Клиенты, которых в панели больше нет, удаляются, если их нет и в базе: записи базы
+    остаются, чтобы их email не выдали повторно.
+    """
+    index = _index(inbound_id)
+    seen = set()
+    for record in records:
+        seen.add(record.email)
+        known = index.clients.get(record.email)
+        index.add(IndexedClient(
+            email=record.email,
+            tg_id=record.tg_id if record.tg_id is not None else (known.tg_id if known else None),
+            credential=getattr(record, credential_field) or (known.credential if known else None),
+            enable=record.enable,
+            in_db=known.in_db if known else False,
+            in_panel=True,
+        ))
+    for email in [email for email, client in index.clients.items() if email not in seen and not client.in_db]:
+        index.remove(email)
+    index.synced = True
+    logger.debug(f"Client index for inbound {inbound_id} synced: {len(index.clients)} clients.")
+
+
+def credential_field(protocol: str) -> str:
+    return "password" if protocol == "shadowsocks" else "id"
+
+
+async def rebuild_from_db() -> int:
+    """Отмечает в индексе активные ключи из базы. Запрос к базе идёт в отдельном потоке."""
+    rows = await asyncio.to_thread(db_manager.get_active_key_owners)
+    count = 0
+    for server_id, protocol, inbound_id, user_id, key_identifier in rows:
+        server = server_registry.get(server_id)
+        if inbound_id is None:
+            inbound_id = server.inbound_id(protocol) if server else None
+        if inbound_id is None:
+            continue
+        index = _index(inbound_id)
+        known = index.clients.get(key_identifier)
+        if known is not None:
+            known.in_db = True
+        else:
+            index.add(IndexedClient(email=key_identifier, tg_id=user_id, in_db=True))
+        count += 1
+    logger.info(f"Client index rebuilt from the database: {count} active keys.")
+    return count
+
+
+def clear() -> None:
+    _indexes.clear()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""Схлопывание повторных нажатий кнопок и лишних правок сообщений.
+
+Повторное нажатие той же кнопки тем же пользователем в течение COALESCE_WINDOW_SEC после
+того, как обработка предыдущего закончилась, получает мгновенный ответ на callback query,
+а обработчик не запускается. Обновления бот обрабатывает по одному (concurrent_updates не
+задан), поэтому нажатия, сделанные, пока первое ещё обрабатывалось, ждут в очереди и
+приходят в обработчик сразу после него — их и отсекает окно. Правка сообщения теми же
+текстом и клавиатурой, что бот уже показал в этом сообщении, в Bot API не отправляется.
+"""
+import functools
+import logging
+import time
+from collections import OrderedDict
+
+from telegram import CallbackQuery, InlineKeyboardMarkup, Update
+from telegram.error import BadRequest, TelegramError
+from telegram.ext import ContextTypes
+
+import secrets
+
+logger = logging.getLogger(__name__)
+
+_MAX_TRACKED = 10000
+
+# user_id -> (callback_data, время завершения) последнего нажатия пользователя
+_last_finished: "OrderedDict[int, tuple[str, float]]" = OrderedDict()
+# (chat_id, message_id) или inline_message_id -> (текст, parse_mode, клавиатура), показанные ботом
+_last_content: "OrderedDict[object, tuple]" = OrderedDict()
+
+
+def _remember(cache: OrderedDict, key, value) -> None:
+    cache[key] = value
+    cache.move_to_end(key)
+    while len(cache) > _MAX_TRACKED:
+        cache.popitem(last=False)
+
+
+def _is_duplicate(user_id: int, data: str) -> bool:
+    last = _last_finished.get(user_id)
+    return last is not None and last[0] == data and time.monotonic() - last[1] < getattr(secrets, "COALESCE_WINDOW_SEC", 1.0)
+
+
+def coalesce(handler):
+    """Обёртка обработчика callback query: повторные нажатия той же кнопки не запускают его."""
+
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        user_id = update.effective_user.id
+        if _is_duplicate(user_id, query.data):
+            logger.debug(f"Coalesced repeated '{query.data}' press of user {user_id}.")
+            try:
+                await query.answer()
+            except TelegramError:
+                pass # Запрос уже устарел — клиенту ответ не нужен
+            return None
+
+        # Другое действие пользователя сбрасывает окно: вернуться к прежней кнопке можно сразу
+        _last_finished.pop(user_id, None)
+        try:
+            return await handler(update, context)
+        finally:
+            _remember(_last_finished, user_id, (query.data, time.monotonic()))
+
+    return wrapper
+
+
+def _message_key(query: CallbackQuery):
+    if query.inline_message_id:
+        return query.inline_message_id
+    return query.message.chat.id, query.message.message_id
+
+
+async def edit_message(query: CallbackQuery, text: str, reply_markup: InlineKeyboardMarkup | None = None,
+                       parse_mode: str | None = None) -> None:
+    """edit_message_text, который не отправляет правку, если сообщение уже выглядит так же."""
+    key = _message_key(query)
+    content = (text, parse_mode, reply_markup)
+    if _last_content.get(key) == content:
+        return
+    kwargs = {"reply_markup": reply_markup}
+    if parse_mode is not None:
+        kwargs["parse_mode"] = parse_mode
+    try:
+        await query.edit_message_text(text, **kwargs)
+    except BadRequest as e:
+        if "message is not modified" not in str(e).lower():
+            _last_content.pop(key, None)
+            raise
+    _remember(_last_content, key, content)
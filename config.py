@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import logging
+import re
+from dataclasses import dataclass
+
+import secrets
+
+logger = logging.getLogger(__name__)
+
+_BOT_TOKEN_RE = re.compile(r"^\d+:[A-Za-z0-9_-]{20,}$")
+
+
+class ConfigError(ValueError):
+    """Ошибка в secrets.py, с которой бот не может запуститься."""
+
+
+@dataclass(frozen=True, slots=True)
+class PanelSettings:
+    api_url: str
+    username: str
+    password: str
+    shadowsocks_master_key: str | None
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    bot_token: str
+    admin_user_id: int
+    admin_username: str | None
+    database_url: str
+    max_keys_per_user: int
+    panel: PanelSettings
+
+
+_settings: Settings | None = None
+
+
+def load_settings() -> Settings:
+    """Один раз проверяет secrets.py и собирает типизированные настройки."""
+    errors = []
+
+    bot_token = str(getattr(secrets, "BOT_TOKEN", "") or "")
+    if not _BOT_TOKEN_RE.match(bot_token):
+        errors.append("BOT_TOKEN is not set or malformed (expected '<digits>:<token>' from @BotFather).")
+
+    admin_user_id = getattr(secrets, "ADMIN_USER_ID", 0)
+    if not isinstance(admin_user_id, int) or admin_user_id < 0:
+        errors.append("ADMIN_USER_ID must be a non-negative integer (0 disables admin features).")
+        admin_user_id = 0
+
+    max_keys = getattr(secrets, "MAX_KEYS_PER_USER", 0)
+    if not isinstance(max_keys, int) or max_keys <= 0:
+        errors.append("MAX_KEYS_PER_USER must be a positive integer.")
+
+    api_url = str(getattr(secrets, "XUI_API_URL", "") or "").rstrip("/")
+    if not api_url.startswith(("http://", "https://")):
+        errors.append("XUI_API_URL must start with http:// or https://.")
+    xui_username = getattr(secrets, "XUI_USERNAME", "")
+    xui_password = getattr(secrets, "XUI_PASSWORD", "")
+    if not xui_username or not xui_password:
+        errors.append("XUI_USERNAME and XUI_PASSWORD must be set.")
+
+    database_url = getattr(secrets, "DATABASE_URL", "")
+    if not database_url:
+        errors.append("DATABASE_URL must be set.")
+
+    if errors:
+        raise ConfigError("Invalid configuration in secrets.py:\n - " + "\n - ".join(errors))
+
+    return Settings(
+        bot_token=bot_token,
+        admin_user_id=admin_user_id,
+        admin_username=getattr(secrets, "ADMIN_TELEGRAM_USERNAME", None) or None,
+        database_url=database_url,
+        max_keys_per_user=max_keys,
+        panel=PanelSettings(
+            api_url=api_url,
+            username=xui_username,
+            password=xui_password,
+            shadowsocks_master_key=getattr(secrets, "XUI_SHADOWSOCKS_MASTER_KEY", None) or None,
+        ),
+    )
+
+
+def get_settings() -> Settings:
+    global _settings
+    if _settings is None:
+        _settings = load_settings()
+    return _settings
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""Согласование воркеров в режиме --workers (см. workers.py) через общую базу.
+
+ - Лидер: аренда «leader» в таблице shared_state, которую воркер продлевает каждые
+   LEASE_TTL_SEC / 3. Только лидер проверяет квоты, продолжает рассылки и переносы и
+   разбирает зависшие выдачи ключей; если лидер пропал, аренду через LEASE_TTL_SEC берёт другой.
+ - Задачи: рассылку или перенос выполняет воркер, взявший аренду задачи; он продлевает её
+   после каждой пачки.
+ - Сессия панели 3x-ui общая: воркер, который залогинился, кладёт куку в shared_state.
+ - Кэши: изменения ключей публикуются в ленту subscription_changes, остальные воркеры читают
+   её раз в CHANGE_FEED_POLL_SEC и сбрасывают кэши у себя. Изменения, закоммиченные не в порядке
+   id (PostgreSQL), не теряются: пропущенные id перечитываются до _CHANGE_FEED_GAP_TTL_SEC.
+
+В обычном режиме (один процесс) модуль ничего не делает: воркер один и он же лидер.
+"""
+import asyncio
+import contextlib
+import datetime
+import logging
+import os
+import socket
+import time
+
+import db_manager
+import inbound_pool
+
+logger = logging.getLogger(__name__)
+
+LEASE_TTL_SEC = 30.0
+JOB_LEASE_TTL_SEC = 120.0
+CHANGE_FEED_POLL_SEC = 1.0
+# Лидер раз в столько секунд подхватывает задачи, брошенные остановившимися воркерами
+LEADER_JOBS_INTERVAL_SEC = 60.0
+# Выдачу ключа, начатую раньше, считаем брошенной: живой воркер закончил бы её быстрее
+PENDING_ISSUANCE_MIN_AGE_SEC = 300.0
+_CHANGE_FEED_RETENTION = datetime.timedelta(hours=1)
+# Сколько ждать пропущенный id ленты: транзакция изменения ключей короткая, а номер откаченной не появится
+_CHANGE_FEED_GAP_TTL_SEC = 30.0
+
+_LEADER_LEASE = "lease:leader"
+
+_owner: str | None = None
+_worker_index = 0
+_leader = False
+_tasks: list[asyncio.Task] = []
+
+
+def configure(worker_index: int) -> None:
+    """Включает режим воркеров. Вызывается в процессе воркера до сборки приложения."""
+    global _owner, _worker_index
+    _worker_index = worker_index
+    _owner = f"{socket.gethostname()}:{os.getpid()}:{worker_index}"
+    db_manager.enable_change_feed(_owner)
+
+
+def enabled() -> bool:
+    return _owner is not None
+
+
+def worker_index() -> int:
+    return _worker_index
+
+
+def is_leader() -> bool:
+    return _owner is None or _leader
+
+
+async def acquire(name: str, ttl: float = JOB_LEASE_TTL_SEC) -> bool:
+    """Берёт или продлевает аренду задачи name. False — задачу выполняет другой воркер."""
+    if _owner is None:
+        return True
+    try:
+        return await asyncio.to_thread(db_manager.try_lease, f"lease:{name}", _owner, ttl)
+    except Exception as e:
+        logger.error(f"Failed to acquire lease {name}: {e}")
+        return False
+
+
+async def release(name: str) -> None:
+    if _owner is None:
+        return
+    try:
+        await asyncio.to_thread(db_manager.release_lease, f"lease:{name}", _owner)
+    except Exception as e:
+        # Аренда истечёт сама
+        logger.warning(f"Failed to release lease {name}: {e}")
+
+
+@contextlib.asynccontextmanager
+async def lock(name: str, ttl: float = JOB_LEASE_TTL_SEC):
+    """Аренда на время блока; в блок передаётся, удалось ли её взять."""
+    locked = await acquire(name, ttl)
+    try:
+        yield locked
+    finally:
+        if locked:
+            await release(name)
+
+
+async def get_shared(key: str) -> str | None:
+    if _owner is None:
+        return None
+    try:
+        return await asyncio.to_thread(db_manager.get_shared_value, key)
+    except Exception as e:
+        logger.warning(f"Failed to read shared value {key}: {e}")
+        return None
+
+
+async def set_shared(key: str, value: str, ttl: float) -> None:
+    if _owner is None:
+        return
+    try:
+        await asyncio.to_thread(db_manager.set_shared_value, key, value, ttl)
+    except Exception as e:
+        logger.warning(f"Failed to store shared value {key}: {e}")
+
+
+async def delete_shared(key: str, value: str | None = None) -> None:
+    if _owner is None:
+        return
+    try:
+        await asyncio.to_thread(db_manager.delete_shared_value, key, value)
+    except Exception as e:
+        logger.warning(f"Failed to delete shared value {key}: {e}")
+
+
+async def _leader_loop(application, on_leader) -> None:
+    global _leader
+    last_jobs = None
+    while True:
+        try:
+            leader = await asyncio.to_thread(db_manager.try_lease, _LEADER_LEASE, _owner, LEASE_TTL_SEC)
+            # Инбаунды, созданные другими воркерами
+            await asyncio.to_thread(inbound_pool.load)
+        except Exception as e:
+            logger.error(f"Leader lease renewal failed: {e}")
+            leader = False
+        if leader != _leader:
+            logger.info(f"Worker {_worker_index} {'is now the leader' if leader else 'lost leadership'}.")
+            _leader = leader
+            last_jobs = None
+        if leader and (last_jobs is None or time.monotonic() - last_jobs >= LEADER_JOBS_INTERVAL_SEC):
+            last_jobs = time.monotonic()
+            try:
+                on_leader(application)
+                cutoff = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - _CHANGE_FEED_RETENTION
+                await asyncio.to_thread(db_manager.prune_subscription_changes, cutoff)
+            except Exception as e:
+                logger.error(f"Leader jobs failed: {e}", exc_info=True)
+        await asyncio.sleep(LEASE_TTL_SEC / 3)
+
+
+async def _change_feed_loop() -> None:
+    last_id = await asyncio.to_thread(db_manager.last_subscription_change_id)
+    # Пропущенный id -> когда его заметили (time.monotonic)
+    gaps: dict[int, float] = {}
+    while True:
+        await asyncio.sleep(CHANGE_FEED_POLL_SEC)
+        try:
+            last_id, user_ids, missing = await asyncio.to_thread(db_manager.get_subscription_changes, last_id, _owner, list(gaps))
+        except Exception as e:
+            logger.warning(f"Failed to read subscription change feed: {e}")
+            continue
+        now = time.monotonic()
+        gaps = {change_id: gaps.get(change_id, now) for change_id in missing
+                if now - gaps.get(change_id, now) < _CHANGE_FEED_GAP_TTL_SEC}
+        if user_ids:
+            db_manager.notify_subscriptions_changed(user_ids)
+
+
+def start(application, on_leader) -> None:
+    """Запускает выборы лидера и чтение ленты изменений. on_leader(application) вызывается,
+    когда воркер становится лидером, и затем раз в LEADER_JOBS_INTERVAL_SEC."""
+    if _owner is None:
+        return
+    _tasks.append(asyncio.create_task(_leader_loop(application, on_leader), name="leader-election"))
+    _tasks.append(asyncio.create_task(_change_feed_loop(), name="change-feed"))
+
+
+async def stop() -> None:
+    """Останавливает фоновые циклы и отдаёт лидерство, чтобы другой воркер взял его сразу."""
+    global _leader
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    if _owner is not None and _leader:
+        _leader = False
+        try:
+            await asyncio.to_thread(db_manager.release_lease, _LEADER_LEASE, _owner)
+        except Exception as e:
+            logger.warning(f"Failed to release leader lease: {e}")
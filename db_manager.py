@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
+import base64
 import datetime
 import logging
+import os
+import time
+import zlib
 from contextlib import contextmanager
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, Boolean
-from sqlalchemy.orm import sessionmaker, relationship, declarative_base
+from sqlalchemy import create_engine, Column, Integer, BigInteger, String, DateTime, ForeignKey, Boolean, Text, Float, Index, event, insert, inspect, or_, select, text, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, relationship, declarative_base, object_session
+from sqlalchemy.schema import CreateIndex
 from sqlalchemy.sql import func
-from secrets import DATABASE_URL, SERVERS
+from secrets import DATABASE_URL
+import server_registry
+import tracing
 from sqlalchemy.orm import Session
 
 logger = logging.getLogger(__name__)
@@ -18,7 +26,20 @@ class User(Base):
     first_name = Column(String, nullable=True)
     last_name = Column(String, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Пользователь заблокировал бота — рассылки его пропускают
+    is_blocked = Column(Boolean, default=False, server_default='0', nullable=False)
+    # Секрет в адресе ссылки-подписки; создаётся при первом запросе ссылки
+    sub_token = Column(String, nullable=True)
+    # Лимит трафика в ГБ на все ключи пользователя: своё значение или тариф из TRAFFIC_PLANS.
+    # Если не заданы оба — DEFAULT_TRAFFIC_LIMIT_GB (0 — без лимита)
+    traffic_limit_gb = Column(Integer, nullable=True)
+    plan = Column(String, nullable=True)
     subscriptions = relationship("Subscription", back_populates="user")
+    # Поиск по username без учёта регистра (как в Telegram) через индекс по выражению
+    __table_args__ = (
+        Index('ix_users_username_lower', func.lower(username)),
+        Index('ix_users_sub_token', sub_token, unique=True),
+    )
 
 class Server(Base):
     __tablename__ = 'servers'
@@ -30,11 +51,13 @@ class Server(Base):
 class Subscription(Base):
     __tablename__ = 'subscriptions'
     id = Column(Integer, primary_key=True, autoincrement=True)
-    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
     server_id = Column(Integer, ForeignKey('servers.id'), nullable=False)
     protocol = Column(String, nullable=False)
     key_data = Column(String, nullable=False)
-    key_identifier = Column(String, nullable=False)
+    key_identifier = Column(String, nullable=False, index=True) # Email клиента в панели 3x-ui
+    # Инбаунд 3x-ui, в котором лежит клиент; NULL — основной инбаунд протокола (ключи до шардирования)
+    inbound_id = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     expires_at = Column(DateTime(timezone=True), nullable=False)
     is_active = Column(Boolean, default=True)
@@ -43,22 +66,309 @@ class Subscription(Base):
     user = relationship("User", back_populates="subscriptions")
     server = relationship("Server", back_populates="subscriptions")
 
+class SubscriptionArchive(Base):
+    """Отозванные ключи, перенесённые из subscriptions задачей хранения (retention.py)."""
+    __tablename__ = 'subscriptions_archive'
+    id = Column(Integer, primary_key=True, autoincrement=False) # id строки в subscriptions
+    user_id = Column(Integer, nullable=False, index=True)
+    server_id = Column(Integer, nullable=False)
+    protocol = Column(String, nullable=False)
+    key_data = Column(String, nullable=False)
+    key_identifier = Column(String, nullable=False)
+    inbound_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), nullable=True)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+    is_active = Column(Boolean, nullable=True)
+    duration_months = Column(Integer, nullable=False)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class Broadcast(Base):
+    __tablename__ = 'broadcasts'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    text = Column(Text, nullable=False)
+    status = Column(String, default='running', nullable=False) # running / completed / cancelled
+    # Последний обработанный users.id — с него рассылка продолжается после перезапуска
+    cursor_user_id = Column(Integer, default=0, nullable=False)
+    sent_count = Column(Integer, default=0, nullable=False)
+    failed_count = Column(Integer, default=0, nullable=False)
+    blocked_count = Column(Integer, default=0, nullable=False)
+    created_by = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+class IssuanceJournal(Base):
+    """Журнал выдачи ключей: запись создаётся до addClient в панели.
+
+    pending — клиент мог попасть в панель, но ключ ещё не сохранён в subscriptions;
+    committed — ключ сохранён (в той же транзакции, что и подписка); rolled_back — клиента в панели нет.
+    """
+    __tablename__ = 'issuance_journal'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
+    server_id = Column(Integer, nullable=False)
+    protocol = Column(String, nullable=False)
+    inbound_id = Column(Integer, nullable=False)
+    email = Column(String, nullable=False, unique=True)
+    # UUID клиента VLESS или пароль (соль) Shadowsocks — чтобы собрать ссылку при восстановлении
+    credential = Column(String, nullable=False)
+    status = Column(String, default='pending', nullable=False, index=True)
+    # Выдача в рамках переноса ключей между серверами: такие записи разбирает сам перенос
+    migration_id = Column(Integer, nullable=True, index=True)
+    # Email прежнего клиента перенесённого ключа; очищается после его удаления из старого инбаунда
+    replaces_email = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class Migration(Base):
+    """Перенос активных ключей 3x-ui с одного сервера на другой (/migrate)."""
+    __tablename__ = 'migrations'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    source_server_id = Column(Integer, nullable=False)
+    target_server_id = Column(Integer, nullable=False)
+    status = Column(String, default='running', nullable=False) # running / completed / cancelled
+    # Последний обработанный subscriptions.id — с него перенос продолжается после перезапуска
+    cursor_subscription_id = Column(Integer, default=0, nullable=False)
+    migrated_count = Column(Integer, default=0, nullable=False)
+    failed_count = Column(Integer, default=0, nullable=False)
+    created_by = Column(Integer, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+class TrafficUsage(Base):
+    """Состояние квоты пользователя после последней проверки трафика."""
+    __tablename__ = 'traffic_usage'
+    user_id = Column(Integer, ForeignKey('users.id'), primary_key=True)
+    used_bytes = Column(BigInteger, default=0, nullable=False)
+    # Сколько порогов предупреждения уже пройдено (чтобы не предупреждать повторно)
+    warned_level = Column(Integer, default=0, nullable=False)
+    # Ключи отключены в панели из-за превышения квоты
+    quota_disabled = Column(Boolean, default=False, server_default='0', nullable=False)
+    # Трафик прежних клиентов перенесённых ключей (их уже нет в панели); входит в used_bytes
+    carried_bytes = Column(BigInteger, default=0, server_default='0', nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+class InboundShard(Base):
+    """Инбаунд 3x-ui, созданный ботом копированием основного, когда инбаунды сервера заполнились."""
+    __tablename__ = 'inbound_shards'
+    inbound_id = Column(Integer, primary_key=True, autoincrement=False)
+    server_id = Column(Integer, nullable=False)
+    protocol = Column(String, nullable=False)
+    port = Column(Integer, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class UserKeyCount(Base):
+    """Число активных ключей пользователя по протоколам. Меняется в той же транзакции, что и subscriptions."""
+    __tablename__ = 'user_key_counts'
+    user_id = Column(Integer, primary_key=True)
+    protocol = Column(String, primary_key=True)
+    active_count = Column(Integer, default=0, nullable=False)
+
+class SharedState(Base):
+    """Общее состояние воркеров (режим --workers): аренды (лидер, задачи) и значения вроде сессии панели."""
+    __tablename__ = 'shared_state'
+    key = Column(String, primary_key=True)
+    value = Column(Text, nullable=True)
+    # Владелец аренды (воркер); у обычных значений — NULL
+    owner = Column(String, nullable=True)
+    # Unix-время истечения: аренду, которую не продлили, может взять другой воркер
+    expires_at = Column(Float, nullable=False)
+
+class SubscriptionChange(Base):
+    """Лента изменений ключей для остальных воркеров: по ней они сбрасывают свои кэши."""
+    __tablename__ = 'subscription_changes'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
+    # Воркер, закоммитивший изменение (свои изменения он уже применил)
+    origin = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class BroadcastDelivery(Base):
+    __tablename__ = 'broadcast_deliveries'
+    broadcast_id = Column(Integer, ForeignKey('broadcasts.id'), primary_key=True)
+    user_id = Column(Integer, primary_key=True)
+    status = Column(String, nullable=False) # sent / failed / blocked
+    updated_at = Column(DateTime(timezone=True), server_default=func.now())
+
 # --- Настройка и функции БД ---
 engine = create_engine(DATABASE_URL)
+tracing.instrument_engine(engine)
+
+if engine.dialect.name == 'sqlite':
+    @event.listens_for(engine, 'connect')
+    def _configure_sqlite(dbapi_connection, connection_record):
+        # WAL: чтение не блокирует запись, в том числе из других процессов (--workers);
+        # busy_timeout: писатель ждёт освобождения базы, а не падает с «database is locked»
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA busy_timeout=30000")
+        cursor.close()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
-def init_db():
+# Подписчики на изменение ключей пользователей (кэш ссылок-подписок и т.п.).
+# Вызываются после коммита с множеством затронутых users.id.
+_subscription_listeners = []
+_CHANGED_USERS_KEY = 'changed_subscription_user_ids'
+# Имя воркера, если изменения публикуются в ленту subscription_changes (режим --workers)
+_change_feed_origin: str | None = None
+
+def on_subscriptions_changed(callback) -> None:
+    _subscription_listeners.append(callback)
+
+def enable_change_feed(origin: str) -> None:
+    global _change_feed_origin
+    _change_feed_origin = origin
+
+def _mark_subscriptions_changed(db_session: Session, user_ids, connection=None) -> None:
+    changed = db_session.info.setdefault(_CHANGED_USERS_KEY, set())
+    new_ids = set(user_ids) - changed
+    changed.update(new_ids)
+    if _change_feed_origin is not None and new_ids:
+        # В той же транзакции: при откате запись в ленте тоже откатится
+        (connection or db_session.connection()).execute(
+            insert(SubscriptionChange), [{"user_id": user_id, "origin": _change_feed_origin} for user_id in new_ids]
+        )
+
+def has_uncommitted_changes(db_session: Session, user_id: int) -> bool:
+    """Есть ли в текущей транзакции сессии ещё не закоммиченные изменения ключей пользователя."""
+    return user_id in db_session.info.get(_CHANGED_USERS_KEY, ())
+
+@event.listens_for(Subscription, 'after_insert')
+@event.listens_for(Subscription, 'after_update')
+@event.listens_for(Subscription, 'after_delete')
+def _track_subscription_change(mapper, connection, target):
+    db_session = object_session(target)
+    if db_session is not None:
+        _mark_subscriptions_changed(db_session, (target.user_id,), connection)
+
+def _adjust_key_counts(connection, deltas: dict[tuple[int, str], int]) -> None:
+    """Прибавляет к счётчикам активных ключей. Выполняется на соединении текущей транзакции."""
+    for (user_id, protocol), delta in deltas.items():
+        if not delta:
+            continue
+        updated = connection.execute(
+            update(UserKeyCount)
+            .where(UserKeyCount.user_id == user_id, UserKeyCount.protocol == protocol)
+            .values(active_count=UserKeyCount.active_count + delta)
+        ).rowcount
+        if not updated:
+            connection.execute(insert(UserKeyCount).values(user_id=user_id, protocol=protocol, active_count=max(delta, 0)))
+
+@event.listens_for(Subscription, 'after_insert')
+def _count_inserted_key(mapper, connection, target):
+    if target.is_active is not False: # None — значение по умолчанию (True) ещё не подставлено в объект
+        _adjust_key_counts(connection, {(target.user_id, target.protocol): 1})
+
+@event.listens_for(Subscription, 'after_update')
+def _count_updated_key(mapper, connection, target):
+    history = inspect(target).attrs.is_active.history
+    if history.has_changes():
+        was_active = bool(history.deleted and history.deleted[0] is not False)
+        if was_active != bool(target.is_active):
+            _adjust_key_counts(connection, {(target.user_id, target.protocol): 1 if target.is_active else -1})
+
+@event.listens_for(Subscription, 'after_delete')
+def _count_deleted_key(mapper, connection, target):
+    if target.is_active:
+        _adjust_key_counts(connection, {(target.user_id, target.protocol): -1})
+
+def _backfill_key_counts(conn) -> None:
+    """Пересчитывает user_key_counts по таблице subscriptions."""
+    conn.execute(UserKeyCount.__table__.delete())
+    conn.execute(insert(UserKeyCount).from_select(
+        ["user_id", "protocol", "active_count"],
+        select(Subscription.user_id, Subscription.protocol, func.count())
+        .where(Subscription.is_active == True) # noqa: E712
+        .group_by(Subscription.user_id, Subscription.protocol)
+    ))
+
+@event.listens_for(SessionLocal, 'after_commit')
+def _notify_subscription_listeners(db_session):
+    user_ids = db_session.info.pop(_CHANGED_USERS_KEY, None)
+    if user_ids:
+        notify_subscriptions_changed(user_ids)
+
+def notify_subscriptions_changed(user_ids) -> None:
+    """Вызывает подписчиков; напрямую — для изменений, пришедших из ленты других воркеров."""
+    for callback in _subscription_listeners:
+        try:
+            callback(user_ids)
+        except Exception as e:
+            logger.error(f"Subscription change listener failed: {e}", exc_info=True)
+
+@event.listens_for(SessionLocal, 'after_rollback')
+def _forget_subscription_changes(db_session):
+    db_session.info.pop(_CHANGED_USERS_KEY, None)
+
+def _migrate_schema():
+    """Добавляет в существующие таблицы новые колонки и индексы (create_all их не трогает)."""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    ddl += f" DEFAULT {getattr(default, 'text', default)}"
+                conn.execute(text(ddl))
+                logger.info(f"Added column {table.name}.{column.name}.")
+            for index in table.indexes:
+                # checkfirst не видит индексы по выражениям, поэтому полагаемся на IF NOT EXISTS
+                conn.execute(CreateIndex(index, if_not_exists=True))
+
+def _schema_fingerprint() -> int:
+    """Контрольная сумма описания таблиц: меняется при добавлении таблиц, колонок или индексов."""
+    parts = []
+    for table in Base.metadata.sorted_tables:
+        parts.append(table.name)
+        parts += [f"{column.name}:{column.type}" for column in table.columns]
+        parts += sorted(index.name for index in table.indexes)
+    return zlib.crc32("|".join(parts).encode('utf-8')) & 0x7FFFFFFF
+
+def _ensure_schema():
+    # В SQLite отпечаток схемы хранится в PRAGMA user_version: если он совпадает,
+    # create_all и проверку колонок при старте можно пропустить
+    fingerprint = _schema_fingerprint()
+    is_sqlite = engine.dialect.name == 'sqlite'
+    if is_sqlite:
+        with engine.connect() as conn:
+            if conn.exec_driver_sql("PRAGMA user_version").scalar() == fingerprint:
+                logger.info("Database schema is up-to-date.")
+                return
+    had_key_counts = inspect(engine).has_table(UserKeyCount.__tablename__)
     Base.metadata.create_all(bind=engine)
+    _migrate_schema()
+    if not had_key_counts:
+        # Таблица счётчиков появилась только что: заполняем её по уже выданным ключам
+        with engine.begin() as conn:
+            _backfill_key_counts(conn)
+        logger.info("Backfilled user_key_counts from subscriptions.")
+    if is_sqlite:
+        with engine.begin() as conn:
+            conn.exec_driver_sql(f"PRAGMA user_version = {fingerprint}")
+
+def init_db():
+    _ensure_schema()
+    sync_servers()
+
+def sync_servers():
+    """Добавляет в таблицу servers серверы из реестра, которых там ещё нет."""
     db = SessionLocal()
     try:
-        existing_server_ids = {s.id for s in db.query(Server).all()}
+        configured_servers = server_registry.all_servers()
+        configured_ids = [server_record.id for server_record in configured_servers]
+        existing_server_ids = {row.id for row in db.query(Server.id).filter(Server.id.in_(configured_ids))}
         servers_added = 0
-        for server_config in SERVERS:
-            if server_config['id'] not in existing_server_ids:
+        for server_record in configured_servers:
+            if server_record.id not in existing_server_ids:
                 server = Server(
-                    id=server_config['id'],
-                    region=server_config['region'],
-                    ip_address=server_config['ip']
+                    id=server_record.id,
+                    region=server_record.region,
+                    ip_address=server_record.ip
                 )
                 db.add(server)
                 servers_added += 1
@@ -73,6 +383,11 @@ def init_db():
     finally:
         db.close()
 
+def warm_up() -> None:
+    """Открывает соединение заранее, чтобы первый запрос пользователя не платил за него."""
+    with engine.connect() as conn:
+        conn.exec_driver_sql("SELECT 1")
+
 @contextmanager
 def get_db():
     db = SessionLocal()
@@ -90,10 +405,12 @@ def add_user(db_session, user_id: int, username: str = None, first_name: str = N
         db_session.refresh(db_user)
     elif (db_user.username != username or
           db_user.first_name != first_name or
-          db_user.last_name != last_name):
+          db_user.last_name != last_name or
+          db_user.is_blocked):
          db_user.username = username
          db_user.first_name = first_name
          db_user.last_name = last_name
+         db_user.is_blocked = False # Пользователь снова написал боту, значит разблокировал его
          db_session.commit()
     return db_user
 
@@ -104,9 +421,16 @@ def add_subscription(
         protocol: str,
         key_data: str,
         key_identifier: str,
-        expires_at: datetime.datetime
+        expires_at: datetime.datetime,
+        inbound_id: int | None = None
     ):
 
+    if inbound_id is None:
+        # Инбаунд клиента записан в журнал выдачи до addClient
+        inbound_id = db_session.query(IssuanceJournal.inbound_id).filter(
+            IssuanceJournal.email == key_identifier,
+            IssuanceJournal.status == 'pending'
+        ).scalar()
     sub = Subscription(
         user_id=user_id,
         server_id=server_id,
@@ -114,20 +438,593 @@ def add_subscription(
         key_data=key_data,
         expires_at=expires_at,
         key_identifier=key_identifier,
+        inbound_id=inbound_id,
         is_active=True
     )
     db_session.add(sub)
+    # Запись журнала выдачи закрывается той же транзакцией, что сохраняет ключ
+    db_session.query(IssuanceJournal).filter(
+        IssuanceJournal.email == key_identifier,
+        IssuanceJournal.status == 'pending'
+    ).update({IssuanceJournal.status: 'committed'}, synchronize_session=False)
     db_session.commit()
     db_session.refresh(sub)
     logger.info(f"Key added for user {user_id}, server {server_id}, protocol {protocol}")
     return sub
 
-def get_user_keys(db_session: Session, user_id: int) -> list[Subscription]:
-    return db_session.query(Subscription).filter(
-        Subscription.user_id == user_id
-    ).order_by(Subscription.created_at.asc()).all()
+def journal_begin(user_id: int, server_id: int, protocol: str, inbound_id: int, email: str, credential: str) -> int:
+    """Записывает намерение добавить клиента в панель. Возвращает id записи журнала."""
+    with get_db() as db:
+        entry = IssuanceJournal(user_id=user_id, server_id=server_id, protocol=protocol,
+                                inbound_id=inbound_id, email=email, credential=credential)
+        db.add(entry)
+        db.commit()
+        return entry.id
+
+def journal_reuse(user_id: int, server_id: int, protocol: str, inbound_id: int, email: str, credential: str) -> int:
+    """Записывает выдачу клиента, который уже есть в панели, но не в базе. Прежняя запись журнала
+    с этим email (например, rolled_back после потерянного ответа addClient) снова становится pending.
+    Возвращает id записи журнала.
+    """
+    with get_db() as db:
+        entry = db.query(IssuanceJournal).filter(IssuanceJournal.email == email).one_or_none()
+        if entry is None:
+            entry = IssuanceJournal(email=email)
+            db.add(entry)
+        entry.user_id, entry.server_id, entry.protocol, entry.inbound_id = user_id, server_id, protocol, inbound_id
+        entry.credential, entry.status, entry.migration_id, entry.replaces_email = credential, 'pending', None, None
+        db.commit()
+        return entry.id
+
+def journal_begin_many(entries: list[dict]) -> dict[str, int]:
+    """journal_begin для пачки клиентов одной транзакцией. entries — словари с user_id, server_id,
+    protocol, inbound_id, email, credential. Возвращает email -> id записи журнала.
+    """
+    with get_db() as db:
+        db.execute(insert(IssuanceJournal), entries)
+        db.commit()
+        rows = db.query(IssuanceJournal.id, IssuanceJournal.email).filter(
+            IssuanceJournal.email.in_([entry["email"] for entry in entries]),
+            IssuanceJournal.status == 'pending'
+        )
+        return {row.email: row.id for row in rows}
+
+def journal_update(journal_id: int, status: str) -> None:
+    with get_db() as db:
+        db.query(IssuanceJournal).filter(IssuanceJournal.id == journal_id).update(
+            {IssuanceJournal.status: status}, synchronize_session=False
+        )
+        db.commit()
+
+def get_pending_issuances(created_before: datetime.datetime) -> list[IssuanceJournal]:
+    with get_db() as db:
+        entries = db.query(IssuanceJournal).filter(
+            IssuanceJournal.status == 'pending',
+            IssuanceJournal.migration_id == None, # noqa: E711
+            IssuanceJournal.created_at < created_before
+        ).order_by(IssuanceJournal.id).all()
+        db.expunge_all()
+        return entries
+
+def create_migration(db_session: Session, source_server_id: int, target_server_id: int, created_by: int) -> Migration:
+    migration = Migration(source_server_id=source_server_id, target_server_id=target_server_id, created_by=created_by, status='running')
+    db_session.add(migration)
+    db_session.commit()
+    db_session.refresh(migration)
+    logger.info(f"Migration {migration.id} of server {source_server_id} to {target_server_id} created by {created_by}.")
+    return migration
+
+def finish_migration(db_session: Session, migration_id: int, status: str = 'completed') -> Migration | None:
+    migration = db_session.get(Migration, migration_id)
+    if migration and migration.status == 'running':
+        migration.status = status
+        migration.finished_at = datetime.datetime.now(datetime.timezone.utc)
+        db_session.commit()
+        db_session.refresh(migration)
+    return migration
+
+def get_migration(migration_id: int) -> Migration | None:
+    with get_db() as db:
+        return db.get(Migration, migration_id)
 
-def count_user_keys(db_session: Session, user_id: int) -> int:
+def get_running_migration_ids() -> list[int]:
+    with get_db() as db:
+        return [row.id for row in db.query(Migration.id).filter(Migration.status == 'running')]
+
+def get_migration_chunk(source_server_id: int, protocols: list[str], chunk_size: int, after_subscription_id: int) -> list:
+    """Следующая пачка активных ключей сервера по возрастанию id:
+    (id, user_id, protocol, key_identifier, traffic_limit_gb, plan, quota_disabled).
+    """
+    with get_db() as db:
+        return db.query(
+            Subscription.id, Subscription.user_id, Subscription.protocol, Subscription.key_identifier,
+            User.traffic_limit_gb, User.plan, func.coalesce(TrafficUsage.quota_disabled, False).label("quota_disabled")
+        ).join(User, User.id == Subscription.user_id).outerjoin(TrafficUsage, TrafficUsage.user_id == Subscription.user_id).filter(
+            Subscription.server_id == source_server_id,
+            Subscription.protocol.in_(protocols),
+            Subscription.is_active == True, # noqa: E712
+            Subscription.id > after_subscription_id
+        ).order_by(Subscription.id.asc()).limit(chunk_size).all()
+
+def journal_begin_migration(migration_id: int, entries: list[dict]) -> dict[str, tuple[int, str]]:
+    """Записывает намерение добавить клиентов переноса. Для email, записанных прошлой (прерванной)
+    попыткой, возвращаются прежние UUID/пароль и инбаунд: клиент мог уже попасть в панель.
+    entries — словари с user_id, server_id, protocol, inbound_id, email, credential, replaces_email.
+    Возвращает email -> (id записи журнала, UUID/пароль, inbound_id).
+    """
+    emails = [entry["email"] for entry in entries]
+    with get_db() as db:
+        existing = {
+            row.email: row for row in db.query(IssuanceJournal.id, IssuanceJournal.email, IssuanceJournal.credential)
+            .filter(IssuanceJournal.email.in_(emails))
+        }
+        new_entries = [dict(entry, migration_id=migration_id, status='pending') for entry in entries if entry["email"] not in existing]
+        if new_entries:
+            db.execute(insert(IssuanceJournal), new_entries)
+        if existing:
+            db.query(IssuanceJournal).filter(IssuanceJournal.email.in_(list(existing))).update(
+                {IssuanceJournal.status: 'pending'}, synchronize_session=False
+            )
+        db.commit()
+        rows = db.query(IssuanceJournal.id, IssuanceJournal.email, IssuanceJournal.credential, IssuanceJournal.inbound_id).filter(
+            IssuanceJournal.email.in_(emails)
+        )
+        return {row.email: (row.id, row.credential, row.inbound_id) for row in rows}
+
+def commit_migration_chunk(migration_id: int, target_server_id: int, moves: list[dict], rolled_back_journal_ids: list[int],
+                           cursor_subscription_id: int, failed_count: int) -> set[int]:
+    """Одной транзакцией переводит ключи на новый сервер, закрывает записи журнала и двигает курсор переноса.
+
+    moves — словари с subscription_id, user_id, journal_id, inbound_id, email, key_data, carried_bytes (трафик прежнего
+    клиента, он добавляется к квоте пользователя). Ключи, отозванные за время обработки пачки, не переносятся.
+    Возвращает id перенесённых подписок.
+    """
+    with get_db() as db:
+        moved_ids = {
+            row.id for row in db.query(Subscription.id).filter(
+                Subscription.id.in_([move["subscription_id"] for move in moves]),
+                Subscription.is_active == True # noqa: E712
+            )
+        } if moves else set()
+        moved = [move for move in moves if move["subscription_id"] in moved_ids]
+        if moved:
+            # Массовый UPDATE не вызывает событий ORM, поэтому владельцев ключей отмечаем сами
+            _mark_subscriptions_changed(db, {move["user_id"] for move in moved})
+            db.execute(update(Subscription), [
+                {"id": move["subscription_id"], "server_id": target_server_id, "inbound_id": move["inbound_id"],
+                 "key_data": move["key_data"], "key_identifier": move["email"]}
+                for move in moved
+            ])
+            db.execute(update(IssuanceJournal), [{"id": move["journal_id"], "status": 'committed'} for move in moved])
+            _carry_traffic(db, moved)
+        rolled_back = rolled_back_journal_ids + [move["journal_id"] for move in moves if move["subscription_id"] not in moved_ids]
+        if rolled_back:
+            db.execute(update(IssuanceJournal), [{"id": journal_id, "status": 'rolled_back', "replaces_email": None} for journal_id in rolled_back])
+        migration = db.get(Migration, migration_id)
+        migration.cursor_subscription_id = cursor_subscription_id
+        migration.migrated_count += len(moved)
+        migration.failed_count += failed_count + len(moves) - len(moved)
+        db.commit()
+        return moved_ids
+
+def _carry_traffic(db_session: Session, moved: list[dict]) -> None:
+    """Прибавляет трафик прежних клиентов к квоте владельцев: иначе после переноса сумма по новым клиентам
+    начнётся с нуля и квота отключённого пользователя снимется."""
+    carried: dict[int, int] = {}
+    for move in moved:
+        carried[move["user_id"]] = carried.get(move["user_id"], 0) + move.get("carried_bytes", 0)
+    for user_id, carried_bytes in carried.items():
+        if not carried_bytes:
+            continue
+        updated = db_session.execute(
+            update(TrafficUsage).where(TrafficUsage.user_id == user_id)
+            .values(carried_bytes=TrafficUsage.carried_bytes + carried_bytes, used_bytes=TrafficUsage.used_bytes + carried_bytes)
+        ).rowcount
+        if not updated:
+            db_session.execute(insert(TrafficUsage).values(user_id=user_id, carried_bytes=carried_bytes, used_bytes=carried_bytes))
+
+def get_migration_replaced_clients(migration_id: int) -> list[tuple[int, str, str]]:
+    """(id записи журнала, протокол, email) прежних клиентов перенесённых ключей, ещё не удалённых из старого инбаунда."""
+    with get_db() as db:
+        return [tuple(row) for row in db.query(IssuanceJournal.id, IssuanceJournal.protocol, IssuanceJournal.replaces_email).filter(
+            IssuanceJournal.migration_id == migration_id,
+            IssuanceJournal.status == 'committed',
+            IssuanceJournal.replaces_email != None # noqa: E711
+        ).order_by(IssuanceJournal.id)]
+
+def clear_replaced_clients(journal_ids: list[int]) -> None:
+    if not journal_ids:
+        return
+    with get_db() as db:
+        db.execute(update(IssuanceJournal), [{"id": journal_id, "replaces_email": None} for journal_id in journal_ids])
+        db.commit()
+
+def get_user_keys(db_session: Session, user_id: int, active_only: bool = True) -> list[Subscription]:
+    query = db_session.query(Subscription).filter(Subscription.user_id == user_id)
+    if active_only:
+        query = query.filter(Subscription.is_active == True) # noqa: E712
+    return query.order_by(Subscription.created_at.asc()).all()
+
+def get_key_counts(db_session: Session, user_id: int) -> dict[str, int]:
+    """Активные ключи пользователя по протоколам (из user_key_counts, без COUNT по subscriptions)."""
+    rows = db_session.query(UserKeyCount.protocol, UserKeyCount.active_count).filter(UserKeyCount.user_id == user_id)
+    return {row.protocol: row.active_count for row in rows if row.active_count}
+
+def get_user(db_session: Session, user_id: int) -> User | None:
+    return db_session.get(User, user_id)
+
+def find_user_by_username(db_session: Session, username: str) -> User | None:
+    return db_session.query(User).filter(
+        func.lower(User.username) == username.lstrip('@').lower()
+    ).first()
+
+def get_subscription_by_identifier(db_session: Session, key_identifier: str) -> Subscription | None:
     return db_session.query(Subscription).filter(
-        Subscription.user_id == user_id
-    ).count()
\ No newline at end of file
+        Subscription.key_identifier == key_identifier
+    ).order_by(Subscription.id.desc()).first()
+
+def get_or_create_sub_token(db_session: Session, user_id: int) -> str | None:
+    """Токен ссылки-подписки пользователя. None, если пользователя нет в базе."""
+    user = db_session.get(User, user_id)
+    if user is None:
+        return None
+    if not user.sub_token:
+        user.sub_token = base64.urlsafe_b64encode(os.urandom(18)).decode('utf-8')
+        db_session.commit()
+    return user.sub_token
+
+def get_sub_tokens() -> dict[str, int]:
+    """Все выданные токены подписок: токен -> users.id."""
+    with get_db() as db:
+        return {token: user_id for user_id, token in db.query(User.id, User.sub_token).filter(User.sub_token.isnot(None))}
+
+def get_user_id_by_sub_token(token: str) -> int | None:
+    with get_db() as db:
+        return db.query(User.id).filter(User.sub_token == token).scalar()
+
+def get_inbound_shards() -> list[tuple[int, int, str, int]]:
+    """(inbound_id, server_id, protocol, port) инбаундов, созданных ботом, в порядке создания."""
+    with get_db() as db:
+        return [tuple(row) for row in db.query(
+            InboundShard.inbound_id, InboundShard.server_id, InboundShard.protocol, InboundShard.port
+        ).order_by(InboundShard.created_at.asc(), InboundShard.inbound_id.asc())]
+
+def add_inbound_shard(inbound_id: int, server_id: int, protocol: str, port: int) -> None:
+    with get_db() as db:
+        db.add(InboundShard(inbound_id=inbound_id, server_id=server_id, protocol=protocol, port=port))
+        db.commit()
+
+def get_active_key_rows(user_id: int) -> list[tuple[int, str, str, str, datetime.datetime]]:
+    """(server_id, protocol, key_identifier, key_data, created_at) активных ключей пользователя."""
+    with get_db() as db:
+        return db.query(
+            Subscription.server_id, Subscription.protocol, Subscription.key_identifier,
+            Subscription.key_data, Subscription.created_at
+        ).filter(
+            Subscription.user_id == user_id,
+            Subscription.is_active == True # noqa: E712
+        ).order_by(Subscription.created_at.asc(), Subscription.id.asc()).all()
+
+def get_quota_states(user_ids: list[int], chunk_size: int = 500) -> dict[int, tuple]:
+    """users.id -> (traffic_limit_gb, plan, used_bytes, warned_level, quota_disabled, carried_bytes) одним запросом на пачку."""
+    states = {}
+    with get_db() as db:
+        for start in range(0, len(user_ids), chunk_size):
+            rows = db.query(
+                User.id, User.traffic_limit_gb, User.plan,
+                TrafficUsage.used_bytes, TrafficUsage.warned_level, TrafficUsage.quota_disabled, TrafficUsage.carried_bytes
+            ).outerjoin(TrafficUsage, TrafficUsage.user_id == User.id).filter(User.id.in_(user_ids[start:start + chunk_size]))
+            for user_id, limit_gb, plan, used_bytes, warned_level, quota_disabled, carried_bytes in rows:
+                states[user_id] = (limit_gb, plan, used_bytes or 0, warned_level or 0, bool(quota_disabled), carried_bytes or 0)
+    return states
+
+def save_traffic_usage(rows: list[tuple[int, int, int, bool]]) -> None:
+    """Сохраняет (user_id, used_bytes, warned_level, quota_disabled) одной транзакцией."""
+    if not rows:
+        return
+    values = [
+        {"user_id": user_id, "used_bytes": used_bytes, "warned_level": warned_level, "quota_disabled": quota_disabled}
+        for user_id, used_bytes, warned_level, quota_disabled in rows
+    ]
+    with get_db() as db:
+        existing = set()
+        for start in range(0, len(values), 500):
+            chunk_ids = [value["user_id"] for value in values[start:start + 500]]
+            existing.update(row.user_id for row in db.query(TrafficUsage.user_id).filter(TrafficUsage.user_id.in_(chunk_ids)))
+        # Пакетные UPDATE по первичному ключу и INSERT вместо merge по строке
+        to_update = [value for value in values if value["user_id"] in existing]
+        to_insert = [value for value in values if value["user_id"] not in existing]
+        if to_update:
+            db.execute(update(TrafficUsage), to_update)
+        if to_insert:
+            db.execute(insert(TrafficUsage), to_insert)
+        db.commit()
+
+def get_traffic_usage(db_session: Session, user_id: int) -> TrafficUsage | None:
+    return db_session.get(TrafficUsage, user_id)
+
+def set_traffic_limit(db_session: Session, user_id: int, traffic_limit_gb: int | None, plan: str | None) -> User | None:
+    user = db_session.get(User, user_id)
+    if user is None:
+        return None
+    user.traffic_limit_gb = traffic_limit_gb
+    user.plan = plan
+    # Лимит меняет квоту ключей пользователя: подписчики (проверка квот, в том числе на
+    # воркере-лидере) пересчитают его при ближайшей проверке
+    _mark_subscriptions_changed(db_session, (user_id,))
+    db_session.commit()
+    return user
+
+def get_active_key_owners() -> list[tuple[int, str, int | None, int, str]]:
+    """(server_id, protocol, inbound_id, user_id, key_identifier) активных ключей 3x-ui — для индекса клиентов."""
+    with get_db() as db:
+        return db.query(
+            Subscription.server_id, Subscription.protocol, Subscription.inbound_id, Subscription.user_id, Subscription.key_identifier
+        ).filter(
+            Subscription.is_active == True, # noqa: E712
+            Subscription.protocol.in_(("vless", "shadowsocks"))
+        ).all()
+
+def deactivate_subscriptions(db_session: Session, subscription_ids: list[int]) -> int:
+    """Помечает подписки неактивными одной транзакцией. Возвращает число изменённых строк."""
+    if not subscription_ids:
+        return 0
+    # Массовый UPDATE не вызывает событий ORM, поэтому владельцев ключей отмечаем и счётчики меняем сами
+    _mark_subscriptions_changed(db_session, {
+        row.user_id for row in db_session.query(Subscription.user_id).filter(Subscription.id.in_(subscription_ids))
+    })
+    deltas = {
+        (row.user_id, row.protocol): -row.count for row in db_session.query(
+            Subscription.user_id, Subscription.protocol, func.count().label("count")
+        ).filter(
+            Subscription.id.in_(subscription_ids),
+            Subscription.is_active == True # noqa: E712
+        ).group_by(Subscription.user_id, Subscription.protocol)
+    }
+    updated = db_session.query(Subscription).filter(
+        Subscription.id.in_(subscription_ids),
+        Subscription.is_active == True # noqa: E712
+    ).update({Subscription.is_active: False}, synchronize_session=False)
+    _adjust_key_counts(db_session.connection(), deltas)
+    db_session.commit()
+    logger.info(f"Deactivated {updated} subscriptions: {subscription_ids}")
+    return updated
+
+def iter_active_key_chunks(server_id: int, protocol: str, chunk_size: int):
+    """Отдаёт (id, user_id, inbound_id, key_identifier, key_data) активных ключей сервера пачками по возрастанию id."""
+    last_id = 0
+    while True:
+        with get_db() as db:
+            rows = db.query(
+                Subscription.id, Subscription.user_id, Subscription.inbound_id, Subscription.key_identifier, Subscription.key_data
+            ).filter(
+                Subscription.server_id == server_id,
+                Subscription.protocol == protocol,
+                Subscription.is_active == True, # noqa: E712
+                Subscription.id > last_id
+            ).order_by(Subscription.id.asc()).limit(chunk_size).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1].id
+
+def update_key_links(updates: list[tuple[int, int, str]]) -> None:
+    """Перезаписывает key_data ключей одним UPDATE: [(subscription_id, user_id, key_data)]."""
+    if not updates:
+        return
+    with get_db() as db:
+        _mark_subscriptions_changed(db, {user_id for _, user_id, _ in updates})
+        db.execute(update(Subscription), [{"id": subscription_id, "key_data": key_data} for subscription_id, _, key_data in updates])
+        db.commit()
+
+def get_user_id_chunk(db_session: Session, chunk_size: int, after_user_id: int = 0, include_blocked: bool = False) -> list[int]:
+    """Следующие chunk_size ID пользователей после after_user_id по возрастанию (keyset-пагинация, без OFFSET)."""
+    query = db_session.query(User.id).filter(User.id > after_user_id)
+    if not include_blocked:
+        query = query.filter(User.is_blocked == False) # noqa: E712
+    return [row.id for row in query.order_by(User.id.asc()).limit(chunk_size)]
+
+def get_broadcast(broadcast_id: int) -> Broadcast | None:
+    with get_db() as db:
+        return db.get(Broadcast, broadcast_id)
+
+def get_broadcast_chunk(broadcast_id: int, chunk_size: int, after_user_id: int) -> tuple[Broadcast | None, list[int], set[int]]:
+    """Одной короткой сессией: рассылка, следующая пачка получателей и уже доставленные из неё.
+
+    Память и блокировки не зависят от размера таблицы пользователей.
+    """
+    with get_db() as db:
+        broadcast = db.get(Broadcast, broadcast_id)
+        if broadcast is None or broadcast.status != 'running':
+            return broadcast, [], set()
+        user_ids = get_user_id_chunk(db, chunk_size, after_user_id)
+        # После перезапуска часть пачки может быть уже доставлена
+        delivered = get_delivered_user_ids(db, broadcast_id, user_ids) if user_ids else set()
+        return broadcast, user_ids, delivered
+
+def create_broadcast(db_session: Session, text: str, created_by: int) -> Broadcast:
+    broadcast = Broadcast(text=text, created_by=created_by, status='running')
+    db_session.add(broadcast)
+    db_session.commit()
+    db_session.refresh(broadcast)
+    logger.info(f"Broadcast {broadcast.id} created by {created_by}.")
+    return broadcast
+
+def get_delivered_user_ids(db_session: Session, broadcast_id: int, user_ids: list[int]) -> set[int]:
+    rows = db_session.query(BroadcastDelivery.user_id).filter(
+        BroadcastDelivery.broadcast_id == broadcast_id,
+        BroadcastDelivery.user_id.in_(user_ids)
+    )
+    return {row.user_id for row in rows}
+
+def record_broadcast_chunk(broadcast_id: int, results: list[tuple[int, str]], cursor_user_id: int) -> None:
+    """Одной транзакцией сохраняет статусы доставки пачки, блокировки и курсор рассылки."""
+    with get_db() as db:
+        broadcast = db.get(Broadcast, broadcast_id)
+        # Пакетный INSERT вместо merge по строке; уже записанные (рассылку перехватил
+        # другой воркер) пропускаются
+        delivered = get_delivered_user_ids(db, broadcast_id, [user_id for user_id, _ in results]) if results else set()
+        results = [(user_id, status) for user_id, status in results if user_id not in delivered]
+        if results:
+            db.execute(insert(BroadcastDelivery), [
+                {"broadcast_id": broadcast_id, "user_id": user_id, "status": status} for user_id, status in results
+            ])
+        blocked_ids = [user_id for user_id, status in results if status == 'blocked']
+        if blocked_ids:
+            db.query(User).filter(User.id.in_(blocked_ids)).update({User.is_blocked: True}, synchronize_session=False)
+        broadcast.sent_count += sum(1 for _, status in results if status == 'sent')
+        broadcast.failed_count += sum(1 for _, status in results if status == 'failed')
+        broadcast.blocked_count += len(blocked_ids)
+        broadcast.cursor_user_id = cursor_user_id
+        db.commit()
+
+def finish_broadcast(db_session: Session, broadcast_id: int, status: str = 'completed') -> Broadcast | None:
+    broadcast = db_session.get(Broadcast, broadcast_id)
+    if broadcast and broadcast.status == 'running':
+        broadcast.status = status
+        broadcast.finished_at = datetime.datetime.now(datetime.timezone.utc)
+        db_session.commit()
+        db_session.refresh(broadcast)
+    return broadcast
+
+# --- Общее состояние воркеров (режим --workers) ---
+
+def try_lease(key: str, owner: str, ttl: float) -> bool:
+    """Берёт или продлевает аренду key для owner на ttl секунд. False — её держит другой владелец."""
+    now = time.time()
+    with engine.begin() as conn:
+        updated = conn.execute(
+            update(SharedState)
+            .where(SharedState.key == key, or_(SharedState.owner == owner, SharedState.expires_at < now))
+            .values(owner=owner, expires_at=now + ttl)
+        ).rowcount
+    if updated:
+        return True
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(SharedState).values(key=key, owner=owner, expires_at=now + ttl))
+        return True
+    except IntegrityError:
+        # Аренду только что взял другой воркер
+        return False
+
+def release_lease(key: str, owner: str) -> None:
+    with engine.begin() as conn:
+        conn.execute(SharedState.__table__.delete().where(SharedState.key == key, SharedState.owner == owner))
+
+def get_shared_value(key: str) -> str | None:
+    with engine.connect() as conn:
+        return conn.execute(
+            select(SharedState.value).where(SharedState.key == key, SharedState.expires_at >= time.time())
+        ).scalar()
+
+def set_shared_value(key: str, value: str, ttl: float) -> None:
+    expires_at = time.time() + ttl
+    with engine.begin() as conn:
+        if conn.execute(update(SharedState).where(SharedState.key == key).values(value=value, owner=None, expires_at=expires_at)).rowcount:
+            return
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(SharedState).values(key=key, value=value, expires_at=expires_at))
+    except IntegrityError:
+        with engine.begin() as conn:
+            conn.execute(update(SharedState).where(SharedState.key == key).values(value=value, owner=None, expires_at=expires_at))
+
+def delete_shared_value(key: str, value: str | None = None) -> None:
+    """Удаляет значение; с value — только если оно не успело смениться."""
+    condition = SharedState.key == key
+    if value is not None:
+        condition &= SharedState.value == value
+    with engine.begin() as conn:
+        conn.execute(SharedState.__table__.delete().where(condition))
+
+def last_subscription_change_id() -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.max(SubscriptionChange.id))).scalar() or 0
+
+def get_subscription_changes(after_id: int, origin: str, missing_ids=()) -> tuple[int, set[int], set[int]]:
+    """(последний id, users.id, пропущенные id) изменений ключей после after_id, сделанных другими воркерами.
+
+    В PostgreSQL id из последовательности выдаётся при INSERT, а видна строка после коммита: транзакция
+    с меньшим id может закоммититься позже большего. Поэтому id ниже последнего, которых ещё нет в
+    ленте, возвращаются как пропущенные, и следующий вызов перечитывает их (missing_ids). Номера
+    откаченных транзакций не появятся никогда — когда перестать их ждать, решает вызывающий.
+    """
+    condition = SubscriptionChange.id > after_id
+    if missing_ids:
+        condition = or_(condition, SubscriptionChange.id.in_(list(missing_ids)))
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select(SubscriptionChange.id, SubscriptionChange.user_id, SubscriptionChange.origin)
+            .where(condition).order_by(SubscriptionChange.id)
+        ).all()
+    seen_ids = {row.id for row in rows}
+    last_id = max(seen_ids | {after_id})
+    missing = (set(missing_ids) | set(range(after_id + 1, last_id))) - seen_ids
+    return last_id, {row.user_id for row in rows if row.origin != origin}, missing
+
+def prune_subscription_changes(older_than: datetime.datetime) -> int:
+    with engine.begin() as conn:
+        return conn.execute(SubscriptionChange.__table__.delete().where(SubscriptionChange.created_at < older_than)).rowcount
+
+# --- Хранение и выгрузка (retention.py, export.py) ---
+
+_ARCHIVED_COLUMNS = ("id", "user_id", "server_id", "protocol", "key_data", "key_identifier", "inbound_id",
+                     "created_at", "expires_at", "is_active", "duration_months")
+
+def archive_subscriptions(created_before: datetime.datetime, after_id: int, batch_size: int) -> tuple[int | None, int]:
+    """Переносит в subscriptions_archive пачку отозванных ключей, выданных до created_before, с id > after_id.
+
+    Возвращает (последний просмотренный id или None, если таких строк больше нет; сколько перенесено).
+    Одна короткая транзакция на пачку: запись в базу ждёт не дольше одной пачки.
+    """
+    with engine.begin() as conn:
+        ids = list(conn.execute(
+            select(Subscription.id).where(
+                Subscription.id > after_id,
+                Subscription.is_active == False, # noqa: E712
+                Subscription.created_at < created_before
+            ).order_by(Subscription.id).limit(batch_size)
+        ).scalars())
+        if not ids:
+            return None, 0
+        # Ключ могли включить обратно, пока шла выборка: переносим только всё ещё отозванные
+        condition = Subscription.id.in_(ids) & (Subscription.is_active == False) # noqa: E712
+        conn.execute(insert(SubscriptionArchive).from_select(
+            list(_ARCHIVED_COLUMNS),
+            select(*(Subscription.__table__.c[name] for name in _ARCHIVED_COLUMNS)).where(condition)
+        ))
+        archived = conn.execute(Subscription.__table__.delete().where(condition)).rowcount
+    return ids[-1], archived
+
+def sqlite_free_ratio() -> float:
+    """Доля свободных страниц в файле SQLite (столько освободит VACUUM)."""
+    with engine.connect() as conn:
+        page_count = conn.exec_driver_sql("PRAGMA page_count").scalar() or 0
+        freelist_count = conn.exec_driver_sql("PRAGMA freelist_count").scalar() or 0
+    return freelist_count / page_count if page_count else 0.0
+
+def sqlite_maintenance(statement: str) -> None:
+    """ANALYZE или VACUUM вне транзакции (VACUUM внутри транзакции SQLite не выполняет)."""
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql(statement)
+
+def iter_table_chunks(table, columns: list[str], chunk_size: int):
+    """Отдаёт строки таблицы пачками по возрастанию первичного ключа, каждую — отдельным коротким запросом.
+
+    Длинного читающего запроса нет, поэтому выгрузка не мешает записи и контрольным точкам WAL.
+    """
+    key = table.primary_key.columns.values()[0]
+    selected = [table.c[name] for name in columns]
+    key_index = columns.index(key.name)
+    last_key = None
+    while True:
+        query = select(*selected).order_by(key).limit(chunk_size)
+        if last_key is not None:
+            query = query.where(key > last_key)
+        with engine.connect() as conn:
+            rows = conn.execute(query).all()
+        if not rows:
+            return
+        yield rows
+        last_key = rows[-1][key_index]
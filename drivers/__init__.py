@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Драйверы протоколов и их реестр.
+
+Драйвер регистрируется по имени протокола — тому же, что в subscriptions.protocol и в
+ServerRecord.protocols. Новый протокол — это модуль с подклассом ProtocolDriver и вызов
+register(); кнопки выбора протокола и обработчики берут список протоколов и их
+возможности (Capabilities) из реестра.
+"""
+import asyncio
+import logging
+from typing import Tuple, Union
+
+import server_registry
+import tracing
+from drivers.base import Capabilities, KeyRequest, ProtocolDriver
+
+logger = logging.getLogger(__name__)
+
+_drivers: dict[str, ProtocolDriver] = {}
+
+
+def register(driver: ProtocolDriver) -> None:
+    _drivers[driver.protocol] = driver
+
+
+def get(protocol: str) -> ProtocolDriver | None:
+    return _drivers.get(protocol)
+
+
+def protocols() -> tuple[str, ...]:
+    """Все зарегистрированные протоколы в порядке регистрации."""
+    return tuple(_drivers)
+
+
+def available() -> list[ProtocolDriver]:
+    """Драйверы, для которых в реестре серверов есть хотя бы один сервер."""
+    return [driver for driver in _drivers.values() if server_registry.first_for_protocol(driver.protocol)]
+
+
+async def close_all() -> None:
+    await asyncio.gather(*(driver.close() for driver in _drivers.values()))
+
+
+def _resolve(server_id: int, protocol: str) -> tuple[server_registry.ServerRecord, ProtocolDriver] | None:
+    server = server_registry.get(server_id)
+    if not server:
+        logger.error(f"Server config not found for ID: {server_id}")
+        return None
+    driver = _drivers.get(protocol)
+    if driver is None:
+        logger.error(f"Unknown protocol '{protocol}' requested for server {server_id}.")
+        return None
+    return server, driver
+
+
+async def create_key(server_id: int, protocol: str, user_telegram_id: int, user_username: str | None,
+                     total_traffic_gb: int | None = None) -> Tuple[Union[str, None], Union[str, None]]:
+    resolved = _resolve(server_id, protocol)
+    if resolved is None:
+        return None, None
+    server, driver = resolved
+    with tracing.span("driver.create", f"{protocol} server {server_id}"):
+        key_data, key_identifier = await driver.create(server, user_telegram_id, user_username, total_traffic_gb)
+    if key_data and key_identifier:
+        logger.info(f"{protocol} key created successfully for server {server_id}.")
+    else:
+        logger.error(f"Failed to create {protocol} key for server {server_id}.")
+    return key_data, key_identifier
+
+
+async def delete_key(server_id: int, protocol: str, key_identifier: str) -> bool:
+    resolved = _resolve(server_id, protocol)
+    if resolved is None:
+        return False
+    server, driver = resolved
+    if not key_identifier:
+        logger.error(f"Cannot delete {protocol} key: key_identifier is missing for server {server_id}.")
+        return False
+    with tracing.span("driver.delete", f"{protocol} server {server_id}"):
+        return await driver.delete(server, key_identifier)
+
+
+async def get_key_traffic(server_id: int, protocol: str, key_identifier: str) -> dict | None:
+    resolved = _resolve(server_id, protocol)
+    if resolved is None:
+        return None
+    server, driver = resolved
+    if not driver.capabilities.traffic:
+        logger.warning(f"Traffic statistics are not supported for protocol '{protocol}'.")
+        return None
+    with tracing.span("driver.traffic", f"{protocol} server {server_id}"):
+        return await driver.traffic(server, key_identifier)
+
+
+# Встроенные драйверы; порядок регистрации — порядок кнопок выбора протокола
+from drivers.xui import ShadowsocksDriver, VlessDriver # noqa: E402
+from drivers.outline import OutlineDriver # noqa: E402
+
+register(VlessDriver())
+register(ShadowsocksDriver())
+register(OutlineDriver())
+
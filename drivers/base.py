@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Интерфейс драйвера протокола."""
+import abc
+import asyncio
+from dataclasses import dataclass
+from typing import Tuple, Union
+
+from server_registry import ServerRecord
+
+
+@dataclass(frozen=True, slots=True)
+class Capabilities:
+    # create_many добавляет ключи одним запросом к серверу, а не по одному
+    bulk_create: bool = False
+    # traffic() отдаёт статистику ключа
+    traffic: bool = False
+    # Сервер сам ограничивает трафик ключа лимитом, переданным в create()
+    traffic_limit: bool = False
+
+
+@dataclass(frozen=True, slots=True)
+class KeyRequest:
+    user_telegram_id: int
+    user_username: str | None = None
+    total_traffic_gb: int | None = None
+
+
+class ProtocolDriver(abc.ABC):
+    """Выдача, удаление и статистика ключей одного протокола.
+
+    create() возвращает (ссылка ключа, идентификатор ключа на сервере); при ошибке ссылка None.
+    Идентификатор сохраняется в subscriptions.key_identifier и передаётся в delete() и traffic().
+    create(), delete() и health() абстрактные: драйвер без них не создастся (TypeError уже в
+    drivers.register(Driver())), а не упадёт при первом вызове.
+    """
+    protocol: str = ""
+    # Подпись кнопки выбора протокола
+    title: str = ""
+    capabilities: Capabilities = Capabilities()
+
+    def is_configured(self, server: ServerRecord) -> bool:
+        return self.protocol in server.protocols
+
+    @abc.abstractmethod
+    async def create(self, server: ServerRecord, user_telegram_id: int, user_username: str | None,
+                     total_traffic_gb: int | None = None) -> Tuple[Union[str, None], Union[str, None]]:
+        ...
+
+    async def create_many(self, server: ServerRecord, requests: list[KeyRequest],
+                          concurrency: int = 5) -> list[Tuple[Union[str, None], Union[str, None]]]:
+        """Выдаёт несколько ключей; результаты в порядке requests. По умолчанию — create() с ограниченной параллельностью."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def create_one(request: KeyRequest):
+            async with semaphore:
+                return await self.create(server, request.user_telegram_id, request.user_username, request.total_traffic_gb)
+
+        return list(await asyncio.gather(*(create_one(request) for request in requests)))
+
+    @abc.abstractmethod
+    async def delete(self, server: ServerRecord, key_identifier: str) -> bool:
+        ...
+
+    async def traffic(self, server: ServerRecord, key_identifier: str) -> dict | None:
+        """{"up", "down", "total" (лимит, 0 — без лимита), "enable"} или None."""
+        return None
+
+    @abc.abstractmethod
+    async def health(self, server: ServerRecord) -> bool:
+        """Сервер протокола отвечает."""
+
+    async def close(self) -> None:
+        """Закрывает пул соединений драйвера."""
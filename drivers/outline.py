@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""Драйвер Outline (Shadowsocks Outline Server, management API по outline_api_url)."""
+import logging
+import time
+from typing import Tuple, Union
+
+import httpx
+
+from drivers.base import Capabilities, ProtocolDriver
+from server_registry import ServerRecord
+
+logger = logging.getLogger(__name__)
+
+_GB = 1024 * 1024 * 1024
+
+
+class OutlineDriver(ProtocolDriver):
+    protocol = "outline"
+    title = "🔐 Outline"
+    capabilities = Capabilities(traffic=True, traffic_limit=True)
+
+    def __init__(self):
+        # Свой пул соединений: серверы Outline не связаны с панелью 3x-ui
+        self._client: httpx.AsyncClient | None = None
+        # Подменяемый транспорт (локальная имитация Outline в benchmarks/)
+        self._transport: httpx.AsyncBaseTransport | None = None
+
+    def is_configured(self, server: ServerRecord) -> bool:
+        return bool(server.outline_api_url)
+
+    def _http(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            # Сертификат management API самоподписанный
+            self._client = httpx.AsyncClient(
+                verify=False,
+                timeout=15,
+                limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+                transport=self._transport
+            )
+        return self._client
+
+    async def set_transport(self, transport: httpx.AsyncBaseTransport | None) -> None:
+        await self.close()
+        self._transport = transport
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def create(self, server: ServerRecord, user_telegram_id: int, user_username: str | None,
+                     total_traffic_gb: int | None = None) -> Tuple[Union[str, None], Union[str, None]]:
+        if not self.is_configured(server):
+            logger.error(f"Outline API URL not configured for server {server.id}")
+            return None, None
+
+        key_name = f"tg_{user_telegram_id}"
+        if user_username:
+            cleaned_username = ''.join(c if c.isalnum() else '_' for c in user_username).lower()
+            key_name += f"_{cleaned_username}"
+        key_name += f"_{int(time.time())}"
+
+        logger.info(f"Creating Outline key via API: {server.outline_api_url}")
+        try:
+            response = await self._http().post(f"{server.outline_api_url}/access-keys", json={"name": key_name})
+            response.raise_for_status()
+            key_data_json = response.json()
+        except httpx.HTTPError as e:
+            logger.error(f"Error connecting to Outline API for server {server.id} during key creation: {e}")
+            return None, None
+        except ValueError:
+            logger.error(f"Outline API returned non-JSON response for server {server.id}: {response.text[:300]}")
+            return None, None
+
+        key_url = key_data_json.get("accessUrl")
+        key_id = key_data_json.get("id")
+        if not key_url or key_id is None:
+            logger.error(f"Outline API returned unexpected data format. Response: {response.text}")
+            return None, None
+        logger.info(f"Outline key created successfully. ID: {key_id}, Name: {key_name}")
+
+        if total_traffic_gb:
+            try:
+                limit_response = await self._http().put(
+                    f"{server.outline_api_url}/access-keys/{key_id}/data-limit",
+                    json={"limit": {"bytes": total_traffic_gb * _GB}}
+                )
+                limit_response.raise_for_status()
+            except httpx.HTTPError as e:
+                # Ключ уже создан: выдаём его без лимита, а не теряем
+                logger.warning(f"Failed to set {total_traffic_gb} GB data limit on Outline key {key_id} of server {server.id}: {e}")
+        return key_url, str(key_id)
+
+    async def delete(self, server: ServerRecord, key_identifier: str) -> bool:
+        if not self.is_configured(server):
+            logger.error(f"Outline API URL not configured for server {server.id}")
+            return False
+        if not key_identifier or not key_identifier.isdigit():
+            logger.error(f"Invalid Outline key_identifier format for deletion: {key_identifier}. Expected integer ID.")
+            return False
+
+        logger.info(f"Deleting Outline key via API. ID: {key_identifier}")
+        try:
+            response = await self._http().delete(f"{server.outline_api_url}/access-keys/{key_identifier}")
+        except httpx.HTTPError as e:
+            logger.error(f"Error connecting to Outline API for server {server.id} during key deletion: {e}")
+            return False
+        if response.status_code == 404:
+            logger.warning(f"Outline key {key_identifier} not found on the server (already deleted?). Status: 404")
+            return True
+        if response.is_success:
+            logger.info(f"Outline key {key_identifier} deleted successfully via API.")
+            return True
+        logger.error(f"HTTP error during Outline key deletion {key_identifier}: {response.status_code} - {response.text}")
+        return False
+
+    async def traffic(self, server: ServerRecord, key_identifier: str) -> dict | None:
+        # Outline считает только суммарный трафик ключа, без разделения на up/down
+        try:
+            response = await self._http().get(f"{server.outline_api_url}/metrics/transfer")
+            response.raise_for_status()
+            transferred = response.json().get("bytesTransferredByUserId", {})
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Failed to get Outline traffic of key {key_identifier} on server {server.id}: {e}")
+            return None
+        return {"up": 0, "down": transferred.get(str(key_identifier), 0), "total": 0, "enable": True}
+
+    async def health(self, server: ServerRecord) -> bool:
+        if not self.is_configured(server):
+            return False
+        try:
+            response = await self._http().get(f"{server.outline_api_url}/server")
+        except httpx.HTTPError:
+            return False
+        return response.is_success
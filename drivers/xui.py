@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""Драйверы VLESS и Shadowsocks панели 3x-ui.
+
+Оба протокола работают через одну панель, поэтому пул соединений, сессия и кэш инбаундов
+общие и живут в vpn_connector; драйвер отвечает за формат email и проверку настроек.
+"""
+import abc
+import base64
+import logging
+import os
+import re
+from typing import Tuple, Union
+
+import config
+import client_index
+import inbound_pool
+import link_templates
+import vpn_connector
+from drivers.base import Capabilities, KeyRequest, ProtocolDriver
+from server_registry import ServerRecord
+
+logger = logging.getLogger(__name__)
+
+
+class XuiDriver(ProtocolDriver):
+    capabilities = Capabilities(bulk_create=True, traffic=True, traffic_limit=True)
+
+    def is_configured(self, server: ServerRecord) -> bool:
+        return server.inbound_id(self.protocol) is not None
+
+    @abc.abstractmethod
+    def _make_email(self, user_telegram_id: int, user_username: str | None):
+        """Функция, возвращающая новый случайный email клиента."""
+
+    async def draft(self, server: ServerRecord, user_telegram_id: int, user_username: str | None,
+                    total_traffic_gb: int | None) -> vpn_connector.ClientDraft | None:
+        inbound_ids = inbound_pool.inbound_ids(server, self.protocol)
+        if vpn_connector.refuse_if_over_limit(inbound_ids, user_telegram_id):
+            return None
+        email = vpn_connector.generate_unique_email(inbound_ids, self._make_email(user_telegram_id, user_username))
+        if not email:
+            logger.error(f"Could not generate a unique client email for user {user_telegram_id} in inbounds {inbound_ids}.")
+            return None
+        inbound_id = await vpn_connector.choose_inbound(server, self.protocol)
+        credential = vpn_connector.new_credential(server, self.protocol)
+        return vpn_connector.make_draft(server, self.protocol, user_telegram_id, email, credential, total_traffic_gb, inbound_id=inbound_id)
+
+    async def create(self, server: ServerRecord, user_telegram_id: int, user_username: str | None,
+                     total_traffic_gb: int | None = None) -> Tuple[Union[str, None], Union[str, None]]:
+        if not self.is_configured(server):
+            logger.error(f"3x-ui {self.protocol} is not configured for server {server.id} (inbound ID or XUI_SHADOWSOCKS_MASTER_KEY).")
+            return None, None
+        reused = await vpn_connector.reuse_orphan(server, self.protocol, user_telegram_id)
+        if reused:
+            return reused
+        draft = await self.draft(server, user_telegram_id, user_username, total_traffic_gb)
+        if draft is None:
+            return None, None
+        return await vpn_connector.issue_client(draft, user_telegram_id)
+
+    async def create_many(self, server: ServerRecord, requests: list[KeyRequest],
+                          concurrency: int = 5) -> list[Tuple[Union[str, None], Union[str, None]]]:
+        if not self.is_configured(server):
+            logger.error(f"3x-ui {self.protocol} is not configured for server {server.id} (inbound ID or XUI_SHADOWSOCKS_MASTER_KEY).")
+            return [(None, None)] * len(requests)
+        drafts = []
+        for request in requests:
+            draft = await self.draft(server, request.user_telegram_id, request.user_username, request.total_traffic_gb)
+            if draft is not None:
+                # Резервируем email сразу: следующий запрос того же пользователя учтёт его в лимите,
+                # а выбор инбаунда — в числе клиентов
+                client_index.register(draft.inbound_id, draft.email, draft.user_telegram_id, credential=draft.credential)
+            drafts.append(draft)
+        # Один addClient на инбаунд: пачка могла разойтись по нескольким
+        by_inbound: dict[int, list[vpn_connector.ClientDraft]] = {}
+        for draft in drafts:
+            if draft is not None:
+                by_inbound.setdefault(draft.inbound_id, []).append(draft)
+        results = {}
+        for inbound_drafts in by_inbound.values():
+            for draft, result in zip(inbound_drafts, await vpn_connector.issue_clients(inbound_drafts, concurrency=concurrency)):
+                results[draft.email] = result
+        return [results[draft.email] if draft is not None else (None, None) for draft in drafts]
+
+    async def delete(self, server: ServerRecord, key_identifier: str) -> bool:
+        inbound_id = server.inbound_id(self.protocol)
+        if inbound_id is None:
+            logger.error(f"3x-ui {self.protocol} inbound ID not configured for server {server.id}. Cannot delete key via API.")
+            return False
+        # Ключ мог попасть в любой инбаунд пула: сначала индекс клиентов, затем панель.
+        # Если его нет ни в одном, удаление из основного вернёт «не найден»
+        inbound_id = (inbound_pool.locate(server, self.protocol, key_identifier)
+                      or await vpn_connector.find_client_inbound(server, self.protocol, key_identifier) or inbound_id)
+        return await vpn_connector.delete_client(inbound_id, key_identifier)
+
+    async def traffic(self, server: ServerRecord, key_identifier: str) -> dict | None:
+        return await vpn_connector.get_client_traffic(key_identifier)
+
+    async def health(self, server: ServerRecord) -> bool:
+        inbound_id = server.inbound_id(self.protocol)
+        return inbound_id is not None and await vpn_connector.inbound_reachable(inbound_id)
+
+    async def close(self) -> None:
+        await vpn_connector.close()
+
+
+class VlessDriver(XuiDriver):
+    protocol = "vless"
+    title = "⚡ VLESS Reality"
+
+    def _make_email(self, user_telegram_id: int, user_username: str | None):
+        base_email_name = f"tg_{user_telegram_id}"
+        if user_username:
+            cleaned_username = ''.join(c if c.isalnum() else '_' for c in user_username).lower()
+            base_email_name += f"_{cleaned_username}"
+
+        def make_email() -> str:
+            random_suffix = base64.urlsafe_b64encode(os.urandom(10)).decode('utf-8').rstrip('=')
+            return f"{base_email_name}_{random_suffix}@bot.local"
+        return make_email
+
+
+class ShadowsocksDriver(XuiDriver):
+    protocol = "shadowsocks"
+    title = "👻 Shadowsocks"
+
+    def is_configured(self, server: ServerRecord) -> bool:
+        if server.shadowsocks is None:
+            return False
+        # Методам Shadowsocks 2022 нужен мастер-ключ инбаунда
+        return not link_templates.is_ss2022(server.shadowsocks.method) or bool(config.get_settings().panel.shadowsocks_master_key)
+
+    def _make_email(self, user_telegram_id: int, user_username: str | None):
+        cleaned_username = re.sub(r'[^a-zA-Z0-9_]', '', user_username) if user_username else ""
+
+        def make_tag() -> str:
+            random_suffix = base64.urlsafe_b64encode(os.urandom(4)).decode('utf-8').rstrip('=')
+            return f"ss_{cleaned_username}_{user_telegram_id}_{random_suffix}"
+        return make_tag
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Выгрузка данных для отчётов (/export): пользователи, ключи и трафик в CSV (gzip).
+
+Таблица читается пачками по EXPORT_CHUNK_SIZE строк по первичному ключу, каждая пачка —
+отдельным коротким запросом в потоке to_thread, и сразу дописывается в сжатый файл. Память
+не зависит от размера таблицы, event loop бота не блокируется, а запись в базу не ждёт
+выгрузку (в SQLite нет долгой читающей транзакции, мешающей контрольной точке WAL). Файл
+отправляется администратору документом; файл больше лимита Telegram остаётся в EXPORT_DIR.
+Секреты (key_data, sub_token) не выгружаются.
+"""
+import asyncio
+import csv
+import datetime
+import gzip
+import logging
+import os
+
+from telegram import InputFile
+
+import secrets
+import db_manager
+import lifecycle
+import rate_limiter
+
+logger = logging.getLogger(__name__)
+
+# Лимит Telegram на документ, отправленный ботом
+_MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+_SUBSCRIPTION_COLUMNS = ["id", "user_id", "server_id", "protocol", "key_identifier", "inbound_id",
+                         "created_at", "expires_at", "is_active"]
+
+# Набор -> (колонки файла, [(таблица, её колонки)]); колонки, которых у таблицы нет, остаются пустыми
+DATASETS = {
+    "users": (
+        ["id", "username", "first_name", "last_name", "created_at", "is_blocked", "traffic_limit_gb", "plan"],
+        [(db_manager.User.__table__, ["id", "username", "first_name", "last_name", "created_at", "is_blocked", "traffic_limit_gb", "plan"])],
+    ),
+    "subscriptions": (
+        _SUBSCRIPTION_COLUMNS + ["archived_at"],
+        [(db_manager.Subscription.__table__, _SUBSCRIPTION_COLUMNS),
+         (db_manager.SubscriptionArchive.__table__, _SUBSCRIPTION_COLUMNS + ["archived_at"])],
+    ),
+    "traffic": (
+        ["user_id", "used_bytes", "warned_level", "quota_disabled", "updated_at"],
+        [(db_manager.TrafficUsage.__table__, ["user_id", "used_bytes", "warned_level", "quota_disabled", "updated_at"])],
+    ),
+}
+
+_running = False
+
+
+def write_csv(dataset: str, path: str) -> int:
+    """Пишет набор в path (CSV в gzip) пачками. Возвращает число строк."""
+    header, sources = DATASETS[dataset]
+    chunk_size = getattr(secrets, "EXPORT_CHUNK_SIZE", 5000)
+    written = 0
+    with gzip.open(path, "wt", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        for table, columns in sources:
+            positions = [columns.index(name) if name in columns else None for name in header]
+            for rows in db_manager.iter_table_chunks(table, columns, chunk_size):
+                if lifecycle.is_draining():
+                    raise RuntimeError("export interrupted by shutdown")
+                writer.writerows([["" if index is None else row[index] for index in positions] for row in rows])
+                written += len(rows)
+    return written
+
+
+async def _send(bot, chat_id: int, dataset: str) -> str:
+    export_dir = getattr(secrets, "EXPORT_DIR", "exports")
+    os.makedirs(export_dir, exist_ok=True)
+    filename = f"{dataset}-{datetime.datetime.now():%Y%m%d-%H%M%S}.csv.gz"
+    path = os.path.join(export_dir, filename)
+    try:
+        rows = await asyncio.to_thread(write_csv, dataset, path)
+    except Exception:
+        if os.path.exists(path):
+            os.remove(path)
+        raise
+    size = os.path.getsize(path)
+    if size > _MAX_DOCUMENT_BYTES:
+        logger.info(f"Export {dataset}: {rows} rows, {size} bytes, kept at {path}.")
+        return f"{dataset}: {rows} строк, {size / 1024 / 1024:.0f} МБ — больше лимита Telegram, файл на сервере: {os.path.abspath(path)}"
+    try:
+        with open(path, "rb") as file:
+            # read_file_handle=False: файл уходит в запрос потоком, а не читается в память целиком
+            await bot.send_document(chat_id=chat_id, document=InputFile(file, filename=filename, read_file_handle=False),
+                                    caption=f"{dataset}: {rows} строк",
+                                    rate_limit_args={"priority": rate_limiter.PRIORITY_NOTIFICATION})
+    finally:
+        os.remove(path)
+    logger.info(f"Export {dataset}: {rows} rows, {size} bytes sent to {chat_id}.")
+    return f"{dataset}: {rows} строк"
+
+
+async def _run(bot, chat_id: int, datasets: list[str]) -> None:
+    global _running
+    results = []
+    try:
+        for dataset in datasets:
+            try:
+                results.append(await _send(bot, chat_id, dataset))
+            except Exception as e:
+                logger.error(f"Export {dataset} failed: {e}", exc_info=True)
+                results.append(f"{dataset}: ошибка ({e})")
+        await bot.send_message(chat_id=chat_id, text="📦 Выгрузка завершена.\n" + "\n".join(results), parse_mode=None,
+                               rate_limit_args={"priority": rate_limiter.PRIORITY_NOTIFICATION})
+    finally:
+        _running = False
+
+
+def start(application, chat_id: int, datasets: list[str]) -> bool:
+    """Запускает выгрузку в фоне. False — предыдущая ещё идёт (одновременно идёт одна выгрузка)."""
+    global _running
+    if _running:
+        return False
+    _running = True
+    lifecycle.track(application.create_task(_run(application.bot, chat_id, datasets), name="export"))
+    return True
@@ -0,0 +1,206 @@
+# -*- coding: utf-8 -*-
+"""Минимальный HTTP/1.1 сервер на asyncio.Protocol для служебных эндпоинтов бота.
+
+Поддерживает только GET и HEAD, keep-alive и конвейерные запросы. Обработчик получает
+Request и возвращает Response — сразу (быстрый путь, без создания задач) или корутиной.
+
+Пока обработчик готовит ответ или клиент не забирает ответы, чтение из сокета приостановлено,
+а соединение, приславшее больше _MAX_BUFFER_SIZE вперёд ответов, закрывается: конвейерный
+клиент не может заставить сервер копить его запросы в памяти.
+"""
+import asyncio
+import inspect
+import logging
+from dataclasses import dataclass, field
+
+logger = logging.getLogger(__name__)
+
+_MAX_HEAD_SIZE = 8192
+# Сколько непрочитанных данных соединения держать в буфере; больше — соединение закрывается
+_MAX_BUFFER_SIZE = 64 * 1024
+_REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    431: "Request Header Fields Too Large",
+    500: "Internal Server Error",
+    503: "Service Unavailable",
+}
+
+
+@dataclass(slots=True)
+class Request:
+    method: str
+    path: str
+    # Имена заголовков в нижнем регистре
+    headers: dict[str, str]
+
+
+@dataclass(slots=True)
+class Response:
+    status: int = 200
+    body: bytes = b""
+    headers: dict[str, str] = field(default_factory=dict)
+
+
+class _HttpProtocol(asyncio.Protocol):
+
+    def __init__(self, server: "HttpServer"):
+        self._server = server
+        self._transport: asyncio.Transport | None = None
+        self._buffer = bytearray()
+        self._busy = False # Ждём ответа асинхронного обработчика; следующие запросы в буфере
+        self._writing_paused = False # Буфер отправки транспорта переполнен: клиент не читает ответы
+        self._idle_handle: asyncio.TimerHandle | None = None
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self._transport = transport
+        self._server._connections.add(self)
+        self._reset_idle_timer()
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self._server._connections.discard(self)
+        if self._idle_handle:
+            self._idle_handle.cancel()
+        self._transport = None
+
+    def data_received(self, data: bytes) -> None:
+        self._buffer += data
+        self._reset_idle_timer()
+        if len(self._buffer) > _MAX_BUFFER_SIZE and (self._busy or self._writing_paused):
+            # Данные, пришедшие до того, как чтение встало на паузу
+            logger.warning("HTTP client sent too much data ahead of responses, closing connection.")
+            self.close()
+            return
+        self._process()
+
+    def pause_writing(self) -> None:
+        self._writing_paused = True
+        self._update_reading()
+
+    def resume_writing(self) -> None:
+        self._writing_paused = False
+        self._update_reading()
+        self._process()
+
+    def _update_reading(self) -> None:
+        if self._transport is None:
+            return
+        if self._busy or self._writing_paused:
+            self._transport.pause_reading()
+        else:
+            self._transport.resume_reading()
+
+    def close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+    def _reset_idle_timer(self) -> None:
+        if self._idle_handle:
+            self._idle_handle.cancel()
+        self._idle_handle = asyncio.get_running_loop().call_later(self._server.idle_timeout, self.close)
+
+    def _process(self) -> None:
+        while not self._busy and not self._writing_paused and self._transport is not None:
+            head_end = self._buffer.find(b"\r\n\r\n")
+            if head_end < 0:
+                if len(self._buffer) > _MAX_HEAD_SIZE:
+                    self._write(Response(431), keep_alive=False, head_only=False)
+                return
+            head = bytes(self._buffer[:head_end]).decode("latin-1")
+            del self._buffer[:head_end + 4]
+
+            lines = head.split("\r\n")
+            parts = lines[0].split(" ")
+            if len(parts) != 3 or not parts[2].startswith("HTTP/1."):
+                self._write(Response(400), keep_alive=False, head_only=False)
+                return
+            method, path, version = parts
+            headers = {}
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            if headers.get("content-length", "0") != "0" or "transfer-encoding" in headers:
+                # Тела запросов не поддерживаются: не можем надёжно найти начало следующего запроса
+                self._write(Response(400), keep_alive=False, head_only=False)
+                return
+
+            connection = headers.get("connection", "").lower()
+            keep_alive = connection != "close" if version == "HTTP/1.1" else connection == "keep-alive"
+            head_only = method == "HEAD"
+            if method not in ("GET", "HEAD"):
+                self._write(Response(405, headers={"Allow": "GET, HEAD"}), keep_alive, head_only)
+                continue
+
+            try:
+                result = self._server.handler(Request(method=method, path=path, headers=headers))
+            except Exception as e:
+                logger.error(f"HTTP handler failed for {method} {path}: {e}", exc_info=True)
+                result = Response(500)
+            if inspect.isawaitable(result):
+                self._busy = True
+                self._update_reading()
+                task = asyncio.ensure_future(result)
+                task.add_done_callback(lambda t, ka=keep_alive, ho=head_only: self._on_async_response(t, ka, ho))
+                return
+            self._write(result, keep_alive, head_only)
+
+    def _on_async_response(self, task: asyncio.Future, keep_alive: bool, head_only: bool) -> None:
+        self._busy = False
+        self._update_reading()
+        if task.cancelled():
+            response = Response(503)
+        elif task.exception() is not None:
+            logger.error(f"HTTP handler failed: {task.exception()}", exc_info=task.exception())
+            response = Response(500)
+        else:
+            response = task.result()
+        self._write(response, keep_alive, head_only)
+        self._process()
+
+    def _write(self, response: Response, keep_alive: bool, head_only: bool) -> None:
+        if self._transport is None:
+            return
+        lines = [f"HTTP/1.1 {response.status} {_REASONS.get(response.status, 'Unknown')}"]
+        lines += [f"{name}: {value}" for name, value in response.headers.items()]
+        if response.status != 304:
+            lines.append(f"Content-Length: {len(response.body)}")
+        if not keep_alive:
+            lines.append("Connection: close")
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+        if not head_only and response.status != 304:
+            payload += response.body
+        self._transport.write(payload)
+        if not keep_alive:
+            self._transport.close()
+            self._transport = None
+
+
+class HttpServer:
+
+    def __init__(self, handler, host: str, port: int, idle_timeout: float = 60.0):
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.idle_timeout = idle_timeout
+        self._server: asyncio.AbstractServer | None = None
+        self._connections: set[_HttpProtocol] = set()
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        self._server = await loop.create_server(lambda: _HttpProtocol(self), self.host, self.port, reuse_address=True)
+        if self.port == 0:
+            self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"HTTP server listening on {self.host}:{self.port}.")
+
+    async def stop(self) -> None:
+        if self._server is None:
+            return
+        self._server.close()
+        for connection in list(self._connections):
+            connection.close()
+        await self._server.wait_closed()
+        self._server = None
+        logger.info(f"HTTP server on {self.host}:{self.port} stopped.")
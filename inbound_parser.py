@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""Потоковый разбор поля ``settings`` инбаунда 3x-ui.
+
+В ``settings`` лежат все клиенты инбаунда. ``json.loads`` целиком строит десятки тысяч
+словарей, хотя нам нужны только email, id, enable и tgId. iter_clients проходит массив
+``clients`` по одному элементу и отдаёт компактные записи, так что в памяти одновременно
+живёт только один разобранный клиент.
+"""
+import json
+import logging
+import re
+from dataclasses import dataclass
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = re.compile(r"[ \t\n\r]*")
+# Всё до ближайшей квадратной скобки вне строк
+_UNTIL_BRACKET = re.compile(r'(?:[^"\[\]]++|"[^"\\]*+(?:\\.[^"\\]*+)*+")*+')
+
+
+@dataclass(frozen=True, slots=True)
+class ClientRecord:
+    email: str
+    id: str | None
+    # Для Shadowsocks — персональный ключ клиента (соль), для VLESS пусто
+    password: str | None
+    enable: bool
+    tg_id: int | None
+
+
+def _to_record(client: dict) -> ClientRecord | None:
+    email = client.get("email")
+    if not email:
+        return None
+    tg_id = client.get("tgId")
+    try:
+        tg_id = int(tg_id) if tg_id not in (None, "") else None
+    except (TypeError, ValueError):
+        tg_id = None
+    client_id = client.get("id")
+    return ClientRecord(email=email, id=str(client_id) if client_id is not None else None,
+                        password=client.get("password") or None,
+                        enable=bool(client.get("enable", True)), tg_id=tg_id)
+
+
+def _skip_whitespace(text: str, pos: int) -> int:
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _expect(text: str, pos: int, char: str) -> int:
+    pos = _skip_whitespace(text, pos)
+    if pos >= len(text) or text[pos] != char:
+        raise ValueError(f"Expected {char!r} at position {pos} of inbound settings")
+    return pos + 1
+
+
+def _iter_clients_stdlib(settings: str) -> Iterator[dict]:
+    # Идём по ключам верхнего уровня, а не ищем подстроку '"clients"': она может встретиться
+    # внутри строковых значений (например, в комментарии клиента)
+    pos = _expect(settings, 0, "{")
+    pos = _skip_whitespace(settings, pos)
+    if settings.startswith("}", pos):
+        return
+    while True:
+        key, pos = _decoder.raw_decode(settings, _skip_whitespace(settings, pos))
+        pos = _expect(settings, pos, ":")
+        pos = _skip_whitespace(settings, pos)
+        if key != "clients" or not settings.startswith("[", pos):
+            _, pos = _decoder.raw_decode(settings, pos)
+        else:
+            pos = _skip_whitespace(settings, pos + 1)
+            if settings.startswith("]", pos):
+                pos += 1
+            else:
+                while True:
+                    client, pos = _decoder.raw_decode(settings, pos)
+                    if isinstance(client, dict):
+                        yield client
+                    pos = _skip_whitespace(settings, pos)
+                    if settings.startswith(",", pos):
+                        pos = _skip_whitespace(settings, pos + 1)
+                        continue
+                    pos = _expect(settings, pos, "]")
+                    break
+        pos = _skip_whitespace(settings, pos)
+        if settings.startswith(",", pos):
+            pos += 1
+            continue
+        _expect(settings, pos, "}")
+        return
+
+
+def _skip_array(text: str, pos: int) -> int:
+    """pos указывает на '['; возвращает позицию за парной ']', не разбирая элементы массива."""
+    depth = 0
+    while True:
+        char = text[pos] if pos < len(text) else ""
+        if char == "[":
+            depth += 1
+        elif char == "]":
+            depth -= 1
+            if depth == 0:
+                return pos + 1
+        else:
+            raise ValueError(f"Unterminated array at position {pos} of inbound settings")
+        pos = _UNTIL_BRACKET.match(text, pos + 1).end()
+
+
+def settings_without_clients(settings: str | bytes | None) -> dict:
+    """settings инбаунда без массива clients (он пропускается без разбора клиентов) — для копии инбаунда."""
+    if not settings:
+        return {}
+    if isinstance(settings, bytes):
+        settings = settings.decode("utf-8")
+    result = {}
+    pos = _skip_whitespace(settings, _expect(settings, 0, "{"))
+    if settings.startswith("}", pos):
+        return result
+    while True:
+        key, pos = _decoder.raw_decode(settings, _skip_whitespace(settings, pos))
+        pos = _skip_whitespace(settings, _expect(settings, pos, ":"))
+        if key == "clients" and settings.startswith("[", pos):
+            pos = _skip_array(settings, pos)
+        else:
+            result[key], pos = _decoder.raw_decode(settings, pos)
+        pos = _skip_whitespace(settings, pos)
+        if settings.startswith(",", pos):
+            pos += 1
+            continue
+        _expect(settings, pos, "}")
+        return result
+
+
+def _iter_client_dicts(settings: str | bytes | None) -> Iterator[dict]:
+    if not settings:
+        return
+    if isinstance(settings, bytes):
+        settings = settings.decode("utf-8")
+    yield from _iter_clients_stdlib(settings)
+
+
+def iter_clients(settings: str | bytes | None) -> Iterator[ClientRecord]:
+    """Отдаёт клиентов из settings инбаунда по одному. Бросает ValueError при битом JSON."""
+    for client in _iter_client_dicts(settings):
+        record = _to_record(client)
+        if record:
+            yield record
+
+
+def find_clients(settings: str | bytes | None, emails: set[str]) -> dict[str, dict]:
+    """Полные объекты клиентов с указанными email (для updateClient). Остальные не сохраняются."""
+    found = {}
+    for client in _iter_client_dicts(settings):
+        email = client.get("email")
+        if email in emails:
+            found[email] = client
+            if len(found) == len(emails):
+                break
+    return found
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Распределение клиентов 3x-ui по нескольким инбаундам сервера.
+
+3x-ui хранит всех клиентов инбаунда в одном JSON settings, и каждый addClient, delClient
+и запрос инбаунда переписывает и разбирает его целиком. Поэтому у протокола сервера может
+быть несколько инбаундов: основной, дополнительные из конфигурации (xui_<протокол>_inbound_ids)
+и созданные ботом копии основного на свободных портах (xui_<протокол>_spare_ports, таблица
+inbound_shards). Новый клиент попадает в первый инбаунд, где клиентов меньше
+XUI_MAX_CLIENTS_PER_INBOUND; число клиентов берётся из индекса клиентов в памяти.
+"""
+import logging
+
+import secrets
+import client_index
+import db_manager
+from server_registry import ServerRecord
+
+logger = logging.getLogger(__name__)
+
+# (server_id, протокол) -> ((inbound_id, порт), ...) инбаундов, созданных ботом
+_created: dict[tuple[int, str], tuple[tuple[int, int], ...]] | None = None
+# (server_id, порт) запасных портов, на которых панель отказалась создать инбаунд (до перезапуска)
+_rejected_ports: set[tuple[int, int]] = set()
+
+
+def load() -> None:
+    """Загружает из базы инбаунды, созданные ботом. Вызывается при прогреве (в отдельном потоке)."""
+    global _created
+    created: dict[tuple[int, str], tuple[tuple[int, int], ...]] = {}
+    for inbound_id, server_id, protocol, port in db_manager.get_inbound_shards():
+        created[(server_id, protocol)] = created.get((server_id, protocol), ()) + ((inbound_id, port),)
+    _created = created
+
+
+def _created_for(server: ServerRecord, protocol: str) -> tuple[tuple[int, int], ...]:
+    if _created is None:
+        load()
+    return _created.get((server.id, protocol), ())
+
+
+def add_created(server: ServerRecord, protocol: str, inbound_id: int, port: int) -> None:
+    db_manager.add_inbound_shard(inbound_id, server.id, protocol, port)
+    key = (server.id, protocol)
+    _created[key] = _created.get(key, ()) + ((inbound_id, port),)
+    logger.info(f"Inbound {inbound_id} (port {port}) added to the {protocol} pool of server {server.id}.")
+
+
+def inbound_ids(server: ServerRecord, protocol: str) -> tuple[int, ...]:
+    """Все инбаунды протокола сервера в порядке заполнения."""
+    configured = server.inbound_ids(protocol)
+    if not configured:
+        return ()
+    return configured + tuple(inbound_id for inbound_id, _ in _created_for(server, protocol) if inbound_id not in configured)
+
+
+def all_inbound_ids(servers) -> set[int]:
+    return {inbound_id for server in servers for protocol in ("vless", "shadowsocks") for inbound_id in inbound_ids(server, protocol)}
+
+
+def max_clients(server: ServerRecord) -> int:
+    """Порог клиентов в одном инбаунде; 0 — без порога (все клиенты в основном инбаунде)."""
+    if server.max_clients_per_inbound is not None:
+        return server.max_clients_per_inbound
+    return getattr(secrets, "XUI_MAX_CLIENTS_PER_INBOUND", 0)
+
+
+def free_spare_ports(server: ServerRecord, protocol: str) -> list[int]:
+    used = {port for _, port in _created_for(server, protocol)}
+    return [port for port in server.spare_ports(protocol) if port not in used and (server.id, port) not in _rejected_ports]
+
+
+def reject_port(server: ServerRecord, port: int) -> None:
+    """Порт занят другим инбаундом: больше не пробуем его до перезапуска."""
+    _rejected_ports.add((server.id, port))
+
+
+def pick(server: ServerRecord, protocol: str) -> int | None:
+    """Первый инбаунд с местом для клиента или None, если заполнены все."""
+    limit = max_clients(server)
+    for inbound_id in inbound_ids(server, protocol):
+        if not limit or client_index.size(inbound_id) < limit:
+            return inbound_id
+    return None
+
+
+def least_loaded(server: ServerRecord, protocol: str) -> int | None:
+    ids = inbound_ids(server, protocol)
+    return min(ids, key=client_index.size) if ids else None
+
+
+def locate(server: ServerRecord, protocol: str, email: str) -> int | None:
+    """Инбаунд, в котором индекс клиентов знает клиента с этим email."""
+    for inbound_id in inbound_ids(server, protocol):
+        if client_index.contains(inbound_id, email):
+            return inbound_id
+    return None
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Разбор незавершённых выдач ключей из журнала (issuance_journal) после перезапуска.
+
+Запись pending означает, что бот упал или не дождался ответа панели между addClient и
+сохранением ключа. Если клиент есть в панели и пользователю ещё можно выдать ключ, выдача
+доводится до конца и ключ отправляется пользователю; иначе клиент удаляется из панели,
+а запись откатывается.
+"""
+import asyncio
+import datetime
+import logging
+
+from telegram.error import Forbidden
+
+import secrets
+import client_index
+import config
+import db_manager
+import drivers
+import key_counts
+import rate_limiter
+import server_registry
+import vpn_connector
+
+logger = logging.getLogger(__name__)
+
+_RECOVERY_CONCURRENCY = 10
+# Разбор уже идёт (в режиме --workers лидер запускает его периодически)
+_recovery_lock = asyncio.Lock()
+
+
+def _resume_in_db(entry: db_manager.IssuanceJournal, key_data: str) -> bool:
+    """Сохраняет ключ, если лимиты пользователя позволяют. Запись журнала закрывается той же транзакцией."""
+    with db_manager.get_db() as db:
+        user = db_manager.get_user(db, entry.user_id)
+        usage = db_manager.get_traffic_usage(db, entry.user_id)
+        if user is None or (usage and usage.quota_disabled):
+            return False
+        if key_counts.total(db, entry.user_id) >= config.get_settings().max_keys_per_user:
+            return False
+        db_manager.add_subscription(
+            db_session=db,
+            user_id=entry.user_id,
+            server_id=entry.server_id,
+            protocol=entry.protocol,
+            key_data=key_data,
+            key_identifier=entry.email,
+            expires_at=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=365 * 100)
+        )
+        return True
+
+
+async def _notify(bot, user_id: int, key_data: str) -> None:
+    try:
+        await bot.send_message(chat_id=user_id, text=secrets.KEY_RECOVERED_MESSAGE.format(key=key_data),
+                               rate_limit_args={"priority": rate_limiter.PRIORITY_NOTIFICATION})
+    except Forbidden:
+        logger.info(f"User {user_id} blocked the bot, recovered key notification skipped.")
+    except Exception as e:
+        logger.error(f"Failed to send recovered key to user {user_id}: {e}")
+
+
+async def _recover(entry: db_manager.IssuanceJournal, bot) -> str:
+    server = server_registry.get(entry.server_id)
+    exists = await vpn_connector.client_exists(entry.inbound_id, entry.email)
+    if exists is None:
+        return "skipped" # Панель недоступна — разберём при следующем запуске
+    if not exists:
+        await asyncio.to_thread(db_manager.journal_update, entry.id, status='rolled_back')
+        return "rolled_back"
+    if not client_index.claim(entry.inbound_id, entry.email):
+        # Клиента уже выдал повторно обычный запрос пользователя — журнал закрыт вместе с его ключом
+        return "claimed"
+
+    key_data = None
+    if server is not None:
+        key_data = await vpn_connector.rebuild_client_link(server, entry.protocol, entry.credential, entry.email, entry.inbound_id)
+
+    if key_data and await asyncio.to_thread(_resume_in_db, entry, key_data):
+        if bot is not None:
+            await _notify(bot, entry.user_id, key_data)
+        return "resumed"
+
+    # Выдать ключ нельзя (лимит, квота, сервер удалён из конфигурации) — убираем клиента из панели
+    client_index.forget(entry.inbound_id, entry.email)
+    if server is None or await drivers.delete_key(entry.server_id, entry.protocol, entry.email):
+        await asyncio.to_thread(db_manager.journal_update, entry.id, status='rolled_back')
+        return "rolled_back"
+    return "skipped"
+
+
+async def recover_pending(bot=None, min_age_sec: float = 0) -> dict[str, int]:
+    """Параллельно доводит или откатывает записи pending, созданные раньше чем min_age_sec назад."""
+    if _recovery_lock.locked():
+        return {}
+    async with _recovery_lock:
+        return await _recover_pending(bot, min_age_sec)
+
+
+async def _recover_pending(bot, min_age_sec: float) -> dict[str, int]:
+    created_before = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(seconds=min_age_sec)
+    entries = await asyncio.to_thread(db_manager.get_pending_issuances, created_before)
+    if not entries:
+        return {}
+    logger.info(f"Recovering {len(entries)} pending key issuances...")
+    semaphore = asyncio.Semaphore(_RECOVERY_CONCURRENCY)
+
+    async def recover_one(entry: db_manager.IssuanceJournal) -> str:
+        async with semaphore:
+            try:
+                return await _recover(entry, bot)
+            except Exception as e:
+                logger.error(f"Failed to recover issuance #{entry.id} ({entry.email}): {e}", exc_info=True)
+                return "failed"
+
+    results = await asyncio.gather(*(recover_one(entry) for entry in entries))
+    summary = {outcome: results.count(outcome) for outcome in set(results)}
+    logger.info(f"Pending key issuances recovered: {summary}")
+    return summary
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Число активных ключей пользователя для проверки лимита MAX_KEYS_PER_USER.
+
+Источник — таблица user_key_counts, которую db_manager меняет в той же транзакции, что и
+subscriptions, поэтому после перезапуска счётчики верны без пересчёта. Поверх таблицы —
+кэш в памяти: повторная проверка лимита не обращается к базе. Запись кэша сбрасывается
+по событиям коммита в db_manager.
+"""
+from collections import OrderedDict
+
+import secrets
+import db_manager
+
+# users.id -> (счётчики или None после сброса, поколение). Поколение растёт при каждом сбросе: чтение,
+# начатое до сброса, не попадёт в кэш. Оно хранится в той же записи LRU и вытесняется вместе с ней
+_counts: "OrderedDict[int, tuple[dict[str, int] | None, int]]" = OrderedDict()
+
+
+def _store(user_id: int, counts: dict[str, int] | None, generation: int) -> None:
+    _counts[user_id] = (counts, generation)
+    _counts.move_to_end(user_id)
+    while len(_counts) > getattr(secrets, "KEY_COUNT_CACHE_SIZE", 100000):
+        _counts.popitem(last=False)
+
+
+def invalidate(user_ids) -> None:
+    for user_id in user_ids:
+        _store(user_id, None, _counts.get(user_id, (None, 0))[1] + 1)
+
+
+db_manager.on_subscriptions_changed(invalidate)
+
+
+def get(db_session, user_id: int) -> dict[str, int]:
+    """Активные ключи пользователя по протоколам (при промахе — одна выборка по первичному ключу)."""
+    if db_manager.has_uncommitted_changes(db_session, user_id):
+        # Сессия уже меняла ключи пользователя: кэш хранит закоммиченное значение, а при откате не сбрасывается
+        return db_manager.get_key_counts(db_session, user_id)
+    counts, generation = _counts.get(user_id, (None, 0))
+    if counts is not None:
+        _counts.move_to_end(user_id)
+        return counts
+    counts = db_manager.get_key_counts(db_session, user_id)
+    if _counts.get(user_id, (None, 0))[1] == generation:
+        _store(user_id, counts, generation)
+    return counts
+
+
+def total(db_session, user_id: int) -> int:
+    return sum(get(db_session, user_id).values())
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 import secrets 
+import drivers
 
 def main_menu_keyboard() -> InlineKeyboardMarkup:
     keyboard = [
@@ -21,9 +22,7 @@ def back_to_menu_keyboard(include_instructions: bool = False) -> InlineKeyboardM
     return InlineKeyboardMarkup(keyboard)
 
 def protocol_selection_keyboard() -> InlineKeyboardMarkup:
-    keyboard = [
-        [InlineKeyboardButton("⚡ VLESS Reality", callback_data="get_key_vless")],
-        [InlineKeyboardButton("👻 Shadowsocks", callback_data="get_key_shadowsocks")],
-        [InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")]
-    ]
+    # Кнопки протоколов, для которых есть сервер, — из реестра драйверов
+    keyboard = [[InlineKeyboardButton(driver.title, callback_data=f"get_key_{driver.protocol}")] for driver in drivers.available()]
+    keyboard.append([InlineKeyboardButton("🔙 Главное меню", callback_data="main_menu")])
     return InlineKeyboardMarkup(keyboard)
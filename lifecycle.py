@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""Жизненный цикл бота: готовность, остановка без потери ключей и закрытие ресурсов.
+
+Остановка (SIGTERM/SIGINT, обрабатывает run_polling) идёт так:
+ 1. run_polling перестаёт получать обновления (Updater.stop);
+ 2. BotApplication.stop переводит бота в draining: /readyz отвечает 503, рассылки и переносы
+    останавливаются после текущей пачки (их курсоры в базе, они продолжатся после запуска);
+ 3. ждём, пока закончатся выдачи ключей (in_flight) и фоновые задачи, но не дольше
+    SHUTDOWN_DRAIN_TIMEOUT_SEC; оставшиеся задачи отменяются — незавершённые выдачи
+    разбирает журнал выдачи при следующем запуске;
+ 4. Application.stop обрабатывает уже полученные обновления;
+ 5. close_resources закрывает HTTP-серверы, пулы соединений панели и Outline, пул базы
+    и сбрасывает буферы логов.
+
+Служебный эндпоинт (HEALTH_HOST:HEALTH_PORT, у воркеров — HEALTH_PORT + номер воркера):
+/livez — процесс жив, /readyz — бот принимает обновления, /healthz — серверы протоколов отвечают.
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import time
+
+import secrets
+import coordination
+import db_manager
+import drivers
+import server_registry
+import subscription_links
+import tracing
+from http_server import HttpServer, Request, Response
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+DRAINING = "draining"
+STOPPED = "stopped"
+
+_state = STARTING
+# Вид операции -> сколько таких выполняется сейчас
+_in_flight: dict[str, int] = {}
+_idle: asyncio.Event | None = None
+# Фоновые задачи, которые при остановке дожидаемся (до дедлайна) и затем отменяем
+_background: set[asyncio.Task] = set()
+_server: HttpServer | None = None
+
+_DRIVER_HEALTH_TTL_SEC = 10.0
+_driver_health: tuple[float, dict[str, bool]] | None = None
+
+
+def state() -> str:
+    return _state
+
+
+def is_draining() -> bool:
+    """Бот останавливается: длинные фоновые операции должны закончить текущую пачку и выйти."""
+    return _state in (DRAINING, STOPPED)
+
+
+def mark_ready() -> None:
+    global _state
+    if _state == STARTING:
+        _state = READY
+        logger.info("Bot is ready.")
+
+
+def _idle_event() -> asyncio.Event:
+    global _idle
+    if _idle is None:
+        _idle = asyncio.Event()
+        _idle.set()
+    return _idle
+
+
+@contextlib.asynccontextmanager
+async def in_flight(kind: str):
+    """Операция, которую остановка бота дожидается (например, выдача ключа: панель + база)."""
+    _in_flight[kind] = _in_flight.get(kind, 0) + 1
+    _idle_event().clear()
+    try:
+        yield
+    finally:
+        _in_flight[kind] -= 1
+        if not _in_flight[kind]:
+            del _in_flight[kind]
+        if not _in_flight:
+            _idle_event().set()
+
+
+def track(task: asyncio.Task) -> asyncio.Task:
+    """Фоновая задача, которую остановка дожидается до дедлайна, а затем отменяет."""
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+    return task
+
+
+async def drain() -> None:
+    """Переводит бота в draining и ждёт выдачи ключей и фоновые задачи не дольше SHUTDOWN_DRAIN_TIMEOUT_SEC."""
+    global _state
+    if is_draining():
+        return
+    _state = DRAINING
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + getattr(secrets, "SHUTDOWN_DRAIN_TIMEOUT_SEC", 20)
+    logger.info(f"Draining: {sum(_in_flight.values())} operations in flight, {len(_background)} background tasks.")
+
+    if _in_flight:
+        try:
+            await asyncio.wait_for(_idle_event().wait(), max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            logger.warning(f"Drain deadline reached with operations still in flight: {_in_flight}. "
+                           f"Unfinished key issuance will be recovered from the journal on the next start.")
+
+    tasks = [task for task in _background if not task.done()]
+    if tasks:
+        _, pending = await asyncio.wait(tasks, timeout=max(0.0, deadline - loop.time()))
+        for task in pending:
+            logger.warning(f"Cancelling background task {task.get_name()} at shutdown; it resumes after restart.")
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+    logger.info("Drain finished.")
+
+
+async def close_resources() -> None:
+    """Закрывает всё, что держит соединения, и сбрасывает логи. Вызывается из post_shutdown."""
+    global _state
+    _state = STOPPED
+    await coordination.stop()
+    await subscription_links.stop_server()
+    await stop_server()
+    await drivers.close_all()
+    await asyncio.to_thread(db_manager.engine.dispose)
+    for handler in logging.getLogger().handlers:
+        handler.flush()
+
+
+class BotApplication(tracing.TracingApplication):
+    """Application, который перед остановкой дожидается выдачи ключей и фоновых задач."""
+
+    async def stop(self) -> None:
+        await drain()
+        await super().stop()
+
+
+async def _check_drivers() -> dict[str, bool]:
+    global _driver_health
+    now = time.monotonic()
+    if _driver_health is not None and now - _driver_health[0] < _DRIVER_HEALTH_TTL_SEC:
+        return _driver_health[1]
+    checks = {}
+    for server in server_registry.all_servers():
+        for protocol in drivers.protocols():
+            driver = drivers.get(protocol)
+            if driver.is_configured(server):
+                checks[f"{server.id}/{protocol}"] = driver.health(server)
+    results = await asyncio.gather(*checks.values(), return_exceptions=True)
+    health = {name: result is True for name, result in zip(checks, results)}
+    _driver_health = (now, health)
+    return health
+
+
+def _json(status: int, payload: dict) -> Response:
+    return Response(status, json.dumps(payload).encode(), {"Content-Type": "application/json"})
+
+
+async def _healthz() -> Response:
+    health = await _check_drivers()
+    return _json(200 if all(health.values()) else 503, {"state": _state, "servers": health})
+
+
+def handle_request(request: Request):
+    path = request.path.split("?", 1)[0]
+    if path == "/livez":
+        return _json(503 if _state == STOPPED else 200, {"state": _state})
+    if path == "/readyz":
+        return _json(200 if _state == READY else 503, {"state": _state, "in_flight": _in_flight})
+    if path == "/healthz":
+        return _healthz()
+    return Response(404)
+
+
+async def start_server() -> None:
+    global _server
+    port = getattr(secrets, "HEALTH_PORT", None)
+    if port is None:
+        return
+    if port:
+        # В режиме --workers у каждого воркера свой порт: HEALTH_PORT + номер воркера
+        port += coordination.worker_index()
+    server = HttpServer(handle_request, getattr(secrets, "HEALTH_HOST", "127.0.0.1"), port)
+    try:
+        await server.start()
+    except OSError as e:
+        # Без служебного эндпоинта бот работает, поэтому не падаем
+        logger.error(f"Cannot start health endpoint on port {port}: {e}")
+        return
+    _server = server
+
+
+async def stop_server() -> None:
+    global _server
+    if _server is not None:
+        await _server.stop()
+        _server = None
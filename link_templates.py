@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""Шаблоны ссылок ключей 3x-ui.
+
+Всё, что зависит только от сервера и инбаунда (адрес, порт, параметры транспорта и
+Reality/TLS, метод Shadowsocks и мастер-ключ), кодируется один раз; для каждого клиента
+подставляются только UUID или пароль и тег. Шаблон привязан к записи реестра серверов:
+после перезагрузки реестра запись новая, и шаблон собирается заново.
+"""
+import base64
+import binascii
+import logging
+from dataclasses import dataclass
+from urllib.parse import quote, unquote
+
+import config
+from server_registry import ServerRecord
+
+logger = logging.getLogger(__name__)
+
+SS2022_PREFIX = "2022-blake3-"
+
+
+def is_ss2022(method: str) -> bool:
+    """Методы Shadowsocks 2022 используют мастер-ключ инбаунда и ключ клиента."""
+    return method.startswith(SS2022_PREFIX)
+
+
+def _address(ip: str, port: int) -> str:
+    host = f"[{ip}]" if ":" in ip and not ip.startswith("[") else ip
+    return f"{host}:{port}"
+
+
+def _vless_query(server: ServerRecord) -> str:
+    vless = server.vless
+    params = [("type", vless.network), ("security", vless.security)]
+    if vless.network == "tcp":
+        params.append(("flow", vless.flow))
+    if vless.security == "reality":
+        params += [("sni", vless.sni), ("pbk", vless.public_key), ("sid", vless.short_id),
+                   ("fp", vless.fingerprint), ("spx", "/")]
+    elif vless.security == "tls":
+        params += [("sni", vless.sni), ("fp", vless.fingerprint), ("alpn", vless.alpn)]
+    if vless.network in ("ws", "xhttp"):
+        params += [("path", vless.path), ("host", vless.host)]
+    elif vless.network == "grpc":
+        params.append(("serviceName", vless.service_name))
+    # Пустые параметры не пишем: клиенты подставят значения по умолчанию
+    return "&".join(f"{name}={quote(str(value))}" for name, value in params if value)
+
+
+@dataclass(frozen=True, slots=True)
+class VlessTemplate:
+    # "@адрес:порт?параметры#" — всё между UUID и тегом
+    middle: str
+
+    def render(self, credential: str, tag: str) -> str:
+        return f"vless://{credential}{self.middle}{quote(tag)}"
+
+
+@dataclass(frozen=True, slots=True)
+class ShadowsocksTemplate:
+    # "метод:мастер-ключ:" (Shadowsocks 2022) или "метод:" — начало userinfo перед паролем клиента
+    userinfo_prefix: bytes
+    # "@адрес:порт#"
+    middle: str
+
+    def render(self, credential: str, tag: str) -> str:
+        userinfo = base64.b64encode(self.userinfo_prefix + credential.encode("utf-8")).decode("ascii")
+        return f"ss://{quote(userinfo)}{self.middle}{quote(tag)}"
+
+
+def _compile(server: ServerRecord, protocol: str, port: int) -> VlessTemplate | ShadowsocksTemplate:
+    if protocol == "vless":
+        query = _vless_query(server)
+        return VlessTemplate(middle=f"@{_address(server.ip, port)}" + (f"?{query}" if query else "") + "#")
+    if protocol == "shadowsocks":
+        method = server.shadowsocks.method
+        prefix = f"{method}:"
+        if is_ss2022(method):
+            prefix += f"{config.get_settings().panel.shadowsocks_master_key}:"
+        return ShadowsocksTemplate(userinfo_prefix=prefix.encode("utf-8"), middle=f"@{_address(server.ip, port)}#")
+    raise ValueError(f"No link template for protocol {protocol!r}.")
+
+
+# (server_id, протокол, порт) -> (запись реестра, для которой собран шаблон, шаблон)
+_templates: dict[tuple[int, str, int], tuple[ServerRecord, VlessTemplate | ShadowsocksTemplate]] = {}
+
+
+def get_template(server: ServerRecord, protocol: str, port: int) -> VlessTemplate | ShadowsocksTemplate:
+    key = (server.id, protocol, port)
+    cached = _templates.get(key)
+    # Сравнение по identity: перезагрузка реестра создаёт новые записи серверов
+    if cached is not None and cached[0] is server:
+        return cached[1]
+    template = _compile(server, protocol, port)
+    _templates[key] = (server, template)
+    return template
+
+
+def render(server: ServerRecord, protocol: str, port: int, credential: str, tag: str) -> str:
+    return get_template(server, protocol, port).render(credential, tag)
+
+
+def extract_credential(protocol: str, link: str) -> str | None:
+    """UUID (VLESS) или пароль клиента (Shadowsocks) из ранее выданной ссылки."""
+    scheme, _, rest = link.partition("://")
+    userinfo, at, _ = rest.partition("@")
+    if not at or not userinfo:
+        return None
+    if protocol == "vless" and scheme == "vless":
+        return userinfo
+    if protocol == "shadowsocks" and scheme == "ss":
+        try:
+            decoded = base64.b64decode(unquote(userinfo), validate=True).decode("utf-8")
+        except (binascii.Error, UnicodeDecodeError):
+            return None
+        method, sep, password = decoded.rpartition(":")
+        return password if sep and method else None
+    return None
+
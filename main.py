@@ -1,13 +1,31 @@
 # -*- coding: utf-8 -*-
+import time
+_PROCESS_STARTED = time.perf_counter() # Точка отсчёта для --profile-startup, до тяжёлых импортов
+
+import argparse
 import logging
 import sys
-import secrets
 from telegram.ext import ApplicationBuilder, Defaults
 from telegram import LinkPreviewOptions
 from telegram.constants import ParseMode
 
+import secrets
+import config
+import coordination
+import server_registry
 import db_manager
 import bot_handlers
+import admin_handlers
+import broadcast
+import rate_limiter
+import startup
+import quota
+import retention
+import subscription_links
+import issuance
+import migration
+import lifecycle
+import workers
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -20,33 +38,106 @@ logging.basicConfig(
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
-def main() -> None:
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="VPN Telegram Bot")
+    parser.add_argument("--profile-startup", action="store_true", help="Вывести длительность этапов запуска")
+    parser.add_argument("--workers", type=int, default=getattr(secrets, "WORKERS", 1),
+                        help="Сколько процессов обрабатывают обновления (см. workers.py)")
+    return parser.parse_args()
+
+def load_configuration(profiler: startup.StartupProfiler) -> config.Settings:
+    """Проверяет конфигурацию и готовит базу; при ошибке завершает процесс."""
     logger.info("Checking essential configuration...")
-    if not secrets.BOT_TOKEN or "YOUR" in secrets.BOT_TOKEN:
-        logger.critical("BOT_TOKEN is not set in secrets.py. Bot cannot start.")
+    try:
+        with profiler.phase("config validation"):
+            settings = config.get_settings()
+            server_registry.load()
+    except (config.ConfigError, server_registry.RegistryError) as e:
+        logger.critical(f"{e}\nBot cannot start.")
         sys.exit(1)
     logger.info("Configuration seems OK.")
 
     logger.info("Initializing database...")
     try:
-        db_manager.init_db()
+        with profiler.phase("database init"):
+            db_manager.init_db()
         logger.info("Database initialized successfully.")
     except Exception as e:
         logger.critical(f"Failed to initialize database: {e}", exc_info=True)
         sys.exit(1)
+    return settings
+
+def resume_background(application) -> None:
+    """Продолжает работу, прерванную остановкой бота (в режиме --workers — на воркере-лидере)."""
+    # Незавершённые выдачи ключей разбираются в фоне и не задерживают начало polling.
+    # Воркер-лидер не трогает свежие записи: их может прямо сейчас доводить другой воркер
+    min_age_sec = coordination.PENDING_ISSUANCE_MIN_AGE_SEC if coordination.enabled() else 0
+    lifecycle.track(application.create_task(issuance.recover_pending(application.bot, min_age_sec), name="issuance-recovery"))
+    broadcast.resume_broadcasts(application)
+    migration.resume_migrations(application)
+
+def build_application(settings: config.Settings, profiler: startup.StartupProfiler, worker_count: int = 1, builder: ApplicationBuilder | None = None):
+    async def post_init(application) -> None:
+        # Выполняется до начала polling: первый пользователь не ждёт логина в панель
+        await profiler.timed("warm-up (concurrent)", startup.warm_up(profiler))
+        if coordination.worker_index() == 0:
+            # Ссылки-подписки раздаёт один воркер: порт у них общий
+            await subscription_links.start_server()
+        await lifecycle.start_server()
+        if coordination.enabled():
+            coordination.start(application, resume_background)
+        else:
+            resume_background(application)
+        lifecycle.mark_ready()
+        profiler.report("ready to poll")
+
+    async def post_shutdown(application) -> None:
+        await lifecycle.close_resources()
 
     logger.info("Setting up Telegram Bot Application...")
-    defaults = Defaults(parse_mode=ParseMode.MARKDOWN, link_preview_options=LinkPreviewOptions(is_disabled=True))
+    with profiler.phase("application build"):
+        defaults = Defaults(parse_mode=ParseMode.MARKDOWN, link_preview_options=LinkPreviewOptions(is_disabled=True))
 
-    application = (
-        ApplicationBuilder()
-        .token(secrets.BOT_TOKEN)
-        .defaults(defaults)
-        .build()
-    )
+        builder = (
+            (builder or ApplicationBuilder())
+            .application_class(lifecycle.BotApplication)
+            .token(settings.bot_token)
+            .defaults(defaults)
+            .rate_limiter(rate_limiter.build_rate_limiter(worker_count))
+            .post_init(post_init)
+            .post_shutdown(post_shutdown)
+        )
+        if coordination.enabled():
+            # Обновления воркеру раздаёт главный процесс (workers.py)
+            builder = builder.updater(None)
+        application = builder.build()
 
     logger.info("Registering handlers...")
-    bot_handlers.register_handlers(application)
+    with profiler.phase("handler registration"):
+        startup.install_first_update_probe(application, profiler)
+        bot_handlers.register_handlers(application)
+        admin_handlers.register_handlers(application)
+        quota.schedule(application)
+        retention.schedule(application)
+    return application
+
+def main() -> None:
+    args = parse_args()
+    profiler = startup.StartupProfiler(enabled=args.profile_startup, process_started=_PROCESS_STARTED)
+    profiler.record("imports", time.perf_counter() - _PROCESS_STARTED)
+    settings = load_configuration(profiler)
+
+    if args.workers > 1:
+        logger.info(f"Starting {args.workers} workers...")
+        try:
+            workers.run(args.workers, settings.bot_token)
+        except Exception as e:
+            logger.critical(f"Workers failed with error: {e}", exc_info=True)
+        finally:
+            logger.info("Bot shutdown complete.")
+        return
+
+    application = build_application(settings, profiler)
     
     logger.info("Starting bot polling...")
     try:
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+"""Перенос ключей 3x-ui с одного сервера на другой (/migrate).
+
+Активные ключи сервера читаются пачками по возрастанию id. Для каждой пачки:
+ 1. клиенты на новом сервере записываются в журнал выдачи и добавляются в панель одним
+    addClient на инбаунд. Email клиента зависит только от переноса и ключа, поэтому после
+    перезапуска та же пачка переиспользует записанные UUID/пароли и инбаунды. Инбаунд пула
+    выбирается один на протокол и пачку, так что порог клиентов инбаунда может быть превышен
+    не больше чем на размер пачки;
+ 2. одной транзакцией ключи переводятся на новый сервер и сдвигается курсор переноса, а трафик прежних
+    клиентов добавляется к квоте пользователей. Ключи пользователей, отключённых по квоте, создаются отключёнными;
+ 3. пользователям отправляются новые ссылки (фоновый приоритет, как у рассылок);
+ 4. прежние клиенты удаляются из старого инбаунда.
+После пачки перенос делает паузу не короче времени, которое заняли запросы к панели.
+"""
+import asyncio
+import logging
+import time
+
+from telegram import Bot
+from telegram.ext import Application
+
+import secrets
+import broadcast
+import client_index
+import coordination
+import db_manager
+import drivers
+import inbound_pool
+import lifecycle
+import quota
+import rate_limiter
+import server_registry
+import vpn_connector
+from server_registry import ServerRecord
+
+logger = logging.getLogger(__name__)
+
+MIGRATABLE_PROTOCOLS = ("vless", "shadowsocks")
+
+# Запущенные в этом процессе переносы: migration_id -> задача
+_running: dict[int, asyncio.Task] = {}
+
+
+def migratable_protocols(source: ServerRecord, target: ServerRecord) -> list[str]:
+    return [protocol for protocol in MIGRATABLE_PROTOCOLS if protocol in source.protocols and protocol in target.protocols]
+
+
+def _target_email(migration_id: int, row) -> str:
+    if row.protocol == "vless":
+        return f"tg_{row.user_id}_m{migration_id}_{row.id}@bot.local"
+    return f"ss_{row.user_id}_m{migration_id}_{row.id}"
+
+
+async def _delete_replaced(migration_id: int, source: ServerRecord) -> None:
+    """Удаляет из старого инбаунда клиентов уже перенесённых ключей."""
+    replaced = await asyncio.to_thread(db_manager.get_migration_replaced_clients, migration_id)
+    if not replaced:
+        return
+    semaphore = asyncio.Semaphore(secrets.MIGRATION_PANEL_CONCURRENCY)
+
+    async def delete_one(journal_id: int, protocol: str, email: str) -> int | None:
+        async with semaphore:
+            if await drivers.delete_key(source.id, protocol, email):
+                return journal_id
+            # Клиента уже нет ни в одном инбаунде (удалён до перезапуска) — тоже считаем удалённым
+            exists = [await vpn_connector.client_exists(inbound_id, email) for inbound_id in inbound_pool.inbound_ids(source, protocol)]
+            if exists and all(found is False for found in exists):
+                return journal_id
+            return None
+
+    deleted = await asyncio.gather(*(delete_one(*client) for client in replaced))
+    await asyncio.to_thread(db_manager.clear_replaced_clients, [journal_id for journal_id in deleted if journal_id])
+    if len(deleted) != sum(1 for journal_id in deleted if journal_id):
+        logger.warning(f"Migration {migration_id}: some old clients were not deleted from server {source.id}, will retry.")
+
+
+async def _read_traffic(emails: list[str]) -> dict[str, int]:
+    """up + down прежних клиентов. Клиент без статистики считается с нулевым трафиком."""
+    semaphore = asyncio.Semaphore(secrets.MIGRATION_PANEL_CONCURRENCY)
+
+    async def read_one(email: str) -> int:
+        async with semaphore:
+            traffic = await vpn_connector.get_client_traffic(email)
+        return (traffic["up"] or 0) + (traffic["down"] or 0) if traffic else 0
+
+    return dict(zip(emails, await asyncio.gather(*(read_one(email) for email in emails))))
+
+
+async def _notify(bot: Bot, target: ServerRecord, links_by_user: dict[int, list[str]]) -> None:
+    semaphore = asyncio.Semaphore(secrets.BROADCAST_CONCURRENCY)
+    await asyncio.gather(*(
+        broadcast.deliver(bot, user_id, secrets.MIGRATION_NOTICE_MESSAGE.format(
+            region=target.region, keys="\n\n".join(f"`{link}`" for link in links)
+        ), semaphore)
+        for user_id, links in links_by_user.items()
+    ))
+
+
+async def _migrate_chunk(migration_id: int, target: ServerRecord, rows) -> tuple[list[dict], list[int], int | None]:
+    """Добавляет клиентов пачки на новый сервер.
+
+    Возвращает (перенесённые ключи для commit_migration_chunk, записи журнала отклонённых панелью
+    клиентов, id первого ключа с неизвестным исходом или None).
+    """
+    target_inbounds = {protocol: await vpn_connector.choose_inbound(target, protocol) for protocol in {row.protocol for row in rows}}
+    entries = [{
+        "user_id": row.user_id,
+        "server_id": target.id,
+        "protocol": row.protocol,
+        "inbound_id": target_inbounds[row.protocol],
+        "email": _target_email(migration_id, row),
+        "credential": vpn_connector.new_credential(target, row.protocol),
+        "replaces_email": row.key_identifier,
+    } for row in rows]
+    journal = await asyncio.to_thread(db_manager.journal_begin_migration, migration_id, entries)
+
+    drafts = {}
+    for row, entry in zip(rows, entries):
+        journal_id, credential, inbound_id = journal[entry["email"]]
+        total_traffic_gb = quota.limit_gb(row.traffic_limit_gb, row.plan) or None
+        drafts[row.id] = (journal_id, vpn_connector.make_draft(target, row.protocol, row.user_id, entry["email"], credential, total_traffic_gb,
+                                                               inbound_id=inbound_id, enable=not row.quota_disabled))
+
+    groups: dict[int, list[vpn_connector.ClientDraft]] = {}
+    for _, draft in drafts.values():
+        groups.setdefault(draft.inbound_id, []).append(draft)
+    results: dict[str, bool | None] = {}
+    for group in groups.values():
+        results.update(await vpn_connector.add_clients(group, concurrency=secrets.MIGRATION_PANEL_CONCURRENCY))
+
+    moves, rolled_back, first_unknown = [], [], None
+    for row in rows:
+        journal_id, draft = drafts[row.id]
+        added = results.get(draft.email)
+        key_data = await vpn_connector.rebuild_client_link(target, draft.protocol, draft.credential, draft.email, draft.inbound_id) if added else None
+        if added and key_data:
+            client_index.register(draft.inbound_id, draft.email, row.user_id, credential=draft.credential)
+            moves.append({"subscription_id": row.id, "user_id": row.user_id, "journal_id": journal_id,
+                          "inbound_id": draft.inbound_id, "email": draft.email, "key_data": key_data})
+        elif added is False:
+            rolled_back.append((row.id, journal_id))
+        elif first_unknown is None:
+            first_unknown = row.id
+    if first_unknown is not None:
+        # Ключи начиная с первого неизвестного исхода переносятся при следующем запуске
+        moves = [move for move in moves if move["subscription_id"] < first_unknown]
+        rolled_back = [(row_id, journal_id) for row_id, journal_id in rolled_back if row_id < first_unknown]
+    # Трафик прежних клиентов переходит в квоту пользователя. Прежний клиент работает до удаления после рассылки
+    # новых ссылок — трафик за эти секунды не учитывается
+    old_emails = {row.id: row.key_identifier for row in rows}
+    traffic = await _read_traffic([old_emails[move["subscription_id"]] for move in moves])
+    for move in moves:
+        move["carried_bytes"] = traffic[old_emails[move["subscription_id"]]]
+    return moves, [journal_id for _, journal_id in rolled_back], first_unknown
+
+
+def _finish(migration_id: int) -> db_manager.Migration | None:
+    with db_manager.get_db() as db:
+        return db_manager.finish_migration(db, migration_id)
+
+
+async def run_migration(bot: Bot, migration_id: int) -> db_manager.Migration | None:
+    """Переносит ключи пачками, начиная с сохранённого курсора.
+
+    Чтение пачек и состояния переноса идут в to_thread, чтобы не блокировать event loop.
+    """
+    migration = await asyncio.to_thread(db_manager.get_migration, migration_id)
+    if not migration or migration.status != 'running':
+        return migration
+    source_id, target_id, cursor_id = migration.source_server_id, migration.target_server_id, migration.cursor_subscription_id
+
+    source, target = server_registry.get(source_id), server_registry.get(target_id)
+    if source is None or target is None:
+        logger.error(f"Migration {migration_id}: server {source_id} or {target_id} is not in the registry, paused.")
+        return migration
+    protocols = migratable_protocols(source, target)
+    logger.info(f"Migration {migration_id} of server {source_id} to {target_id} ({', '.join(protocols)}) started from subscription id > {cursor_id}.")
+
+    # Хвост прерванного запуска: ключи перенесены, а старые клиенты ещё не удалены
+    await _delete_replaced(migration_id, source)
+
+    while True:
+        rows = await asyncio.to_thread(db_manager.get_migration_chunk, source_id, protocols, secrets.MIGRATION_CHUNK_SIZE, cursor_id)
+        if not rows:
+            break
+        migration = await asyncio.to_thread(db_manager.get_migration, migration_id)
+        if migration.status != 'running':
+            logger.info(f"Migration {migration_id} is {migration.status}, stopping.")
+            return migration
+        if lifecycle.is_draining():
+            logger.info(f"Migration {migration_id} paused for shutdown, resumes after restart.")
+            return migration
+        if not await coordination.acquire(f"migration-{migration_id}"):
+            logger.warning(f"Migration {migration_id} was taken over by another worker, stopping.")
+            return migration
+
+        started = time.perf_counter()
+        moves, rolled_back, first_unknown = await _migrate_chunk(migration_id, target, rows)
+        panel_time = time.perf_counter() - started
+        cursor_id = first_unknown - 1 if first_unknown is not None else rows[-1].id
+        moved_ids = await asyncio.to_thread(db_manager.commit_migration_chunk, migration_id, target_id, moves, rolled_back,
+                                            cursor_id, len(rolled_back))
+
+        links_by_user: dict[int, list[str]] = {}
+        for move in moves:
+            if move["subscription_id"] in moved_ids:
+                links_by_user.setdefault(move["user_id"], []).append(move["key_data"])
+        await _notify(bot, target, links_by_user)
+
+        started = time.perf_counter()
+        await _delete_replaced(migration_id, source)
+        panel_time += time.perf_counter() - started
+
+        if first_unknown is not None:
+            logger.error(f"Migration {migration_id}: panel did not confirm new clients, paused at subscription {first_unknown}.")
+            return await asyncio.to_thread(db_manager.get_migration, migration_id)
+        # Не больше половины времени нагружаем панели, но и не чаще, чем раз в MIGRATION_PAUSE_SEC
+        await asyncio.sleep(max(secrets.MIGRATION_PAUSE_SEC, panel_time))
+
+    migration = await asyncio.to_thread(_finish, migration_id)
+    logger.info(f"Migration {migration_id} finished: migrated {migration.migrated_count}, failed {migration.failed_count}.")
+    return migration
+
+
+async def _run_and_report(bot: Bot, migration_id: int) -> None:
+    try:
+        # В режиме --workers перенос выполняет один воркер — тот, кто взял его аренду
+        async with coordination.lock(f"migration-{migration_id}") as locked:
+            migration = await run_migration(bot, migration_id) if locked else None
+        if migration and migration.created_by:
+            if migration.status == 'completed':
+                text = (f"🚚 Перенос #{migration_id} завершён.\n"
+                        f"Перенесено ключей: {migration.migrated_count}\nНе удалось: {migration.failed_count}")
+            elif migration.status == 'running' and not lifecycle.is_draining():
+                text = f"⚠️ Перенос #{migration_id} приостановлен (подробности в логе). Продолжить: /migrate {migration.source_server_id} {migration.target_server_id}"
+            else:
+                return
+            await bot.send_message(chat_id=migration.created_by, text=text, parse_mode=None,
+                                   rate_limit_args={"priority": rate_limiter.PRIORITY_NOTIFICATION})
+    except Exception as e:
+        logger.error(f"Migration {migration_id} crashed: {e}", exc_info=True)
+    finally:
+        _running.pop(migration_id, None)
+
+
+def start_migration(application: Application, migration_id: int) -> None:
+    if migration_id in _running:
+        return
+    _running[migration_id] = lifecycle.track(
+        application.create_task(_run_and_report(application.bot, migration_id), name=f"migration-{migration_id}")
+    )
+
+
+async def _resume(application: Application) -> None:
+    for migration_id in await asyncio.to_thread(db_manager.get_running_migration_ids):
+        logger.info(f"Resuming migration {migration_id} after restart.")
+        start_migration(application, migration_id)
+
+
+def resume_migrations(application: Application) -> None:
+    """Продолжает переносы, прерванные перезапуском бота. Список переносов читается в фоне."""
+    lifecycle.track(application.create_task(_resume(application), name="migration-resume"))
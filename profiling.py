@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Сэмплирующий профайлер для работающего бота (/profile).
+
+Таймер ITIMER_REAL раз в SAMPLE_INTERVAL_SEC присылает SIGALRM; обработчик сигнала
+выполняется в главном потоке (там же, где event loop) и получает кадр, который выполнялся
+в этот момент. По кадрам считается, где event loop проводит время: «своё» — функция на
+вершине стека, «всего» — функция где-то в стеке. Поток-сэмплер с sys._current_frames() тут
+не годится: из-за GIL он просыпается, только когда event loop сам отпускает GIL в select(),
+и видит один простой. Накладные расходы — разбор стека раз в интервал, поэтому профайлер
+можно включать в проде без перезапуска. Нужен Unix (signal.setitimer).
+"""
+import asyncio
+import collections
+import os
+import signal
+import threading
+
+SAMPLE_INTERVAL_SEC = 0.005
+# Вершины стека, в которых event loop ждёт событий, а не работает
+_IDLE_FUNCTIONS = frozenset({"select", "poll", "epoll", "kqueue"})
+
+_running = False
+
+
+class ProfileResult:
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.samples = 0
+        self.idle = 0
+        self.own: collections.Counter = collections.Counter()
+        self.total: collections.Counter = collections.Counter()
+
+    def add(self, frame) -> None:
+        self.samples += 1
+        if frame is None or frame.f_code.co_name in _IDLE_FUNCTIONS:
+            self.idle += 1
+            return
+        self.own[_location(frame)] += 1
+        seen = set()
+        while frame is not None:
+            location = _location(frame)
+            if location not in seen:
+                seen.add(location)
+                self.total[location] += 1
+            frame = frame.f_back
+
+    def summary(self, top: int = 15) -> str:
+        if not self.samples:
+            return "Сэмплов нет."
+        busy = self.samples - self.idle
+        lines = [f"Профиль event loop за {self.seconds:.0f} с: {self.samples} сэмплов, "
+                 f"занят {busy * 100 / self.samples:.0f}% времени."]
+        if busy:
+            lines.append("\nСвоё время (вершина стека):")
+            lines += [f"{count * 100 / busy:5.1f}%  {location}" for location, count in self.own.most_common(top)]
+            # Функции, которые есть в каждом сэмпле (run_forever, main), ничего не говорят
+            total = [(location, count) for location, count in self.total.most_common() if count < busy][:top]
+            lines.append("\nВсего (функция в стеке):")
+            lines += [f"{count * 100 / busy:5.1f}%  {location}" for location, count in total]
+        return "\n".join(lines)
+
+
+def _location(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def available() -> bool:
+    """Профайлер работает, если платформа умеет setitimer, а event loop крутится в главном потоке."""
+    return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+
+def is_running() -> bool:
+    return _running
+
+
+async def profile_event_loop(seconds: float) -> ProfileResult | None:
+    """Сэмплирует event loop seconds секунд. None — профайлер уже запущен или недоступен."""
+    global _running
+    if _running or not available():
+        return None
+    _running = True
+    result = ProfileResult(seconds)
+    previous_handler = signal.signal(signal.SIGALRM, lambda signum, frame: result.add(frame))
+    signal.setitimer(signal.ITIMER_REAL, SAMPLE_INTERVAL_SEC, SAMPLE_INTERVAL_SEC)
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous_handler)
+        _running = False
+    return result
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Квоты трафика пользователей.
+
+Лимит задаётся на пользователя (сумма трафика всех его ключей): личный, по тарифу из
+TRAFFIC_PLANS или DEFAULT_TRAFFIC_LIMIT_GB. При выдаче ключа лимит передаётся в панель как
+totalGB — панель сама отключит ключ, который в одиночку выбрал весь лимит.
+
+Периодическая проверка одним запросом inbounds/list забирает статистику всех клиентов и
+пересчитывает только пользователей, у чьих клиентов изменился трафик с прошлой проверки
+(или которых отметили явно: сменился лимит, выдан или отозван ключ). Для них отправляются
+предупреждения о порогах, а ключи отключаются или включаются обратно через updateClient.
+"""
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+
+from telegram.error import Forbidden
+
+import secrets
+import coordination
+import db_manager
+import inbound_parser
+import rate_limiter
+import server_registry
+import vpn_connector
+
+logger = logging.getLogger(__name__)
+
+_GB = 1024 ** 3
+
+# email -> up + down на момент прошлой проверки
+_last_totals: dict[str, int] = {}
+# Пользователи, которых надо пересчитать независимо от изменения трафика
+_pending_users: set[int] = set()
+_sweep_lock = asyncio.Lock()
+
+
+@dataclass(frozen=True, slots=True)
+class Notification:
+    user_id: int
+    text: str
+
+
+def mark_for_check(user_ids) -> None:
+    _pending_users.update(user_ids)
+
+
+# Новый или отозванный ключ меняет сумму трафика и набор клиентов пользователя
+db_manager.on_subscriptions_changed(mark_for_check)
+
+
+def limit_gb(traffic_limit_gb: int | None, plan: str | None) -> int:
+    """Действующий лимит в ГБ (0 — без лимита)."""
+    if traffic_limit_gb is not None:
+        return traffic_limit_gb
+    plans = getattr(secrets, "TRAFFIC_PLANS", {})
+    if plan and plan in plans:
+        return plans[plan]
+    return getattr(secrets, "DEFAULT_TRAFFIC_LIMIT_GB", 0)
+
+
+def limit_gb_for_user(user: db_manager.User | None) -> int:
+    if user is None:
+        return limit_gb(None, None)
+    return limit_gb(user.traffic_limit_gb, user.plan)
+
+
+def _level(used_bytes: int, limit_bytes: int) -> int:
+    """Сколько порогов предупреждения пройдено."""
+    if not limit_bytes:
+        return 0
+    return sum(1 for threshold in secrets.QUOTA_WARNING_THRESHOLDS if used_bytes >= threshold * limit_bytes)
+
+
+def _evaluate(used_bytes: int, limit_bytes: int, warned_level: int, quota_disabled: bool) -> tuple[int, bool, str | None]:
+    """Новое состояние квоты: (warned_level, quota_disabled, вид уведомления или None)."""
+    level = _level(used_bytes, limit_bytes)
+    exceeded = bool(limit_bytes) and used_bytes >= limit_bytes
+    if exceeded and not quota_disabled:
+        return level, True, "exceeded"
+    if not exceeded and quota_disabled:
+        return level, False, "restored"
+    if level > warned_level:
+        return level, quota_disabled, "warning"
+    # Лимит увеличили или счётчики сбросили — следующий порог снова предупредит
+    return min(level, warned_level), quota_disabled, None
+
+
+def _notification_text(kind: str, used_bytes: int, limit_bytes: int) -> str:
+    used = vpn_connector.format_bytes(used_bytes)
+    limit = vpn_connector.format_bytes(limit_bytes) if limit_bytes else "без лимита"
+    if kind == "exceeded":
+        return secrets.QUOTA_EXCEEDED_MESSAGE.format(used=used, limit=limit)
+    if kind == "restored":
+        return secrets.QUOTA_RESTORED_MESSAGE.format(used=used, limit=limit)
+    return secrets.QUOTA_WARNING_MESSAGE.format(percent=int(used_bytes * 100 / limit_bytes), used=used, limit=limit)
+
+
+async def _apply_to_panel(inbounds: list[dict], desired: dict[str, tuple[bool, int]]) -> set[str]:
+    """Приводит клиентов с указанными email к (enable, totalGB). Возвращает email, которые не удалось обновить."""
+    updates = []
+    for inbound in inbounds:
+        stats_emails = {stat.get("email") for stat in inbound.get("clientStats") or ()}
+        wanted = desired.keys() & stats_emails
+        if not wanted:
+            # settings больших инбаундов разбираем, только если там есть нужные клиенты
+            continue
+        try:
+            clients = inbound_parser.find_clients(inbound.get("settings"), set(wanted))
+        except ValueError as e:
+            logger.error(f"Cannot parse clients of inbound {inbound.get('id')} for quota update: {e}")
+            continue
+        for email, client in clients.items():
+            enable, total_bytes = desired[email]
+            if client.get("enable", True) == enable and (client.get("totalGB") or 0) == total_bytes:
+                continue
+            updates.append((inbound.get("id"), inbound.get("protocol"), {**client, "enable": enable, "totalGB": total_bytes}))
+    if not updates:
+        return set()
+    results = await vpn_connector.update_clients(updates, concurrency=secrets.QUOTA_PANEL_CONCURRENCY)
+    logger.info(f"Quota: updated {sum(results)}/{len(updates)} panel clients.")
+    return {client["email"] for (_, _, client), ok in zip(updates, results) if not ok}
+
+
+async def run_sweep() -> list[Notification] | None:
+    """Одна проверка квот. Возвращает уведомления для пользователей или None, если панель недоступна."""
+    async with _sweep_lock:
+        started = time.perf_counter()
+        inbounds = await vpn_connector.list_inbounds()
+        if inbounds is None:
+            return None
+        owners = await asyncio.to_thread(db_manager.get_active_key_owners)
+
+        user_by_email: dict[str, int] = {}
+        emails_by_user: dict[int, list[str]] = {}
+        for server_id, protocol, inbound_id, user_id, email in owners:
+            user_by_email[email] = user_id
+            emails_by_user.setdefault(user_id, []).append(email)
+
+        pending = set(_pending_users)
+        _pending_users.clear()
+        changed_users = set(pending)
+        totals: dict[str, int] = {}
+        for inbound in inbounds:
+            for stat in inbound.get("clientStats") or ():
+                email = stat.get("email")
+                total = (stat.get("up") or 0) + (stat.get("down") or 0)
+                totals[email] = total
+                if _last_totals.get(email) != total:
+                    user_id = user_by_email.get(email)
+                    if user_id is not None:
+                        changed_users.add(user_id)
+        # Перезаписываем целиком: email удалённых клиентов не копятся
+        _last_totals.clear()
+        _last_totals.update(totals)
+
+        notifications: list[Notification] = []
+        if changed_users:
+            states = await asyncio.to_thread(db_manager.get_quota_states, list(changed_users))
+            desired: dict[str, tuple[bool, int]] = {}
+            new_states: dict[int, tuple[int, int, int, bool]] = {}
+            pending_notifications: dict[int, str] = {}
+            for user_id, (traffic_limit_gb, plan, used_before, warned_level, quota_disabled, carried_bytes) in states.items():
+                limit_bytes = limit_gb(traffic_limit_gb, plan) * _GB
+                # carried_bytes — трафик клиентов, удалённых при переносе ключей на другой сервер
+                used_bytes = carried_bytes + sum(totals.get(email, 0) for email in emails_by_user.get(user_id, ()))
+                new_level, disabled, kind = _evaluate(used_bytes, limit_bytes, warned_level, quota_disabled)
+                if (used_bytes, new_level, disabled) != (used_before, warned_level, quota_disabled):
+                    new_states[user_id] = (user_id, used_bytes, new_level, disabled)
+                if kind:
+                    pending_notifications[user_id] = _notification_text(kind, used_bytes, limit_bytes)
+                # Клиентов в панели трогаем при смене состояния и для явно отмеченных пользователей
+                # (новый ключ у отключённого пользователя, изменённый лимит)
+                if kind in ("exceeded", "restored") or user_id in pending:
+                    for email in emails_by_user.get(user_id, ()):
+                        desired[email] = (not disabled, limit_bytes)
+
+            failed_emails = await _apply_to_panel(inbounds, desired) if desired else set()
+            failed_users = {user_by_email[email] for email in failed_emails if email in user_by_email}
+            if failed_users:
+                # Состояние не сохраняем — следующая проверка повторит обновление
+                _pending_users.update(failed_users)
+            await asyncio.to_thread(db_manager.save_traffic_usage,
+                                    [state for user_id, state in new_states.items() if user_id not in failed_users])
+            notifications = [Notification(user_id, text) for user_id, text in pending_notifications.items() if user_id not in failed_users]
+
+        logger.info(f"Quota sweep: {len(totals)} clients, {len(changed_users)} users re-checked, "
+                    f"{len(notifications)} notifications in {time.perf_counter() - started:.2f}s.")
+        return notifications
+
+
+async def _send(bot, notifications: list[Notification]) -> None:
+    semaphore = asyncio.Semaphore(secrets.BROADCAST_CONCURRENCY)
+
+    async def send_one(notification: Notification) -> None:
+        async with semaphore:
+            try:
+                await bot.send_message(chat_id=notification.user_id, text=notification.text,
+                                       rate_limit_args={"priority": rate_limiter.PRIORITY_NOTIFICATION})
+            except Forbidden:
+                logger.info(f"User {notification.user_id} blocked the bot, quota notification skipped.")
+            except Exception as e:
+                logger.error(f"Failed to send quota notification to {notification.user_id}: {e}")
+
+    await asyncio.gather(*(send_one(notification) for notification in notifications))
+
+
+async def quota_job(context) -> None:
+    if not coordination.is_leader():
+        # В режиме --workers квоты проверяет только воркер-лидер
+        return
+    try:
+        notifications = await run_sweep()
+    except Exception as e:
+        logger.error(f"Quota sweep failed: {e}", exc_info=True)
+        return
+    if notifications:
+        await _send(context.bot, notifications)
+
+
+def schedule(application) -> None:
+    if not server_registry.available_protocols() & {"vless", "shadowsocks"}:
+        return
+    if application.job_queue is None:
+        logger.warning("JobQueue is not available (install python-telegram-bot[job-queue]); traffic quotas are not enforced.")
+        return
+    application.job_queue.run_repeating(quota_job, interval=secrets.QUOTA_CHECK_INTERVAL, first=60, name="quota")
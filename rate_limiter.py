@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextlib
+import datetime
+import heapq
+import itertools
+import logging
+import time
+from typing import Any, Callable, Coroutine
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+import secrets
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты исходящих запросов: чем меньше число, тем раньше запрос получит токен.
+PRIORITY_INTERACTIVE = 0  # Ответы на нажатия кнопок и команды пользователя
+PRIORITY_NOTIFICATION = 5  # Уведомления администратору и пользователям
+PRIORITY_BACKGROUND = 10  # Рассылки и прочие фоновые задачи
+
+# Методы, которые Telegram не учитывает в лимите на отправку сообщений.
+_UNLIMITED_ENDPOINTS = frozenset({"answerCallbackQuery", "answerInlineQuery", "getMe", "getUpdates"})
+
+
+def retry_after_seconds(exc: RetryAfter) -> float:
+    """Возвращает retry_after в секундах независимо от версии python-telegram-bot."""
+    value = exc.retry_after
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class PriorityTokenBucket:
+    """Токен-бакет, который выдаёт токены ожидающим в порядке приоритета, затем FIFO."""
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic):
+        self._rate = rate
+        self._capacity = capacity
+        self._clock = clock
+        self._tokens = capacity
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._waiters: list[tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._timer: asyncio.TimerHandle | None = None
+
+    @property
+    def idle(self) -> bool:
+        """Бакет полон и никто не ждёт — его можно удалить без потери состояния."""
+        self._refill()
+        return not self._waiters and self._tokens >= self._capacity and self._clock() >= self._blocked_until
+
+    def block_for(self, seconds: float) -> None:
+        """Останавливает выдачу токенов на seconds (реакция на retry_after)."""
+        self._blocked_until = max(self._blocked_until, self._clock() + seconds)
+        self._tokens = 0.0
+        self._updated = self._clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        if now < self._blocked_until:
+            self._updated = now
+            return
+        self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._rate)
+        self._updated = now
+
+    async def acquire(self, priority: int = PRIORITY_INTERACTIVE) -> None:
+        self._refill()
+        if not self._waiters and self._tokens >= 1:
+            self._tokens -= 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._schedule()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Токен уже был выдан, но ожидающий отменён — возвращаем токен в бакет
+                self._tokens = min(self._capacity, self._tokens + 1)
+                self._schedule()
+            raise
+
+    def _schedule(self) -> None:
+        if self._timer is not None or not self._waiters:
+            return
+        now = self._clock()
+        if now < self._blocked_until:
+            delay = self._blocked_until - now
+        else:
+            delay = max(0.0, (1 - self._tokens) / self._rate)
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def _dispatch(self) -> None:
+        self._timer = None
+        self._refill()
+        while self._waiters and self._tokens >= 1:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._tokens -= 1
+            future.set_result(None)
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        self._schedule()
+
+
+class PriorityRateLimiter(BaseRateLimiter[dict]):
+    """Планировщик исходящих запросов к Bot API.
+
+    Ограничивает общий поток сообщений бота и поток в каждый отдельный чат, реагирует на
+    ``retry_after`` и пропускает интерактивные ответы раньше фоновых рассылок.
+    Через ``rate_limit_args`` методов бота можно передать ``{"priority": ..., "max_retries": ...}``.
+    """
+
+    def __init__(
+        self,
+        overall_rate: float = 30,
+        private_chat_rate: float = 1,
+        group_chat_rate: float = 20 / 60,
+        max_retries: int = 3,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self._overall_rate = overall_rate
+        self._private_chat_rate = private_chat_rate
+        self._group_chat_rate = group_chat_rate
+        self._max_retries = max_retries
+        self._clock = clock
+        self._global_bucket: PriorityTokenBucket | None = None
+        self._chat_buckets: dict[int | str, PriorityTokenBucket] = {}
+        self._last_prune = 0.0
+
+    async def initialize(self) -> None:
+        # Ёмкость 1: запросы равномерно распределяются во времени, и в любом окне в одну секунду
+        # их не больше overall_rate (при большей ёмкости всплеск + пополнение превышает лимит)
+        self._global_bucket = PriorityTokenBucket(self._overall_rate, 1, clock=self._clock)
+        self._chat_buckets.clear()
+
+    async def shutdown(self) -> None:
+        self._chat_buckets.clear()
+
+    def _chat_bucket(self, chat_id: int | str) -> PriorityTokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            rate = self._group_chat_rate if is_group else self._private_chat_rate
+            bucket = PriorityTokenBucket(rate, 1, clock=self._clock)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune_chat_buckets(self) -> None:
+        now = self._clock()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        for chat_id in [cid for cid, bucket in self._chat_buckets.items() if bucket.idle]:
+            del self._chat_buckets[chat_id]
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, bool | dict | list[dict]]],
+        args: Any,
+        kwargs: dict[str, Any],
+        endpoint: str,
+        data: dict[str, Any],
+        rate_limit_args: dict | None,
+    ) -> bool | dict | list[dict]:
+        rate_limit_args = rate_limit_args or {}
+        priority = rate_limit_args.get("priority", PRIORITY_INTERACTIVE)
+        max_retries = rate_limit_args.get("max_retries", self._max_retries)
+
+        chat_id = data.get("chat_id")
+        with contextlib.suppress(ValueError, TypeError):
+            chat_id = int(chat_id)
+        limited = endpoint not in _UNLIMITED_ENDPOINTS and chat_id is not None
+
+        for attempt in range(max_retries + 1):
+            if limited:
+                self._prune_chat_buckets()
+                with tracing.span("bot_api.wait", endpoint):
+                    await self._chat_bucket(chat_id).acquire(priority)
+                    await self._global_bucket.acquire(priority)
+            try:
+                with tracing.span("bot_api", endpoint):
+                    return await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                delay = retry_after_seconds(exc)
+                if attempt >= max_retries:
+                    logger.error(f"Bot API flood limit on {endpoint} (chat {chat_id}) persists after {max_retries} retries.")
+                    raise
+                logger.warning(f"Bot API asked to retry {endpoint} (chat {chat_id}) after {delay}s. Attempt {attempt + 1}/{max_retries}.")
+                # Флуд-контроль Telegram действует на всего бота, поэтому тормозим все запросы
+                self._global_bucket.block_for(delay)
+                if chat_id is not None:
+                    self._chat_bucket(chat_id).block_for(delay)
+                if not limited:
+                    await asyncio.sleep(delay)
+
+
+def build_rate_limiter(workers: int = 1) -> PriorityRateLimiter:
+    # Общий лимит бота делится между воркерами; лимиты на чат — нет: чат обслуживает один воркер
+    return PriorityRateLimiter(
+        overall_rate=secrets.BOT_API_MESSAGES_PER_SECOND / workers,
+        private_chat_rate=secrets.BOT_API_PRIVATE_CHAT_MESSAGES_PER_SECOND,
+        group_chat_rate=secrets.BOT_API_GROUP_CHAT_MESSAGES_PER_MINUTE / 60,
+        max_retries=secrets.BOT_API_MAX_RETRIES,
+    )
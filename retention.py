@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Хранение истории ключей: архив отозванных ключей и обслуживание базы SQLite.
+
+Отозванные ключи, выданные раньше чем SUBSCRIPTION_RETENTION_DAYS дней назад, переносятся из
+subscriptions в subscriptions_archive пачками по RETENTION_BATCH_SIZE — каждая пачка отдельной
+короткой транзакцией с паузой между ними, чтобы выдача ключей не ждала базу. Активные ключи
+не архивируются, даже если прошёл expires_at: клиент в панели при этом продолжает работать
+(expiryTime = 0), и запись нужна, чтобы его можно было отозвать. Поэтому счётчики
+user_key_counts архив не меняет.
+
+После архивации на SQLite выполняется ANALYZE, а VACUUM — только если свободные страницы
+занимают больше SQLITE_VACUUM_FREE_RATIO файла: VACUUM переписывает базу целиком и на это
+время блокирует запись. В Postgres то же делает autovacuum.
+"""
+import asyncio
+import datetime
+import logging
+import time
+
+import secrets
+import coordination
+import db_manager
+import lifecycle
+
+logger = logging.getLogger(__name__)
+
+# Пауза между пачками: между ними успевают пройти записи обработчиков
+_BATCH_PAUSE_SEC = 0.05
+
+
+async def archive_revoked() -> int:
+    """Переносит в архив отозванные ключи старше срока хранения. Возвращает, сколько перенесено."""
+    days = getattr(secrets, "SUBSCRIPTION_RETENTION_DAYS", None)
+    if days is None:
+        return 0
+    created_before = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) - datetime.timedelta(days=days)
+    batch_size = getattr(secrets, "RETENTION_BATCH_SIZE", 1000)
+    total, after_id = 0, 0
+    while not lifecycle.is_draining():
+        after_id, archived = await asyncio.to_thread(db_manager.archive_subscriptions, created_before, after_id, batch_size)
+        if after_id is None:
+            break
+        total += archived
+        await asyncio.sleep(_BATCH_PAUSE_SEC)
+    return total
+
+
+async def maintain_sqlite() -> None:
+    if db_manager.engine.dialect.name != 'sqlite':
+        return
+    started = time.perf_counter()
+    await asyncio.to_thread(db_manager.sqlite_maintenance, "ANALYZE")
+    free_ratio = await asyncio.to_thread(db_manager.sqlite_free_ratio)
+    vacuum_ratio = getattr(secrets, "SQLITE_VACUUM_FREE_RATIO", 0.25)
+    if vacuum_ratio is not None and free_ratio > vacuum_ratio:
+        logger.info(f"{free_ratio:.0%} of the database file is free, running VACUUM.")
+        await asyncio.to_thread(db_manager.sqlite_maintenance, "VACUUM")
+    logger.info(f"SQLite maintenance done in {time.perf_counter() - started:.1f}s.")
+
+
+async def retention_job(context) -> None:
+    if not coordination.is_leader():
+        # В режиме --workers архивирует только воркер-лидер
+        return
+    try:
+        archived = await archive_revoked()
+        logger.info(f"Retention: {archived} revoked subscriptions archived.")
+        await maintain_sqlite()
+    except Exception as e:
+        logger.error(f"Retention job failed: {e}", exc_info=True)
+
+
+def schedule(application) -> None:
+    if application.job_queue is None:
+        logger.warning("JobQueue is not available (install python-telegram-bot[job-queue]); revoked keys are not archived.")
+        return
+    interval = getattr(secrets, "RETENTION_INTERVAL_HOURS", 24) * 3600
+    application.job_queue.run_repeating(retention_job, interval=interval, first=600, name="retention")
@@ -12,6 +12,7 @@ INSTRUCTION_LINK = "https://your_link" #Ссылка на гайд по подк
 
 # --- База данных ---
 DATABASE_URL = "sqlite:///vpn_bot.db"
+WORKERS = 1 # Сколько процессов обрабатывают обновления (то же, что python main.py --workers N). Воркеры делят эту базу: SQLite (бот включает режим WAL) или Postgres (postgresql://...)
 
 # --- Настройки 3x-ui API (для управления VLESS через API) ---
 XUI_API_URL = "http://127.0.0.1:port/path" # <-- УКАЖИТЕ ПРАВИЛЬНЫЙ URL ВАШЕЙ ПАНЕЛИ, ЕСЛИ БОТ НА ТОМ ЖЕ СЕРВЕРЕ, ЧТО И ПАНЕЛЬ, ТО ОСТАВЛЯЕМ LOCALHOST, ИНАЧЕ ПРАВИЛЬНЫЙ IP ПАНЕЛИ
@@ -19,6 +20,54 @@ XUI_USERNAME = "Login" #  ЛОГИН ОТ ПАНЕЛИ 3x-ui
 XUI_PASSWORD = "Password" #  ПАРОЛЬ ОТ ПАНЕЛИ 3x-ui
 XUI_SHADOWSOCKS_MASTER_KEY = "Your_secret_key" # МАСТЕР КЛЮЧ ДЛЯ SS
 MAX_KEYS_PER_USER = 4 # Максимальное количество ключей на одного пользователя
+KEY_COUNT_CACHE_SIZE = 100000 # Для скольких пользователей держать в памяти число их ключей
+XUI_MAX_CLIENTS_PER_INBOUND = 0 # Сколько клиентов класть в один инбаунд, дальше — в следующий инбаунд сервера (xui_<протокол>_inbound_ids). 0 — без порога
+
+# --- Лимиты исходящих запросов к Bot API ---
+BOT_API_MESSAGES_PER_SECOND = 30 # Общий лимит сообщений бота в секунду
+BOT_API_PRIVATE_CHAT_MESSAGES_PER_SECOND = 1 # Лимит сообщений в один личный чат в секунду
+BOT_API_GROUP_CHAT_MESSAGES_PER_MINUTE = 20 # Лимит сообщений в одну группу в минуту
+BOT_API_MAX_RETRIES = 3 # Сколько раз повторять запрос после ответа 429 (retry_after)
+
+# --- Повторные нажатия кнопок ---
+COALESCE_WINDOW_SEC = 1.0 # Повтор той же кнопки в течение этого времени после обработки отвечается без запуска обработчика
+
+# --- Диагностика ---
+HEALTH_HOST = "127.0.0.1" # Служебный эндпоинт /livez, /readyz, /healthz — только для локальных проверок
+HEALTH_PORT = 8081 # None — эндпоинт отключён
+SHUTDOWN_DRAIN_TIMEOUT_SEC = 20 # Сколько при остановке ждать выдачи ключей и фоновых задач (меньше таймаута остановки systemd/Docker)
+SLOW_TRACE_THRESHOLD_SEC = 5.0 # Обработка обновления дольше этого времени пишется в лог со всеми запросами к БД, панели и Bot API. 0 — трассировка выключена
+
+# --- Квоты трафика ---
+DEFAULT_TRAFFIC_LIMIT_GB = 0 # Лимит трафика на пользователя (все его ключи вместе), ГБ. 0 — без лимита
+TRAFFIC_PLANS = {} # Тарифы для /quota, например {"basic": 50, "pro": 200} (ГБ)
+QUOTA_CHECK_INTERVAL = 300 # Как часто (в секундах) проверять трафик в панели
+QUOTA_WARNING_THRESHOLDS = [0.8, 0.95] # При какой доле лимита предупреждать пользователя
+QUOTA_PANEL_CONCURRENCY = 10 # Сколько клиентов одновременно включать/отключать в панели
+
+# --- Ссылка-подписка (все ключи пользователя одной ссылкой для приложения) ---
+SUBSCRIPTION_PUBLIC_URL = None # Внешний адрес эндпоинта, например "https://vpn.example.com:8080". None — подписка отключена
+SUBSCRIPTION_HOST = "0.0.0.0" # На каком адресе слушать HTTP
+SUBSCRIPTION_PORT = 8080 # На каком порту слушать HTTP
+SUBSCRIPTION_UPDATE_INTERVAL_HOURS = 12 # Как часто приложениям советуют обновлять подписку
+SUBSCRIPTION_CACHE_SIZE = 10000 # Сколько пользователей держать в кэше ответов
+
+# --- Хранение истории и выгрузка ---
+SUBSCRIPTION_RETENTION_DAYS = 30 # Отозванные ключи, выданные раньше, переносятся в архив (subscriptions_archive). None — не архивировать
+RETENTION_BATCH_SIZE = 1000 # Сколько ключей переносить в архив одной транзакцией
+RETENTION_INTERVAL_HOURS = 24 # Как часто архивировать ключи и обслуживать базу (ANALYZE, при необходимости VACUUM)
+SQLITE_VACUUM_FREE_RATIO = 0.25 # VACUUM, если свободные страницы занимают больше этой доли файла SQLite. None — без VACUUM
+EXPORT_CHUNK_SIZE = 5000 # Сколько строк читать из базы за один запрос при выгрузке (/export)
+EXPORT_DIR = "exports" # Куда писать файлы выгрузки; файл больше 50 МБ (лимит Telegram) остаётся здесь
+
+# --- Рассылки (/broadcast) ---
+BROADCAST_CHUNK_SIZE = 200 # Сколько пользователей читать из БД за один запрос
+BROADCAST_CONCURRENCY = 30 # Сколько сообщений рассылки может ожидать отправки одновременно
+
+# --- Перенос ключей между серверами (/migrate) ---
+MIGRATION_CHUNK_SIZE = 100 # Сколько ключей переносить за одну пачку (один addClient на инбаунд)
+MIGRATION_PAUSE_SEC = 1.0 # Минимальная пауза между пачками; если панель отвечала дольше — пауза равна этому времени
+MIGRATION_PANEL_CONCURRENCY = 5 # Сколько одновременных запросов к панели при удалении старых клиентов
 
 SERVERS = [
     {
@@ -33,7 +82,19 @@ SERVERS = [
         "xui_vless_public_key": "your_public_key", #ВАШ ПУБЛИЧНЫЙ КЛЮЧ REALITY
         "xui_vless_sni": "your_sni.com", # SNI ИЗ НАСТРОЕК REALITY
         "xui_vless_short_id": "your_short_id", # SHORT ID ИЗ НАСТРОЕК REALITY
+        "xui_vless_fingerprint": "chrome", # FINGERPRINT ИЗ НАСТРОЕК REALITY (по умолчанию chrome)
         "xui_vless_flow": "xtls-rprx-vision", 
+        # Необязательно: несколько инбаундов с одинаковыми настройками Reality (клиенты распределяются по ним
+        # по XUI_MAX_CLIENTS_PER_INBOUND) и порты, на которых бот сам создаст копии основного инбаунда, когда все заполнятся
+        # "xui_vless_inbound_ids": [3, 4],
+        # "xui_vless_spare_ports": [8443, 9443],
+        # "xui_max_clients_per_inbound": 2000, # порог для этого сервера вместо XUI_MAX_CLIENTS_PER_INBOUND
+        # Необязательно: транспорт и защита, если инбаунд не TCP + Reality
+        # "xui_vless_network": "tcp", # tcp, ws, grpc или xhttp
+        # "xui_vless_security": "reality", # reality, tls или none
+        # "xui_vless_path": "/ws", "xui_vless_host": "example.com", # для ws и xhttp
+        # "xui_vless_service_name": "grpc", # для grpc
+        # "xui_vless_alpn": "h2,http/1.1", # для tls
     },
 
 	# --- Настройки shadowsocks ---
@@ -45,10 +106,19 @@ SERVERS = [
 
         # Настройки Shadowsocks инбаунда
         "xui_shadowsocks_inbound_id": 2, 
-        "xui_shadowsocks_method": "2022-blake3-aes-256-gcm", 
-    }
+        "xui_shadowsocks_method": "2022-blake3-aes-256-gcm", # Как в инбаунде: 2022-blake3-* (нужен XUI_SHADOWSOCKS_MASTER_KEY), aes-256-gcm, chacha20-ietf-poly1305 ...
+    },
+
+	# Необязательно: сервер Outline — кнопка Outline появится в выборе протокола
+	# {"id": 3, "name": "Outline Server", "region": "Германия 🚀", "ip": "255.255.255.255",
+	#  "outline_api_url": "https://255.255.255.255:12345/SecretPath"}, # apiUrl из Outline Manager
 ]
 
+# Необязательно: путь к JSON-файлу со списком серверов в том же формате, что и SERVERS.
+# Если задан, серверы берутся из файла, и его изменения применяются без перезапуска бота.
+SERVERS_CONFIG_FILE = None
+SERVERS_RELOAD_INTERVAL = 30 # Как часто (в секундах) проверять, изменился ли файл серверов
+
 # --- Тексты сообщений ---
 WELCOME_MESSAGE = "👋 Добро пожаловать!\n\nНажмите кнопку, чтобы получить ключ доступа."
 MY_KEYS_MESSAGE_HEADER = "📄 **Ваши активные ключи:**\n\n"
@@ -59,6 +129,19 @@ KEY_SUCCESS_MESSAGE = (
     "`{key}`\n\n"
     "Вы можете получить еще {keys_left} ключ(а/ей)."
 )
+SUBSCRIPTION_LINK_MESSAGE = "🔗 **Ссылка-подписка** (все ключи сразу, добавьте её в приложение как подписку):\n`{url}`\n"
+KEY_RECOVERED_MESSAGE = (
+    "✅ Ключ, который не удалось выдать из-за сбоя, готов:\n\n"
+    "`{key}`"
+)
+QUOTA_WARNING_MESSAGE = "⚠️ Использовано {percent}% трафика: {used} из {limit}. После исчерпания лимита ключи будут приостановлены."
+QUOTA_EXCEEDED_MESSAGE = "⛔ Лимит трафика исчерпан ({used} из {limit}). Ключи приостановлены — для продления свяжитесь с администратором."
+QUOTA_RESTORED_MESSAGE = "✅ Доступ восстановлен: использовано {used} из {limit}."
+MIGRATION_NOTICE_MESSAGE = (
+    "🔄 Ваши ключи перенесены на другой сервер ({region}). Старые ключи перестанут работать — "
+    "замените их в приложении на новые:\n\n{keys}"
+)
+QUOTA_BLOCKED_KEY_MESSAGE = "Лимит трафика исчерпан, новые ключи недоступны. Для продления свяжитесь с администратором."
 KEY_LIMIT_REACHED_MESSAGE = "Превышен лимит ключей на одного пользователя. Для получения дополнительных ключей свяжитесь с администратором."
 GENERIC_ERROR = "Произошла ошибка. Попробуйте позже или свяжитесь с администратором."
 KEY_GENERATION_ERROR = "Произошла ошибка при автоматической генерации ключа. Мы уже уведомили администратора. Пожалуйста, попробуйте еще раз через некоторое время или свяжитесь с ним напрямую."
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Any, Mapping
+
+import secrets
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VLESS_FINGERPRINT = "chrome"
+VLESS_NETWORKS = ("tcp", "ws", "grpc", "xhttp")
+VLESS_SECURITY = ("reality", "tls", "none")
+
+
+class RegistryError(ValueError):
+    """Ошибка в описании серверов (secrets.SERVERS или SERVERS_CONFIG_FILE)."""
+
+
+@dataclass(frozen=True, slots=True)
+class VlessInbound:
+    inbound_id: int
+    public_key: str
+    sni: str
+    short_id: str
+    fingerprint: str
+    flow: str
+    network: str = "tcp"
+    security: str = "reality"
+    # Транспорт ws/xhttp: путь и заголовок Host; grpc: serviceName
+    path: str = ""
+    host: str = ""
+    service_name: str = ""
+    alpn: str = ""
+    # Дополнительные инбаунды с теми же настройками, куда переходят новые клиенты, когда основной заполнен
+    extra_inbound_ids: tuple[int, ...] = ()
+    # Свободные порты для инбаундов, которые бот создаёт сам, когда заполнены все перечисленные
+    spare_ports: tuple[int, ...] = ()
+
+
+@dataclass(frozen=True, slots=True)
+class ShadowsocksInbound:
+    inbound_id: int
+    method: str
+    extra_inbound_ids: tuple[int, ...] = ()
+    spare_ports: tuple[int, ...] = ()
+
+
+@dataclass(frozen=True, slots=True)
+class ServerRecord:
+    id: int
+    name: str
+    region: str
+    ip: str
+    protocols: frozenset[str]
+    vless: VlessInbound | None = None
+    shadowsocks: ShadowsocksInbound | None = None
+    outline_api_url: str | None = None
+    # Порог клиентов в одном инбаунде 3x-ui; None — общий XUI_MAX_CLIENTS_PER_INBOUND
+    max_clients_per_inbound: int | None = None
+    # Исходный словарь из конфигурации (только для чтения) — для редких необязательных ключей, например SSH
+    raw: Mapping[str, Any] = field(default_factory=lambda: MappingProxyType({}))
+
+    def inbound_id(self, protocol: str) -> int | None:
+        """Основной инбаунд протокола: по нему строится шаблон для инбаундов, создаваемых ботом."""
+        if protocol == "vless" and self.vless:
+            return self.vless.inbound_id
+        if protocol == "shadowsocks" and self.shadowsocks:
+            return self.shadowsocks.inbound_id
+        return None
+
+    def inbound_ids(self, protocol: str) -> tuple[int, ...]:
+        """Инбаунды протокола из конфигурации: основной и дополнительные."""
+        inbound = self.vless if protocol == "vless" else self.shadowsocks if protocol == "shadowsocks" else None
+        return (inbound.inbound_id, *inbound.extra_inbound_ids) if inbound else ()
+
+    def spare_ports(self, protocol: str) -> tuple[int, ...]:
+        inbound = self.vless if protocol == "vless" else self.shadowsocks if protocol == "shadowsocks" else None
+        return inbound.spare_ports if inbound else ()
+
+
+@dataclass(frozen=True, slots=True)
+class _Snapshot:
+    servers: tuple[ServerRecord, ...]
+    by_id: Mapping[int, ServerRecord]
+    by_protocol: Mapping[str, tuple[ServerRecord, ...]]
+    by_region: Mapping[str, tuple[ServerRecord, ...]]
+
+
+# Текущий снимок реестра. Перезагрузка собирает новый снимок и подменяет ссылку целиком,
+# поэтому читатели никогда не видят наполовину обновлённые индексы.
+_snapshot: _Snapshot | None = None
+_config_file_mtime: float | None = None
+
+
+def _is_int(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _inbound_ids(server_config: dict, prefix: str) -> tuple[int, ...]:
+    """xui_<протокол>_inbound_id и/или список xui_<протокол>_inbound_ids — основной инбаунд первым."""
+    inbound_ids = []
+    if server_config.get(f"{prefix}_inbound_id") is not None:
+        inbound_ids.append(server_config[f"{prefix}_inbound_id"])
+    inbound_ids += [inbound_id for inbound_id in server_config.get(f"{prefix}_inbound_ids") or () if inbound_id not in inbound_ids]
+    return tuple(inbound_ids)
+
+
+def _parse_server(server_config: dict, errors: list[str]) -> ServerRecord | None:
+    server_id = server_config.get("id")
+    label = f"server {server_id!r}"
+    if not _is_int(server_id):
+        errors.append(f"{label}: 'id' must be an integer.")
+        return None
+
+    problems = []
+    for key in ("xui_vless_inbound_id", "xui_shadowsocks_inbound_id", "xui_max_clients_per_inbound"):
+        value = server_config.get(key)
+        if value is not None and not _is_int(value):
+            errors.append(f"{label}: '{key}' must be an integer.")
+            return None
+    for key in ("xui_vless_inbound_ids", "xui_shadowsocks_inbound_ids", "xui_vless_spare_ports", "xui_shadowsocks_spare_ports"):
+        value = server_config.get(key)
+        if value is not None and (not isinstance(value, (list, tuple)) or not all(_is_int(item) for item in value)):
+            errors.append(f"{label}: '{key}' must be a list of integers.")
+            return None
+    ip = str(server_config.get("ip") or "").strip()
+    if not ip:
+        problems.append("'ip' (public address) is required")
+    region = server_config.get("region")
+    if not region:
+        problems.append("'region' is required")
+
+    vless = None
+    vless_inbound_ids = _inbound_ids(server_config, "xui_vless")
+    if vless_inbound_ids:
+        network = server_config.get("xui_vless_network") or "tcp"
+        security = server_config.get("xui_vless_security") or "reality"
+        required = ("xui_vless_public_key", "xui_vless_sni", "xui_vless_short_id") if security == "reality" else ()
+        missing = [key for key in required if not server_config.get(key)]
+        if network not in VLESS_NETWORKS:
+            problems.append(f"'xui_vless_network' must be one of {', '.join(VLESS_NETWORKS)}")
+        elif security not in VLESS_SECURITY:
+            problems.append(f"'xui_vless_security' must be one of {', '.join(VLESS_SECURITY)}")
+        elif missing:
+            problems.append(f"VLESS Reality settings missing: {', '.join(missing)}")
+        elif server_config.get("xui_vless_flow") and network != "tcp":
+            problems.append("'xui_vless_flow' is only supported with the tcp transport")
+        else:
+            vless = VlessInbound(
+                inbound_id=vless_inbound_ids[0],
+                public_key=server_config.get("xui_vless_public_key") or "",
+                sni=server_config.get("xui_vless_sni") or "",
+                short_id=server_config.get("xui_vless_short_id") or "",
+                fingerprint=server_config.get("xui_vless_fingerprint") or DEFAULT_VLESS_FINGERPRINT,
+                flow=server_config.get("xui_vless_flow") or "",
+                network=network,
+                security=security,
+                path=server_config.get("xui_vless_path") or "",
+                host=server_config.get("xui_vless_host") or "",
+                service_name=server_config.get("xui_vless_service_name") or "",
+                alpn=server_config.get("xui_vless_alpn") or "",
+                extra_inbound_ids=vless_inbound_ids[1:],
+                spare_ports=tuple(server_config.get("xui_vless_spare_ports") or ()),
+            )
+
+    shadowsocks = None
+    shadowsocks_inbound_ids = _inbound_ids(server_config, "xui_shadowsocks")
+    if shadowsocks_inbound_ids:
+        if not server_config.get("xui_shadowsocks_method"):
+            problems.append("'xui_shadowsocks_method' is required for a Shadowsocks inbound")
+        else:
+            shadowsocks = ShadowsocksInbound(
+                inbound_id=shadowsocks_inbound_ids[0],
+                method=server_config["xui_shadowsocks_method"],
+                extra_inbound_ids=shadowsocks_inbound_ids[1:],
+                spare_ports=tuple(server_config.get("xui_shadowsocks_spare_ports") or ()),
+            )
+
+    outline_api_url = server_config.get("outline_api_url") or None
+
+    protocols = set()
+    if vless:
+        protocols.add("vless")
+    if shadowsocks:
+        protocols.add("shadowsocks")
+    if outline_api_url:
+        protocols.add("outline")
+    declared = server_config.get("protocols_available")
+    if declared is not None:
+        undeclared = set(declared) - protocols
+        if undeclared and not problems:
+            problems.append(f"'protocols_available' lists {sorted(undeclared)} but their settings are missing")
+        protocols &= set(declared)
+    if not protocols and not problems:
+        problems.append("no protocol is configured (xui_vless_*, xui_shadowsocks_* or outline_api_url)")
+
+    if problems:
+        errors.extend(f"{label}: {problem}." for problem in problems)
+        return None
+
+    return ServerRecord(
+        id=server_id,
+        name=server_config.get("name") or f"Server {server_id}",
+        region=region,
+        ip=ip,
+        protocols=frozenset(protocols),
+        vless=vless,
+        shadowsocks=shadowsocks,
+        outline_api_url=outline_api_url,
+        max_clients_per_inbound=server_config.get("xui_max_clients_per_inbound"),
+        raw=MappingProxyType(dict(server_config)),
+    )
+
+
+def build(server_configs: list[dict]) -> _Snapshot:
+    """Проверяет описание серверов целиком и строит индексы. Все ошибки собираются в RegistryError."""
+    if not isinstance(server_configs, list) or not server_configs:
+        raise RegistryError("SERVERS must be a non-empty list.")
+
+    errors: list[str] = []
+    records: list[ServerRecord] = []
+    seen_ids = set()
+    for server_config in server_configs:
+        if not isinstance(server_config, dict):
+            errors.append(f"server entry {server_config!r} must be a dict.")
+            continue
+        record = _parse_server(server_config, errors)
+        if record is None:
+            continue
+        if record.id in seen_ids:
+            errors.append(f"server {record.id}: duplicate id.")
+            continue
+        seen_ids.add(record.id)
+        records.append(record)
+    if errors:
+        raise RegistryError("Invalid server configuration:\n - " + "\n - ".join(errors))
+
+    by_protocol: dict[str, list[ServerRecord]] = {}
+    by_region: dict[str, list[ServerRecord]] = {}
+    for record in records:
+        for protocol in record.protocols:
+            by_protocol.setdefault(protocol, []).append(record)
+        by_region.setdefault(record.region, []).append(record)
+
+    return _Snapshot(
+        servers=tuple(records),
+        by_id=MappingProxyType({record.id: record for record in records}),
+        by_protocol=MappingProxyType({key: tuple(value) for key, value in by_protocol.items()}),
+        by_region=MappingProxyType({key: tuple(value) for key, value in by_region.items()}),
+    )
+
+
+def _read_config_file(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as config_file:
+        return json.load(config_file)
+
+
+def load() -> None:
+    """Загружает серверы из SERVERS_CONFIG_FILE (если задан) или из secrets.SERVERS."""
+    global _snapshot, _config_file_mtime
+    path = getattr(secrets, "SERVERS_CONFIG_FILE", None)
+    if path:
+        try:
+            _config_file_mtime = os.path.getmtime(path)
+            server_configs = _read_config_file(path)
+        except (OSError, ValueError) as e:
+            raise RegistryError(f"Cannot read servers config file {path}: {e}") from e
+    else:
+        server_configs = secrets.SERVERS
+    _snapshot = build(server_configs)
+    logger.info(f"Server registry loaded: {len(_snapshot.servers)} servers, protocols: {sorted(_snapshot.by_protocol)}.")
+
+
+def reload_if_changed() -> bool:
+    """Перечитывает SERVERS_CONFIG_FILE, если он изменился. При ошибке остаётся прежний реестр."""
+    global _snapshot, _config_file_mtime
+    path = getattr(secrets, "SERVERS_CONFIG_FILE", None)
+    if not path:
+        return False
+    try:
+        mtime = os.path.getmtime(path)
+        if mtime == _config_file_mtime:
+            return False
+        new_snapshot = build(_read_config_file(path))
+    except (OSError, ValueError) as e:
+        logger.error(f"Servers config reload failed, keeping the previous registry: {e}")
+        return False
+    _config_file_mtime = mtime
+    _snapshot = new_snapshot
+    logger.info(f"Server registry reloaded from {path}: {len(new_snapshot.servers)} servers.")
+    return True
+
+
+def _current() -> _Snapshot:
+    if _snapshot is None:
+        load()
+    return _snapshot
+
+
+def get(server_id: int) -> ServerRecord | None:
+    return _current().by_id.get(server_id)
+
+
+def for_protocol(protocol: str) -> tuple[ServerRecord, ...]:
+    return _current().by_protocol.get(protocol, ())
+
+
+def first_for_protocol(protocol: str) -> ServerRecord | None:
+    servers = for_protocol(protocol)
+    return servers[0] if servers else None
+
+
+def for_region(region: str) -> tuple[ServerRecord, ...]:
+    return _current().by_region.get(region, ())
+
+
+def all_servers() -> tuple[ServerRecord, ...]:
+    return _current().servers
+
+
+def available_protocols() -> frozenset[str]:
+    return frozenset(_current().by_protocol)
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+import client_index
+import db_manager
+import vpn_connector
+
+logger = logging.getLogger(__name__)
+
+
+class StartupProfiler:
+    """Замеряет длительность этапов запуска бота (включается флагом --profile-startup)."""
+
+    def __init__(self, enabled: bool, process_started: float):
+        self.enabled = enabled
+        self.process_started = process_started
+        self.phases: list[tuple[str, float]] = []
+        self._first_update_seen = False
+
+    def record(self, name: str, seconds: float) -> None:
+        self.phases.append((name, seconds))
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    async def timed(self, name: str, awaitable):
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def report(self, title: str) -> None:
+        if not self.enabled:
+            return
+        total = time.perf_counter() - self.process_started
+        lines = [f"{name:<28}{seconds * 1000:>9.1f} ms" for name, seconds in self.phases]
+        logger.info(f"Startup profile ({title}), {total * 1000:.1f} ms since process start:\n" + "\n".join(lines))
+
+    async def on_first_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        if self._first_update_seen:
+            return
+        self._first_update_seen = True
+        self.record("first update received", time.perf_counter() - self.process_started)
+        self.report("first update")
+
+
+async def warm_up(profiler: StartupProfiler) -> None:
+    """Параллельно прогревает сессию панели, метаданные инбаундов, индекс клиентов и соединение с БД."""
+    results = await asyncio.gather(
+        profiler.timed("warm-up: 3x-ui panel", vpn_connector.warm_up()),
+        profiler.timed("warm-up: database", asyncio.to_thread(db_manager.warm_up)),
+        profiler.timed("warm-up: client index", client_index.rebuild_from_db()),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.warning(f"Warm-up step failed, continuing startup: {result}", exc_info=result)
+
+
+def install_first_update_probe(application: Application, profiler: StartupProfiler) -> None:
+    if profiler.enabled:
+        # Группа с самым маленьким номером обрабатывается первой и не мешает остальным обработчикам
+        application.add_handler(TypeHandler(Update, profiler.on_first_update), group=-100)
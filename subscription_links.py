@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""Ссылка-подписка: все активные ключи пользователя по одному адресу.
+
+GET /sub/<token> отдаёт ссылки ключей в стандартном формате подписок (base64 от строк
+vless://, ss://, ...). Ответ заранее собран и лежит в кэше вместе с ETag, поэтому
+приложения, опрашивающие подписку каждые несколько минут, обслуживаются без обращения
+к базе, а с If-None-Match получают 304. Кэш сбрасывается по событиям коммита в db_manager.
+Тот же кэш отдаёт список ключей для кнопки «Мои ключи».
+"""
+import asyncio
+import base64
+import datetime
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import secrets
+import coordination
+import db_manager
+from http_server import HttpServer, Request, Response
+
+logger = logging.getLogger(__name__)
+
+_PATH = re.compile(r"^/sub/([A-Za-z0-9_-]{16,64})$")
+
+
+@dataclass(frozen=True, slots=True)
+class KeyView:
+    server_id: int
+    protocol: str
+    key_identifier: str
+    key_data: str
+    created_at: datetime.datetime | None
+
+
+@dataclass(frozen=True, slots=True)
+class _Entry:
+    keys: tuple[KeyView, ...]
+    body: bytes
+    etag: str
+
+
+# user_id -> (запись или None, поколение). Сброс оставляет в LRU запись без ответа с поколением
+# на единицу больше: сборка, начатая до сброса, не попадёт в кэш. Поколения вытесняются вместе
+# с записями, так что память ограничена SUBSCRIPTION_CACHE_SIZE
+_entries: "OrderedDict[int, tuple[_Entry | None, int]]" = OrderedDict()
+_building: dict[int, asyncio.Future] = {}
+# Токен -> users.id; загружается при старте сервера и пополняется при выдаче новых токенов
+_tokens: dict[str, int] = {}
+_server: HttpServer | None = None
+
+
+def is_enabled() -> bool:
+    return bool(getattr(secrets, "SUBSCRIPTION_PUBLIC_URL", None))
+
+
+def subscription_url(token: str) -> str:
+    return f"{secrets.SUBSCRIPTION_PUBLIC_URL.rstrip('/')}/sub/{token}"
+
+
+def invalidate(user_ids) -> None:
+    for user_id in user_ids:
+        _store(user_id, None, _entries.get(user_id, (None, 0))[1] + 1)
+
+
+db_manager.on_subscriptions_changed(invalidate)
+
+
+def _make_entry(rows) -> _Entry:
+    keys = tuple(KeyView(*row) for row in rows)
+    body = base64.b64encode("\n".join(key.key_data for key in keys).encode("utf-8"))
+    etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+    return _Entry(keys=keys, body=body, etag=etag)
+
+
+def _store(user_id: int, entry: _Entry | None, generation: int) -> None:
+    _entries[user_id] = (entry, generation)
+    _entries.move_to_end(user_id)
+    while len(_entries) > getattr(secrets, "SUBSCRIPTION_CACHE_SIZE", 10000):
+        _entries.popitem(last=False)
+
+
+def _cached(user_id: int) -> _Entry | None:
+    entry = _entries.get(user_id, (None, 0))[0]
+    if entry is not None:
+        _entries.move_to_end(user_id)
+    return entry
+
+
+async def _load(user_id: int) -> _Entry:
+    entry = _cached(user_id)
+    if entry is not None:
+        return entry
+    # Одновременные промахи по одному пользователю ждут одну и ту же выборку
+    pending = _building.get(user_id)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    future = asyncio.get_running_loop().create_future()
+    _building[user_id] = future
+    generation = _entries.get(user_id, (None, 0))[1]
+    try:
+        entry = _make_entry(await asyncio.to_thread(db_manager.get_active_key_rows, user_id))
+        if _entries.get(user_id, (None, 0))[1] == generation:
+            _store(user_id, entry, generation)
+        future.set_result(entry)
+        return entry
+    except BaseException as e:
+        future.set_exception(e)
+        future.exception() # Исключение получит вызывающий; не логируем его как забытое
+        raise
+    finally:
+        del _building[user_id]
+
+
+async def get_user_keys(user_id: int) -> tuple[KeyView, ...]:
+    """Активные ключи пользователя из кэша (при промахе — одна выборка из базы)."""
+    return (await _load(user_id)).keys
+
+
+async def get_or_create_token(user_id: int) -> str | None:
+    def create() -> str | None:
+        with db_manager.get_db() as db:
+            return db_manager.get_or_create_sub_token(db, user_id)
+    token = await asyncio.to_thread(create)
+    if token:
+        _tokens[token] = user_id
+    return token
+
+
+def _response(entry: _Entry, request: Request) -> Response:
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == entry.etag:
+        return Response(304, headers=headers)
+    headers["Content-Type"] = "text/plain; charset=utf-8"
+    headers["Profile-Update-Interval"] = str(getattr(secrets, "SUBSCRIPTION_UPDATE_INTERVAL_HOURS", 12))
+    return Response(200, entry.body, headers)
+
+
+async def _respond_after_load(user_id: int, request: Request) -> Response:
+    return _response(await _load(user_id), request)
+
+
+async def _respond_for_new_token(token: str, request: Request) -> Response:
+    user_id = await asyncio.to_thread(db_manager.get_user_id_by_sub_token, token)
+    if user_id is None:
+        return Response(404)
+    _tokens[token] = user_id
+    return await _respond_after_load(user_id, request)
+
+
+def handle_request(request: Request):
+    match = _PATH.match(request.path.split("?", 1)[0])
+    user_id = _tokens.get(match.group(1)) if match else None
+    if user_id is None:
+        if match and coordination.enabled():
+            # Токен мог выдать другой воркер (--workers): ищем его в базе
+            return _respond_for_new_token(match.group(1), request)
+        return Response(404)
+    entry = _cached(user_id)
+    if entry is not None:
+        # Быстрый путь: ответ собирается синхронно, без задач и обращений к базе
+        return _response(entry, request)
+    return _respond_after_load(user_id, request)
+
+
+async def start_server() -> None:
+    global _server
+    if not is_enabled():
+        return
+    _tokens.update(await asyncio.to_thread(db_manager.get_sub_tokens))
+    _server = HttpServer(handle_request, getattr(secrets, "SUBSCRIPTION_HOST", "0.0.0.0"), getattr(secrets, "SUBSCRIPTION_PORT", 8080))
+    await _server.start()
+    logger.info(f"Subscription endpoint started: {len(_tokens)} tokens, public URL {secrets.SUBSCRIPTION_PUBLIC_URL}.")
+
+
+async def stop_server() -> None:
+    global _server
+    if _server is not None:
+        await _server.stop()
+        _server = None
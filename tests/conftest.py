@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Общая настройка тестов: python -m pytest из корня репозитория.
+
+Конфигурация задаётся до импорта модулей бота: движок БД создаётся при импорте db_manager.
+База — SQLite во временном каталоге, панель и Telegram — имитации из benchmarks.
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_load import _prepare_environment  # noqa: E402
+
+_prepare_environment(tempfile.mkdtemp(prefix="vpn-bot-tests-"))
+
+
+
+@pytest.fixture
+def database():
+    """Схема БД с серверами из реестра; после теста таблицы очищаются."""
+    import db_manager
+    import server_registry
+
+    server_registry.load()
+    db_manager.init_db()
+    yield db_manager
+    with db_manager.engine.begin() as conn:
+        for table in reversed(db_manager.Base.metadata.sorted_tables):
+            conn.execute(table.delete())
+
+
+@pytest.fixture
+def panel(database):
+    """Имитация панели 3x-ui без задержек. Тест подключает её через vpn_connector.set_transport()
+    в своём event loop: пул соединений привязан к циклу."""
+    from benchmarks.fake_panel import FakePanel
+
+    return FakePanel(latency=0)
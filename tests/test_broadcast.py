@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from telegram.error import BadRequest, Forbidden, TimedOut
+
+import secrets
+import broadcast
+import lifecycle
+
+
+class StubBot:
+    """Записывает отправленные сообщения; для части пользователей отвечает ошибкой Bot API."""
+
+    def __init__(self, errors: dict[int, Exception] | None = None):
+        self.errors = errors or {}
+        self.sent: list[int] = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        if chat_id in self.errors:
+            raise self.errors[chat_id]
+        self.sent.append(chat_id)
+
+
+def _create(database, user_ids, text="hello") -> int:
+    with database.get_db() as db:
+        for user_id in user_ids:
+            db.add(database.User(id=user_id))
+        db.commit()
+        return database.create_broadcast(db, text, created_by=1).id
+
+
+def _load(database, broadcast_id: int):
+    with database.get_db() as db:
+        return db.get(database.Broadcast, broadcast_id)
+
+
+def test_broadcast_delivers_in_chunks(database, monkeypatch):
+    monkeypatch.setattr(secrets, "BROADCAST_CHUNK_SIZE", 3)
+    broadcast_id = _create(database, range(1, 11))
+    bot = StubBot()
+
+    result = asyncio.run(broadcast.run_broadcast(bot, broadcast_id))
+
+    assert result.status == "completed"
+    assert sorted(bot.sent) == list(range(1, 11))
+    stored = _load(database, broadcast_id)
+    assert (stored.sent_count, stored.failed_count, stored.blocked_count, stored.cursor_user_id) == (10, 0, 0, 10)
+
+
+def test_broadcast_marks_blocked_users(database, monkeypatch):
+    monkeypatch.setattr(secrets, "BROADCAST_CHUNK_SIZE", 2)
+    broadcast_id = _create(database, range(1, 6))
+    bot = StubBot({2: Forbidden("bot was blocked by the user"), 3: BadRequest("Chat not found"), 4: TimedOut()})
+
+    result = asyncio.run(broadcast.run_broadcast(bot, broadcast_id))
+
+    assert (result.sent_count, result.failed_count, result.blocked_count) == (2, 1, 2)
+    with database.get_db() as db:
+        blocked = {user.id for user in db.query(database.User).filter(database.User.is_blocked == True)}  # noqa: E712
+    assert blocked == {2, 3}
+
+
+def test_broadcast_resumes_without_resending(database, monkeypatch):
+    monkeypatch.setattr(secrets, "BROADCAST_CHUNK_SIZE", 4)
+    broadcast_id = _create(database, range(1, 9))
+    # Перезапуск посреди пачки: пользователям 1 и 2 уже доставлено, курсор ещё не сдвинут
+    database.record_broadcast_chunk(broadcast_id, [(1, "sent"), (2, "sent")], cursor_user_id=0)
+    bot = StubBot()
+
+    result = asyncio.run(broadcast.run_broadcast(bot, broadcast_id))
+
+    assert sorted(bot.sent) == list(range(3, 9))
+    assert result.sent_count == 8
+
+
+def test_broadcast_pauses_while_draining(database, monkeypatch):
+    broadcast_id = _create(database, range(1, 4))
+    monkeypatch.setattr(lifecycle, "_state", lifecycle.DRAINING)
+    bot = StubBot()
+
+    result = asyncio.run(broadcast.run_broadcast(bot, broadcast_id))
+
+    assert result.status == "running"
+    assert bot.sent == []
+    assert _load(database, broadcast_id).cursor_user_id == 0
+
+
+def test_cancelled_broadcast_is_not_sent(database):
+    broadcast_id = _create(database, range(1, 4))
+    with database.get_db() as db:
+        database.finish_broadcast(db, broadcast_id, status="cancelled")
+    bot = StubBot()
+
+    result = asyncio.run(broadcast.run_broadcast(bot, broadcast_id))
+
+    assert result.status == "cancelled"
+    assert bot.sent == []
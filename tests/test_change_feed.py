@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from sqlalchemy import insert
+
+
+def _publish(database, change_id: int, user_id: int, origin: str = "worker-2") -> None:
+    with database.engine.begin() as conn:
+        conn.execute(insert(database.SubscriptionChange).values(id=change_id, user_id=user_id, origin=origin))
+
+
+def test_change_committed_out_of_order_is_not_skipped(database):
+    _publish(database, 1, 101)
+    # Транзакция с id 2 ещё не закоммичена, а с id 3 — уже
+    _publish(database, 3, 103)
+
+    last_id, user_ids, missing = database.get_subscription_changes(0, "worker-1")
+    assert (last_id, user_ids, missing) == (3, {101, 103}, {2})
+
+    _publish(database, 2, 102)
+    last_id, user_ids, missing = database.get_subscription_changes(last_id, "worker-1", missing)
+    assert (last_id, user_ids, missing) == (3, {102}, set())
+
+
+def test_own_changes_are_skipped(database):
+    _publish(database, 1, 101, origin="worker-1")
+    _publish(database, 2, 102)
+    assert database.get_subscription_changes(0, "worker-1") == (2, {102}, set())
+    assert database.get_subscription_changes(2, "worker-1") == (2, set(), set())
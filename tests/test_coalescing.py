@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import asyncio
+
+from telegram.ext import CallbackQueryHandler
+
+import secrets
+import coalescing
+from benchmarks.telegram_driver import TelegramDriver
+
+
+def _driver(calls: list):
+    @coalescing.coalesce
+    async def handler(update, context):
+        calls.append(update.callback_query.data)
+        await asyncio.sleep(0.05)
+
+    return TelegramDriver(lambda application: application.add_handler(CallbackQueryHandler(handler)))
+
+
+async def _tap(driver: TelegramDriver, user_id: int, *data: str) -> None:
+    await driver.start()
+    try:
+        # Нажатия приходят одновременно и ждут своей очереди, как при polling
+        await asyncio.gather(*(driver.feed(driver.callback_update(user_id, item)) for item in data))
+    finally:
+        await driver.stop()
+
+
+def test_repeated_press_is_coalesced():
+    calls = []
+    driver = _driver(calls)
+    asyncio.run(_tap(driver, 1001, "get_key_vless", "get_key_vless"))
+    assert calls == ["get_key_vless"]
+    # Повтор получил ответ на callback query без запуска обработчика
+    assert driver.bot_api.calls["answerCallbackQuery"] == 1
+
+
+def test_different_buttons_are_not_coalesced():
+    calls = []
+    asyncio.run(_tap(_driver(calls), 1002, "get_key_vless", "my_keys", "get_key_vless"))
+    assert calls == ["get_key_vless", "my_keys", "get_key_vless"]
+
+
+def test_press_after_window_runs_handler(monkeypatch):
+    monkeypatch.setattr(secrets, "COALESCE_WINDOW_SEC", 0.0)
+    calls = []
+    asyncio.run(_tap(_driver(calls), 1003, "get_key_vless", "get_key_vless"))
+    assert calls == ["get_key_vless", "get_key_vless"]
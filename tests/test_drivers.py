@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import datetime
+
+import pytest
+
+import secrets
+import drivers
+import server_registry
+import vpn_connector
+from benchmarks.fake_panel import FakePanel
+from drivers.base import ProtocolDriver
+from drivers.xui import XuiDriver
+
+
+def test_registered_drivers_are_complete():
+    assert set(drivers.protocols()) >= {"vless", "shadowsocks", "outline"}
+
+
+def test_incomplete_driver_fails_at_registration():
+    class NoHealthDriver(ProtocolDriver):
+        protocol = "wireguard"
+
+        async def create(self, server, user_telegram_id, user_username, total_traffic_gb=None):
+            return None, None
+
+        async def delete(self, server, key_identifier):
+            return True
+
+    with pytest.raises(TypeError):
+        drivers.register(NoHealthDriver())
+    assert "wireguard" not in drivers.protocols()
+
+
+def test_xui_driver_requires_email_format():
+    class NoEmailDriver(XuiDriver):
+        protocol = "vless"
+
+    with pytest.raises(TypeError):
+        NoEmailDriver()
+
+
+def test_reused_orphan_keeps_its_inbound(database, monkeypatch):
+    # Клиент пользователя остался в дополнительном инбаунде пула, а ключ в базу не попал
+    monkeypatch.setattr(secrets, "SERVERS", [dict(secrets.SERVERS[0], xui_vless_inbound_ids=[4])] + secrets.SERVERS[1:])
+    server_registry.load()
+    panel = FakePanel(latency=0, inbounds={1: {"port": 443, "protocol": "vless"}, 4: {"port": 8443, "protocol": "vless"}})
+    panel.add_clients(4, [{"id": "orphan-uuid", "email": "tg_42_orphan@bot.local", "enable": True, "tgId": 42}])
+    with database.get_db() as db:
+        database.add_user(db, 42, "user42")
+
+    async def run():
+        await vpn_connector.set_transport(panel.transport())
+        try:
+            await vpn_connector.warm_up()
+            return await drivers.create_key(1, "vless", 42, "user42")
+        finally:
+            await vpn_connector.close()
+
+    key_data, key_identifier = asyncio.run(run())
+    assert key_identifier == "tg_42_orphan@bot.local"
+    assert key_data.startswith("vless://orphan-uuid@") and ":8443?" in key_data
+    with database.get_db() as db:
+        # Как в bot_handlers: инбаунд не передаётся, add_subscription берёт его из журнала
+        subscription = database.add_subscription(db_session=db, user_id=42, server_id=1, protocol="vless", key_data=key_data,
+                                                 key_identifier=key_identifier, expires_at=datetime.datetime.now(datetime.timezone.utc))
+        assert subscription.inbound_id == 4
+        assert db.query(database.IssuanceJournal.status).filter_by(email=key_identifier).scalar() == "committed"
+    assert len(panel.inbounds[1]["clients"]) == 0
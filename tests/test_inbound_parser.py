@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+import inbound_parser
+
+
+def test_settings_without_clients_keeps_other_fields():
+    settings = {
+        "comment": 'x]"[',
+        "clients": [{"email": 'a]b["', "id": "1", "flow": "", "nested": [1, [2]]}, {"email": "\\\\"}],
+        "decryption": "none",
+        "fallbacks": [{"dest": 80}],
+    }
+    result = inbound_parser.settings_without_clients(json.dumps(settings))
+    assert result == {"comment": 'x]"[', "decryption": "none", "fallbacks": [{"dest": 80}]}
+
+
+@pytest.mark.parametrize("settings", [None, "", "{}", '{"clients": []}'])
+def test_settings_without_clients_empty(settings):
+    assert inbound_parser.settings_without_clients(settings) == {}
+
+
+@pytest.mark.parametrize("settings", ['{"clients": [1, 2', '{"clients": ["a]', '{"method": 1'])
+def test_settings_without_clients_rejects_broken_json(settings):
+    with pytest.raises(ValueError):
+        inbound_parser.settings_without_clients(settings)
+
+
+def test_iter_clients_matches_json_loads():
+    settings = json.dumps({"clients": [{"email": "a", "id": "u1", "tgId": "5"}, {"email": "", "id": "u2"},
+                                       {"email": "b", "password": "p", "enable": False}]})
+    records = list(inbound_parser.iter_clients(settings))
+    assert [(r.email, r.id, r.password, r.enable, r.tg_id) for r in records] == [
+        ("a", "u1", None, True, 5),
+        ("b", None, "p", False, None),
+    ]
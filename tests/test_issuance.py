@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import datetime
+import uuid
+
+import httpx
+
+import config
+import issuance
+import vpn_connector
+
+
+class StubBot:
+    def __init__(self):
+        self.sent: list[tuple[int, str]] = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def _pending(database, panel, user_id: int, email: str, in_panel: bool) -> int:
+    credential = str(uuid.uuid4())
+    with database.get_db() as db:
+        database.add_user(db, user_id, f"user{user_id}")
+    journal_id = database.journal_begin(user_id, 1, "vless", 1, email, credential)
+    if in_panel:
+        # addClient прошёл, а ключ не успели сохранить
+        panel.add_clients(1, [{"id": credential, "email": email, "enable": True, "tgId": user_id}])
+    return journal_id
+
+
+def _status(database, journal_id: int) -> str:
+    with database.get_db() as db:
+        return db.get(database.IssuanceJournal, journal_id).status
+
+
+def _active_keys(database, user_id: int) -> list[str]:
+    with database.get_db() as db:
+        return [s.key_identifier for s in db.query(database.Subscription).filter_by(user_id=user_id, is_active=True)]
+
+
+def _recover(panel, transport=None, **kwargs):
+    async def run():
+        await vpn_connector.set_transport(transport or panel.transport())
+        try:
+            bot = StubBot()
+            return await issuance.recover_pending(bot, **kwargs), bot
+        finally:
+            await vpn_connector.close()
+    return asyncio.run(run())
+
+
+def test_client_in_panel_is_resumed(database, panel):
+    journal_id = _pending(database, panel, 1, "tg_1_crash", in_panel=True)
+
+    summary, bot = _recover(panel)
+
+    assert summary == {"resumed": 1}
+    assert _status(database, journal_id) == "committed"
+    assert _active_keys(database, 1) == ["tg_1_crash"]
+    assert [chat_id for chat_id, _ in bot.sent] == [1]
+
+
+def test_client_missing_from_panel_is_rolled_back(database, panel):
+    journal_id = _pending(database, panel, 2, "tg_2_lost", in_panel=False)
+
+    summary, bot = _recover(panel)
+
+    assert summary == {"rolled_back": 1}
+    assert _status(database, journal_id) == "rolled_back"
+    assert _active_keys(database, 2) == []
+    assert bot.sent == []
+
+
+def test_unknown_state_is_left_pending(database, panel):
+    journal_id = _pending(database, panel, 3, "tg_3_unknown", in_panel=True)
+
+    def unreachable(request):
+        raise httpx.ConnectError("panel is down", request=request)
+
+    summary, _ = _recover(panel, transport=httpx.MockTransport(unreachable))
+
+    assert summary == {"skipped": 1}
+    assert _status(database, journal_id) == "pending"
+    assert _active_keys(database, 3) == []
+
+
+def test_client_over_key_limit_is_removed_from_panel(database, panel):
+    journal_id = _pending(database, panel, 4, "tg_4_extra", in_panel=True)
+    with database.get_db() as db:
+        for i in range(config.get_settings().max_keys_per_user):
+            database.add_subscription(db_session=db, user_id=4, server_id=1, protocol="vless", key_data=f"k{i}",
+                                      key_identifier=f"tg_4_{i}", expires_at=datetime.datetime(2100, 1, 1))
+
+    summary, bot = _recover(panel)
+
+    assert summary == {"rolled_back": 1}
+    assert _status(database, journal_id) == "rolled_back"
+    assert "tg_4_extra" not in panel.inbounds[1]["clients"]
+    assert bot.sent == []
+
+
+def test_recent_and_closed_entries_are_not_touched(database, panel):
+    recent_id = _pending(database, panel, 5, "tg_5_recent", in_panel=True)
+    closed_id = _pending(database, panel, 6, "tg_6_closed", in_panel=False)
+    database.journal_update(closed_id, status="rolled_back")
+
+    # Запись моложе min_age_sec: выдача, возможно, ещё идёт
+    summary, _ = _recover(panel, min_age_sec=300)
+
+    assert summary == {}
+    assert _status(database, recent_id) == "pending"
+    assert _status(database, closed_id) == "rolled_back"
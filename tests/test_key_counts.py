@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from types import SimpleNamespace
+
+import secrets
+import db_manager
+import key_counts
+
+
+def _session():
+    return SimpleNamespace(info={})
+
+
+def test_cache_stays_bounded_with_invalidations(monkeypatch):
+    monkeypatch.setattr(secrets, "KEY_COUNT_CACHE_SIZE", 50)
+    monkeypatch.setattr(key_counts, "_counts", type(key_counts._counts)())
+    monkeypatch.setattr(db_manager, "get_key_counts", lambda db_session, user_id: {"vless": 1})
+
+    for user_id in range(200):
+        key_counts.get(_session(), user_id)
+    key_counts.invalidate(range(1000, 5000))
+
+    assert len(key_counts._counts) == 50
+    caches = {name: value for name, value in vars(key_counts).items()
+              if isinstance(value, dict) and name.startswith("_") and not name.startswith("__")}
+    assert all(len(value) <= 50 for value in caches.values()), {name: len(value) for name, value in caches.items()}
+
+
+def test_read_started_before_invalidation_is_not_cached(monkeypatch):
+    monkeypatch.setattr(key_counts, "_counts", type(key_counts._counts)())
+    counts = {7: {"vless": 1}}
+
+    def get_key_counts(db_session, user_id):
+        result = counts[user_id]
+        # Ключ выдан и закоммичен, пока шла выборка
+        counts[user_id] = {"vless": 2}
+        key_counts.invalidate([user_id])
+        return result
+
+    monkeypatch.setattr(db_manager, "get_key_counts", get_key_counts)
+    assert key_counts.total(_session(), 7) == 1
+    monkeypatch.setattr(db_manager, "get_key_counts", lambda db_session, user_id: counts[user_id])
+    assert key_counts.total(_session(), 7) == 2
+    assert key_counts.total(_session(), 7) == 2
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import base64
+import dataclasses
+from urllib.parse import unquote
+
+import pytest
+
+import config
+import link_templates
+import server_registry
+
+MASTER_KEY = "bWFzdGVyLWtleS1mb3ItdGVzdHMtMzItYnl0ZXMhIQ=="
+
+
+def _server(**overrides):
+    raw = {
+        "id": 1,
+        "name": "Test",
+        "region": "Test",
+        "ip": "203.0.113.7",
+        "xui_vless_inbound_id": 1,
+        "xui_vless_public_key": "pbk",
+        "xui_vless_sni": "example.com",
+        "xui_vless_short_id": "ab12",
+        "xui_vless_fingerprint": "chrome",
+        "xui_vless_flow": "xtls-rprx-vision",
+        "xui_shadowsocks_inbound_id": 2,
+        "xui_shadowsocks_method": "2022-blake3-aes-256-gcm",
+    }
+    raw.update(overrides)
+    return server_registry.build([raw]).servers[0]
+
+
+@pytest.fixture(autouse=True)
+def master_key(monkeypatch):
+    settings = config.get_settings()
+    panel = dataclasses.replace(settings.panel, shadowsocks_master_key=MASTER_KEY)
+    monkeypatch.setattr(config, "_settings", dataclasses.replace(settings, panel=panel))
+    monkeypatch.setattr(link_templates, "_templates", {})
+
+
+def test_vless_link():
+    link = link_templates.render(_server(), "vless", 443, "uuid-1", "Мой ключ")
+    assert link == (
+        "vless://uuid-1@203.0.113.7:443?type=tcp&security=reality&flow=xtls-rprx-vision"
+        "&sni=example.com&pbk=pbk&sid=ab12&fp=chrome&spx=/#%D0%9C%D0%BE%D0%B9%20%D0%BA%D0%BB%D1%8E%D1%87"
+    )
+    assert link_templates.extract_credential("vless", link) == "uuid-1"
+
+
+def test_vless_link_ipv6_address():
+    link = link_templates.render(_server(ip="2001:db8::1"), "vless", 8443, "uuid-1", "tag")
+    assert link.startswith("vless://uuid-1@[2001:db8::1]:8443?")
+    assert link_templates.extract_credential("vless", link) == "uuid-1"
+
+
+def test_ss2022_link_carries_master_key():
+    link = link_templates.render(_server(), "shadowsocks", 8388, "client-key", "tag")
+    userinfo, _, rest = link.removeprefix("ss://").partition("@")
+    assert rest == "203.0.113.7:8388#tag"
+    decoded = base64.b64decode(unquote(userinfo)).decode("utf-8")
+    assert decoded == f"2022-blake3-aes-256-gcm:{MASTER_KEY}:client-key"
+    assert link_templates.extract_credential("shadowsocks", link) == "client-key"
+
+
+def test_legacy_shadowsocks_link_has_no_master_key():
+    server = _server(xui_shadowsocks_method="chacha20-ietf-poly1305")
+    link = link_templates.render(server, "shadowsocks", 8388, "secret", "tag")
+    userinfo = link.removeprefix("ss://").partition("@")[0]
+    assert base64.b64decode(unquote(userinfo)) == b"chacha20-ietf-poly1305:secret"
+    assert link_templates.extract_credential("shadowsocks", link) == "secret"
+
+
+@pytest.mark.parametrize("protocol, link", [
+    ("vless", "ss://dXNlcg==@1.2.3.4:1#t"),
+    ("vless", "vless://1.2.3.4:1#t"),
+    ("vless", "vless://@1.2.3.4:1#t"),
+    ("shadowsocks", "ss://not-base64!@1.2.3.4:1#t"),
+    ("shadowsocks", f"ss://{base64.b64encode(b'no-separator').decode()}@1.2.3.4:1#t"),
+    ("shadowsocks", f"ss://{base64.b64encode(bytes([0xff, 0xfe])).decode()}@1.2.3.4:1#t"),
+    ("outline", "ss://dXNlcjpwYXNz@1.2.3.4:1#t"),
+])
+def test_extract_credential_rejects_foreign_links(protocol, link):
+    assert link_templates.extract_credential(protocol, link) is None
+
+
+def test_template_rebuilt_for_new_server_record():
+    old = _server()
+    assert link_templates.get_template(old, "vless", 443) is link_templates.get_template(old, "vless", 443)
+    new = _server(ip="198.51.100.1")
+    assert "@198.51.100.1:443?" in link_templates.render(new, "vless", 443, "uuid-1", "tag")
+
+
+def test_unknown_protocol():
+    with pytest.raises(ValueError):
+        link_templates.get_template(_server(), "wireguard", 51820)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import datetime
+
+import secrets
+import lifecycle
+import migration
+import quota
+import server_registry
+import vpn_connector
+from benchmarks.fake_panel import FakePanel
+
+GB = 1024 ** 3
+LIMIT_GB = 50
+
+
+class StubBot:
+    def __init__(self):
+        self.sent: list[tuple[int, str]] = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def _add_target_server(database, monkeypatch):
+    # Второй VLESS-сервер со своим инбаундом — цель переноса
+    source = dict(secrets.SERVERS[0])
+    monkeypatch.setattr(secrets, "SERVERS", secrets.SERVERS + [dict(source, id=3, ip="203.0.113.9", xui_vless_inbound_id=3)])
+    monkeypatch.setattr(secrets, "MIGRATION_PAUSE_SEC", 0)
+    # Остановленное другим тестом приложение оставляет бота в draining — перенос бы приостановился
+    monkeypatch.setattr(lifecycle, "_state", lifecycle.READY)
+    server_registry.load()
+    database.sync_servers()
+
+
+def _add_key(database, panel, user_id: int, used_gb: int, quota_disabled: bool) -> str:
+    email = f"tg_{user_id}_old@bot.local"
+    with database.get_db() as db:
+        database.add_user(db, user_id, f"user{user_id}")
+        database.set_traffic_limit(db, user_id, LIMIT_GB, None)
+        database.add_subscription(db_session=db, user_id=user_id, server_id=1, protocol="vless", key_data=f"vless://{user_id}@old#x",
+                                  key_identifier=email, expires_at=datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=30))
+    panel.add_clients(1, [{"id": f"uuid-{user_id}", "email": email, "enable": not quota_disabled, "totalGB": LIMIT_GB * GB}])
+    panel.set_traffic(1, email, used_gb * GB // 2, used_gb * GB // 2)
+    warned_level = len(secrets.QUOTA_WARNING_THRESHOLDS) if quota_disabled else 0
+    database.save_traffic_usage([(user_id, used_gb * GB, warned_level, quota_disabled)])
+    return email
+
+
+def test_migration_keeps_quota_state(database, monkeypatch):
+    _add_target_server(database, monkeypatch)
+    panel = FakePanel(latency=0, inbounds={1: {"port": 443, "protocol": "vless"}, 2: {"port": 8388, "protocol": "shadowsocks"},
+                                           3: {"port": 8443, "protocol": "vless"}})
+    _add_key(database, panel, 1, used_gb=60, quota_disabled=True)
+    _add_key(database, panel, 2, used_gb=10, quota_disabled=False)
+    with database.get_db() as db:
+        migration_id = database.create_migration(db, 1, 3, created_by=None).id
+
+    async def run():
+        await vpn_connector.set_transport(panel.transport())
+        try:
+            result = await migration.run_migration(StubBot(), migration_id)
+            return result, await quota.run_sweep()
+        finally:
+            await vpn_connector.close()
+
+    result, notifications = asyncio.run(run())
+
+    assert result.status == "completed" and result.migrated_count == 2
+    assert panel.inbounds[1]["clients"] == {}
+    enabled = {client["tgId"]: client["enable"] for client in panel.inbounds[3]["clients"].values()}
+    assert enabled == {"1": False, "2": True}
+    # Трафик удалённых клиентов остался в квоте: отключённый пользователь не включился обратно
+    assert [notification.user_id for notification in notifications] == []
+    states = database.get_quota_states([1, 2])
+    assert states[1][2:] == (60 * GB, len(secrets.QUOTA_WARNING_THRESHOLDS), True, 60 * GB)
+    assert states[2][2:] == (10 * GB, 0, False, 10 * GB)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+import secrets
+import quota
+
+LIMIT = 100 * quota._GB
+
+
+@pytest.fixture(autouse=True)
+def thresholds(monkeypatch):
+    monkeypatch.setattr(secrets, "QUOTA_WARNING_THRESHOLDS", [0.8, 0.95])
+
+
+@pytest.mark.parametrize("used, warned_level, disabled, expected", [
+    # Ниже порогов — ничего не меняется
+    (10, 0, False, (0, False, None)),
+    # Каждый новый порог предупреждает один раз
+    (80, 0, False, (1, False, "warning")),
+    (85, 1, False, (1, False, None)),
+    (96, 1, False, (2, False, "warning")),
+    # Перескок сразу через оба порога — одно предупреждение
+    (97, 0, False, (2, False, "warning")),
+    # Исчерпание лимита отключает ключи, повторная проверка уже не уведомляет
+    (100, 2, False, (2, True, "exceeded")),
+    (150, 2, True, (2, True, None)),
+    # Лимит увеличили или трафик сбросили — доступ восстанавливается, уровень падает
+    (50, 2, True, (0, False, "restored")),
+    (90, 2, False, (1, False, None)),
+])
+def test_evaluate_transitions(used, warned_level, disabled, expected):
+    assert quota._evaluate(used * quota._GB, LIMIT, warned_level, disabled) == expected
+
+
+def test_unlimited_user_is_never_disabled():
+    assert quota._evaluate(10**15, 0, 0, False) == (0, False, None)
+    # Лимит сняли у отключённого пользователя
+    assert quota._evaluate(10**15, 0, 2, True) == (0, False, "restored")
+
+
+def test_limit_precedence(monkeypatch):
+    monkeypatch.setattr(secrets, "TRAFFIC_PLANS", {"pro": 200})
+    monkeypatch.setattr(secrets, "DEFAULT_TRAFFIC_LIMIT_GB", 30)
+    assert quota.limit_gb(50, "pro") == 50
+    assert quota.limit_gb(None, "pro") == 200
+    assert quota.limit_gb(None, "unknown") == 30
+    assert quota.limit_gb(0, "pro") == 0
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import datetime
+import time
+
+import pytest
+from telegram.error import RetryAfter
+
+import rate_limiter
+from rate_limiter import PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, PRIORITY_NOTIFICATION
+
+
+def test_bucket_grants_waiters_by_priority_then_fifo():
+    async def run():
+        bucket = rate_limiter.PriorityTokenBucket(rate=100, capacity=1)
+        await bucket.acquire()  # Забираем единственный токен: дальше все ждут
+        order = []
+
+        async def wait(name, priority):
+            await bucket.acquire(priority)
+            order.append(name)
+
+        tasks = []
+        for name, priority in [("bg1", PRIORITY_BACKGROUND), ("note", PRIORITY_NOTIFICATION),
+                               ("bg2", PRIORITY_BACKGROUND), ("user1", PRIORITY_INTERACTIVE),
+                               ("user2", PRIORITY_INTERACTIVE)]:
+            tasks.append(asyncio.create_task(wait(name, priority)))
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order
+
+    assert asyncio.run(run()) == ["user1", "user2", "note", "bg1", "bg2"]
+
+
+def test_bucket_limits_rate():
+    async def run():
+        bucket = rate_limiter.PriorityTokenBucket(rate=50, capacity=1)
+        started = time.monotonic()
+        await asyncio.gather(*(bucket.acquire() for _ in range(6)))
+        return time.monotonic() - started
+
+    # Первый токен сразу, остальные пять — по 20 мс
+    assert asyncio.run(run()) >= 0.09
+
+
+class FlakyCall:
+    """Колбэк Bot API, который первые failures вызовов отвечает RetryAfter."""
+
+    def __init__(self, failures: int, retry_after: float = 0.05):
+        self.failures = failures
+        self.retry_after = retry_after
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise RetryAfter(datetime.timedelta(seconds=self.retry_after))
+        return {"ok": True}
+
+
+async def _request(limiter, call, endpoint="sendMessage", rate_limit_args=None):
+    return await limiter.process_request(call, (), {}, endpoint, {"chat_id": 42}, rate_limit_args)
+
+
+def _limiter(**kwargs) -> rate_limiter.PriorityRateLimiter:
+    return rate_limiter.PriorityRateLimiter(overall_rate=1000, private_chat_rate=1000, **kwargs)
+
+
+def test_retry_after_blocks_and_retries():
+    async def run():
+        limiter = _limiter(max_retries=3)
+        await limiter.initialize()
+        call = FlakyCall(failures=1, retry_after=0.1)
+        started = time.monotonic()
+        result = await _request(limiter, call)
+        return result, call.calls, time.monotonic() - started
+
+    result, calls, elapsed = asyncio.run(run())
+    assert result == {"ok": True}
+    assert calls == 2
+    # Повтор ждал retry_after, выставленный Telegram
+    assert elapsed >= 0.1
+
+
+def test_retry_after_pauses_other_chats():
+    async def run():
+        limiter = _limiter()
+        await limiter.initialize()
+        first = asyncio.create_task(_request(limiter, FlakyCall(failures=1, retry_after=0.1)))
+        await asyncio.sleep(0.01)
+        # Флуд-контроль Telegram действует на всего бота: запрос в другой чат тоже ждёт
+        started = time.monotonic()
+        await limiter.process_request(FlakyCall(failures=0), (), {}, "sendMessage", {"chat_id": 7}, None)
+        await first
+        return time.monotonic() - started
+
+    assert asyncio.run(run()) >= 0.08
+
+
+def test_gives_up_after_max_retries():
+    async def run(rate_limit_args):
+        limiter = _limiter(max_retries=2)
+        await limiter.initialize()
+        call = FlakyCall(failures=10, retry_after=0.01)
+        with pytest.raises(RetryAfter):
+            await _request(limiter, call, rate_limit_args=rate_limit_args)
+        return call.calls
+
+    assert asyncio.run(run(None)) == 3
+    # max_retries из rate_limit_args переопределяет значение по умолчанию
+    assert asyncio.run(run({"max_retries": 0})) == 1
+
+
+def test_unlimited_endpoint_still_honours_retry_after():
+    async def run():
+        limiter = _limiter(max_retries=1)
+        await limiter.initialize()
+        call = FlakyCall(failures=1, retry_after=0.05)
+        started = time.monotonic()
+        await limiter.process_request(call, (), {}, "answerCallbackQuery", {}, None)
+        return call.calls, time.monotonic() - started
+
+    calls, elapsed = asyncio.run(run())
+    assert calls == 2
+    assert elapsed >= 0.05
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+
+import secrets
+import db_manager
+import subscription_links
+
+
+def _fake_rows(monkeypatch, rows_by_user: dict, gate: threading.Event | None = None):
+    def get_active_key_rows(user_id):
+        rows = rows_by_user.get(user_id, [])
+        if gate is not None:
+            # Выборка уже прочитала строки, но ещё не вернулась
+            gate.wait(5)
+        return rows
+    monkeypatch.setattr(db_manager, "get_active_key_rows", get_active_key_rows)
+
+
+def _row(key_data: str):
+    return (1, "vless", key_data, key_data, None)
+
+
+def test_cache_stays_bounded_with_invalidations(monkeypatch):
+    monkeypatch.setattr(secrets, "SUBSCRIPTION_CACHE_SIZE", 50)
+    monkeypatch.setattr(subscription_links, "_entries", type(subscription_links._entries)())
+    _fake_rows(monkeypatch, {})
+
+    async def run():
+        for user_id in range(200):
+            await subscription_links.get_user_keys(user_id)
+        subscription_links.invalidate(range(1000, 5000))
+
+    asyncio.run(run())
+    assert len(subscription_links._entries) == 50
+    # Никакое другое состояние кэша не растёт с числом пользователей (_tokens — не кэш)
+    caches = {name: value for name, value in vars(subscription_links).items()
+              if isinstance(value, dict) and name.startswith("_") and not name.startswith("__") and name != "_tokens"}
+    assert all(len(value) <= 50 for value in caches.values()), {name: len(value) for name, value in caches.items()}
+
+
+def test_build_started_before_invalidation_is_not_cached(monkeypatch):
+    monkeypatch.setattr(subscription_links, "_entries", type(subscription_links._entries)())
+    rows = {7: [_row("vless://old")]}
+    gate = threading.Event()
+    _fake_rows(monkeypatch, rows, gate)
+
+    async def run():
+        build = asyncio.create_task(subscription_links.get_user_keys(7))
+        await asyncio.sleep(0.05)
+        # Ключи пользователя поменялись, пока шла выборка
+        rows[7] = [_row("vless://new")]
+        subscription_links.invalidate([7])
+        gate.set()
+        stale = await build
+        fresh = await subscription_links.get_user_keys(7)
+        return stale, fresh
+
+    stale, fresh = asyncio.run(run())
+    assert [key.key_data for key in stale] == ["vless://old"]
+    assert [key.key_data for key in fresh] == ["vless://new"]
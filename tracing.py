@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Трассировка запросов: что именно делал бот, пока обрабатывал одно обновление.
+
+Обработка обновления (и другие корневые операции) открывает трассу — trace(); запросы к базе,
+к панели 3x-ui, логин и вызовы Bot API внутри неё записываются дочерними спанами — span().
+Текущий спан хранится в contextvars и поэтому переходит в задачи asyncio.create_task
+и в потоки asyncio.to_thread. Трасса дольше SLOW_TRACE_THRESHOLD_SEC целиком пишется в лог.
+Вне трассы span() ничего не записывает.
+"""
+import contextlib
+import contextvars
+import logging
+import time
+
+from sqlalchemy import event
+from telegram import Update
+from telegram.ext import Application
+
+import secrets
+
+logger = logging.getLogger(__name__)
+
+# Больше спанов в одной трассе не записываем: фоновые задачи, запущенные из обработчика,
+# наследуют его трассу
+_MAX_SPANS_PER_TRACE = 500
+_DETAIL_LENGTH = 120
+
+_current: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("tracing_span", default=None)
+
+
+class Trace:
+    __slots__ = ("spans", "dropped", "finished")
+
+    def __init__(self):
+        self.spans = 0
+        self.dropped = 0
+        self.finished = False
+
+
+class Span:
+    __slots__ = ("name", "detail", "started", "duration", "children", "trace")
+
+    def __init__(self, name: str, detail: str, trace: Trace):
+        self.name = name
+        self.detail = detail[:_DETAIL_LENGTH]
+        self.started = time.perf_counter()
+        self.duration: float | None = None
+        self.children: list[Span] = []
+        self.trace = trace
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.started
+
+    def child(self, name: str, detail: str) -> "Span | None":
+        """Новый дочерний спан или None, если трасса закончена или переполнена."""
+        trace = self.trace
+        if trace.finished:
+            return None
+        if trace.spans >= _MAX_SPANS_PER_TRACE:
+            trace.dropped += 1
+            return None
+        trace.spans += 1
+        child = Span(name, detail, trace)
+        # list.append атомарен: дочерние спаны добавляются и из потоков to_thread
+        self.children.append(child)
+        return child
+
+
+def _slow_threshold() -> float:
+    return getattr(secrets, "SLOW_TRACE_THRESHOLD_SEC", 5.0)
+
+
+def enabled() -> bool:
+    return _slow_threshold() > 0
+
+
+def format_trace(root: Span) -> str:
+    lines = []
+
+    def walk(span: Span, depth: int) -> None:
+        duration = f"{span.duration * 1000:8.1f} ms" if span.duration is not None else "     ? ms"
+        offset = (span.started - root.started) * 1000
+        lines.append(f"{'  ' * depth}+{offset:.1f} ms {duration} {span.name} {span.detail}".rstrip())
+        for child in sorted(span.children, key=lambda item: item.started):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    if root.trace.dropped:
+        lines.append(f"... ещё {root.trace.dropped} спанов не записано")
+    return "\n".join(lines)
+
+
+@contextlib.contextmanager
+def trace(name: str, detail: str = ""):
+    """Корневая трасса. Если она заняла больше SLOW_TRACE_THRESHOLD_SEC, дерево спанов пишется в лог."""
+    if not enabled():
+        yield None
+        return
+    root = Span(name, detail, Trace())
+    token = _current.set(root)
+    try:
+        yield root
+    finally:
+        root.finish()
+        root.trace.finished = True
+        _current.reset(token)
+        if root.duration >= _slow_threshold():
+            logger.warning(f"Slow {name} ({root.duration * 1000:.0f} ms):\n{format_trace(root)}")
+
+
+@contextlib.contextmanager
+def span(name: str, detail: str = ""):
+    """Дочерний спан текущей трассы (вне трассы — ничего не делает)."""
+    parent = _current.get()
+    child = parent.child(name, detail) if parent is not None else None
+    if child is None:
+        yield
+        return
+    token = _current.set(child)
+    try:
+        yield
+    finally:
+        child.finish()
+        _current.reset(token)
+
+
+def instrument_engine(engine) -> None:
+    """Спан на каждый SQL-запрос движка, выполненный внутри трассы."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        parent = _current.get()
+        if parent is not None and context is not None:
+            context._tracing_span = parent.child("db", " ".join(statement.split()))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        db_span = getattr(context, "_tracing_span", None)
+        if db_span is not None:
+            db_span.finish()
+
+
+def describe_update(update: object) -> str:
+    if not isinstance(update, Update):
+        return type(update).__name__
+    user = update.effective_user
+    who = f"user {user.id}" if user else "no user"
+    if update.callback_query:
+        return f"{who} callback {update.callback_query.data}"
+    if update.message and update.message.text:
+        return f"{who} message {update.message.text.split(maxsplit=1)[0][:32]}"
+    return who
+
+
+class TracingApplication(Application):
+    """Application, в котором обработка каждого обновления — отдельная трасса."""
+
+    async def process_update(self, update: object) -> None:
+        with trace("update", describe_update(update)):
+            await super().process_update(update)
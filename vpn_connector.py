@@ -1,22 +1,31 @@
 # -*- coding: utf-8 -*-
 import logging
-import paramiko # Для Outline
 import sys
 import os
-import requests
+import httpx
 import json
 import datetime
 import math
 import base64
 import asyncio
-import re
 import random
 import string
-from urllib.parse import quote
 import secrets # Импорт локального secrets.py для конфигураций
 from typing import Tuple, Union
 import uuid
 import time
+from dataclasses import dataclass, field
+import config
+import coordination
+import db_manager
+import server_registry
+import inbound_parser
+import client_index
+import inbound_pool
+import link_templates
+import tracing
+from inbound_parser import ClientRecord
+from server_registry import ServerRecord
 
 
 logger = logging.getLogger(__name__)
@@ -24,14 +33,19 @@ logger = logging.getLogger(__name__)
 # --- Глобальные переменные для хранения сессии 3x-ui API ---
 _xui_session_cookie = None
 _xui_cookie_expiry = 0 # Метка времени истечения куки (или 0, если не задана)
-
-def _find_server_config(server_id: int) -> dict | None:
-    for server in secrets.SERVERS:
-        if server.get("id") == server_id:
-            return server
-    return None
+# Один логин на всех: параллельные запросы ждут его, а не логинятся каждый сам
+_xui_login_lock = asyncio.Lock()
+# Ключ в shared_state, под которым воркеры (режим --workers) делят сессию панели
+_SHARED_SESSION_KEY = "xui-session"
+# Пул соединений к панели, создаётся при первом запросе
+_xui_client: httpx.AsyncClient | None = None
+# Подменяемый транспорт (например, локальная имитация панели в benchmarks/)
+_xui_transport: httpx.AsyncBaseTransport | None = None
+# Метаданные инбаундов (порт, протокол) почти не меняются — не запрашиваем их на каждый ключ
+_xui_inbound_cache: dict[int, dict] = {}
 
 async def execute_ssh_command(server_config: dict, command: str) -> Tuple[int, str, str]:
+    import paramiko # Тяжёлый импорт, нужен только для SSH — загружаем при первом использовании
     client = None
     try:
         client = paramiko.SSHClient()
@@ -84,6 +98,34 @@ async def execute_ssh_command(server_config: dict, command: str) -> Tuple[int, s
             client.close()
 
 
+def _get_xui_client() -> httpx.AsyncClient:
+    global _xui_client
+    if _xui_client is None or _xui_client.is_closed:
+        _xui_client = httpx.AsyncClient(
+            verify=False,
+            timeout=20,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+            transport=_xui_transport
+        )
+    return _xui_client
+
+async def set_transport(transport: httpx.AsyncBaseTransport | None) -> None:
+    """Направляет запросы к панели через указанный транспорт и сбрасывает сессию и кэши."""
+    global _xui_transport, _xui_session_cookie, _xui_cookie_expiry
+    await close()
+    _xui_transport = transport
+    _xui_session_cookie = None
+    _xui_cookie_expiry = 0
+    _xui_inbound_cache.clear()
+    client_index.clear()
+
+async def close() -> None:
+    """Закрывает пул соединений к панели."""
+    global _xui_client
+    if _xui_client is not None:
+        await _xui_client.aclose()
+        _xui_client = None
+
 async def _get_xui_session() -> Union[str, None]:
     global _xui_session_cookie, _xui_cookie_expiry # Moved to the top
 
@@ -91,23 +133,52 @@ async def _get_xui_session() -> Union[str, None]:
         logger.debug("Using existing 3x-ui session cookie.")
         return _xui_session_cookie
 
-    if not secrets.XUI_API_URL or not secrets.XUI_USERNAME or not secrets.XUI_PASSWORD:
-        logger.error("3x-ui API credentials are not fully configured in secrets.py. XUI_API_URL, XUI_USERNAME, or XUI_PASSWORD is missing or default.")
-        return None
+    async with _xui_login_lock:
+        # Пока ждали блокировку, другой запрос мог уже залогиниться
+        if _xui_session_cookie and _xui_cookie_expiry > time.time() + 60:
+            return _xui_session_cookie
+        # Другой воркер мог уже залогиниться
+        if await _load_shared_session():
+            return _xui_session_cookie
+        with tracing.span("panel.login"):
+            session_cookie = await _xui_login()
+        if session_cookie:
+            await coordination.set_shared(_SHARED_SESSION_KEY, _shared_session_value(), _xui_cookie_expiry - time.time() - 60)
+        return session_cookie
+
+def _shared_session_value() -> str:
+    return json.dumps({"cookie": _xui_session_cookie, "expires": _xui_cookie_expiry})
+
+async def _load_shared_session() -> bool:
+    global _xui_session_cookie, _xui_cookie_expiry
+    value = await coordination.get_shared(_SHARED_SESSION_KEY)
+    if not value:
+        return False
+    session = json.loads(value)
+    if session["expires"] <= time.time() + 60:
+        return False
+    _xui_session_cookie, _xui_cookie_expiry = session["cookie"], session["expires"]
+    logger.info("Using 3x-ui session cookie shared by another worker.")
+    return True
 
-    login_url = f"{secrets.XUI_API_URL}/login"
+async def _xui_login() -> Union[str, None]:
+    global _xui_session_cookie, _xui_cookie_expiry
+
+    panel = config.get_settings().panel
+    login_url = f"{panel.api_url}/login"
 
     login_data = {
-        "username": secrets.XUI_USERNAME,
-        "password": secrets.XUI_PASSWORD
+        "username": panel.username,
+        "password": panel.password
     }
 
     headers = {'Content-Type': 'application/json'}
 
-    logger.info(f"Attempting to log in to 3x-ui panel via POST at {login_url} with username: {secrets.XUI_USERNAME} (password hidden)...")
+    logger.info(f"Attempting to log in to 3x-ui panel via POST at {login_url} with username: {panel.username} (password hidden)...")
 
+    client = _get_xui_client()
     try:
-        response = requests.post(login_url, headers=headers, json=login_data, verify=False, timeout=15)
+        response = await client.post(login_url, headers=headers, json=login_data, timeout=15)
         response.raise_for_status()
         response_json = {}
         try:
@@ -125,13 +196,14 @@ async def _get_xui_session() -> Union[str, None]:
                 _xui_cookie_expiry = time.time() + 3600
 
                 try:
-                    for cookie in response.cookies:
+                    for cookie in response.cookies.jar:
                         if cookie.name == cookie_name:
                             _xui_cookie_expiry = cookie.expires or (time.time() + 3600)
                             break
                 except Exception as ex:
-                    logger.warning(f"Could not get cookie expiry time from requests.response.cookies: {ex}")
-
+                    logger.warning(f"Could not get cookie expiry time from response cookies: {ex}")
+                # Куку передаём явно в заголовке, поэтому не даём клиенту дублировать её из своего хранилища
+                client.cookies.clear()
 
                 logger.info(f"Successfully logged in to 3x-ui. Session cookie: {_xui_session_cookie[:20]}..., Expires: {datetime.datetime.fromtimestamp(_xui_cookie_expiry).strftime('%Y-%m-%d %H:%M:%S')}")
                 return _xui_session_cookie
@@ -142,14 +214,14 @@ async def _get_xui_session() -> Union[str, None]:
             logger.error(f"3x-ui login failed. Response success is false. Message: {response_json.get('msg', 'No message')}. Full response: {response.text}")
             return None
 
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         logger.error(f"HTTP error during 3x-ui login to {login_url}: {e.response.status_code} - {e.response.text}")
         if e.response.status_code == 401:
             logger.warning("3x-ui API returned 401 Unauthorized. Clearing session cookie.")
             _xui_session_cookie = None
             _xui_cookie_expiry = 0
         return None
-    except requests.exceptions.RequestException as e:
+    except httpx.RequestError as e:
         logger.error(f"Request error during 3x-ui login to {login_url}: {e}")
         return None
     except Exception as e:
@@ -157,40 +229,93 @@ async def _get_xui_session() -> Union[str, None]:
         return None
 
 async def _xui_api_request(method: str, path: str, json_data: dict | None = None) -> dict | None:
+    with tracing.span("panel", f"{method} {path}"):
+        return await _xui_api_request_untraced(method, path, json_data)
+
+async def _xui_api_request_untraced(method: str, path: str, json_data: dict | None) -> dict | None:
     global _xui_session_cookie, _xui_cookie_expiry # Added global declaration here
 
     session_cookie = await _get_xui_session()
     if not session_cookie:
         logger.error("Failed to get 3x-ui session cookie for API request. Aborting.")
         return None
-    url = f"{secrets.XUI_API_URL}{path}"
+    url = f"{config.get_settings().panel.api_url}{path}"
     headers = {
         'Content-Type': 'application/json',
         'Cookie': session_cookie
     }
 
     try:
-        response = requests.request(method, url, headers=headers, json=json_data, verify=False, timeout=20)
+        response = await _get_xui_client().request(method, url, headers=headers, json=json_data, timeout=20)
         response.raise_for_status()
 
         return response.json()
 
-    except requests.exceptions.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         logger.error(f"HTTP error during 3x-ui API request {method} {path}: {e.response.status_code} - {e.response.text}")
         if e.response.status_code == 401:
             logger.warning("3x-ui API returned 401 Unauthorized. Clearing session cookie.")
+            if _xui_session_cookie == session_cookie:
+                # Остальные воркеры тоже не должны брать эту куку
+                await coordination.delete_shared(_SHARED_SESSION_KEY, _shared_session_value())
             _xui_session_cookie = None
             _xui_cookie_expiry = 0
         return None
-    except requests.exceptions.RequestException as e:
+    except httpx.RequestError as e:
         logger.error(f"Request error during 3x-ui API request {method} {path}: {e}")
         return None
     except Exception as e:
         logger.error(f"An unexpected error occurred during 3x-ui API request {method} {path}: {e}", exc_info=True)
         return None
 
-async def _xui_get_inbound_clients(inbound_id: int) -> list[dict] | None:
+async def _xui_get_inbound(inbound_id: int, refresh: bool = False) -> dict | None:
+    """Возвращает метаданные инбаунда (порт, протокол) из кэша или из панели."""
+    if not refresh and inbound_id in _xui_inbound_cache:
+        return _xui_inbound_cache[inbound_id]
+
+    inbound_data = await _xui_api_request("GET", f"/panel/api/inbounds/get/{inbound_id}")
+    if not (inbound_data and inbound_data.get("success") and inbound_data.get("obj")):
+        logger.error(f"Failed to fetch inbound {inbound_id} metadata. Response: {inbound_data}")
+        return None
+
+    inbound_obj = inbound_data.get("obj")
+    inbound_meta = {
+        "port": inbound_obj.get("port"),
+        "protocol": inbound_obj.get("protocol"),
+        "host": inbound_obj.get("host"),
+        "remark": inbound_obj.get("remark"),
+    }
+    _xui_inbound_cache[inbound_id] = inbound_meta
+    _sync_client_index(inbound_id, inbound_obj)
+    return inbound_meta
+
+def _sync_client_index(inbound_id: int, inbound_obj: dict) -> None:
+    # Клиенты приходят в том же ответе, что и метаданные, — отдельный запрос не нужен
+    try:
+        client_index.sync_inbound(
+            inbound_id,
+            inbound_parser.iter_clients(inbound_obj.get("settings")),
+            credential_field=client_index.credential_field(inbound_obj.get("protocol")),
+        )
+    except ValueError as e:
+        logger.error(f"Failed to parse clients of inbound {inbound_id} for the client index: {e}")
+
+def _configured_inbound_ids() -> set[int]:
+    return inbound_pool.all_inbound_ids(server_registry.all_servers())
+
+async def warm_up() -> bool:
+    """Логинится в панель и загружает метаданные и клиентов всех инбаундов до первого запроса пользователя."""
+    await asyncio.to_thread(inbound_pool.load)
+    if not await _get_xui_session():
+        logger.warning("3x-ui panel warm-up failed: could not log in. The first key request will retry.")
+        return False
+    results = await asyncio.gather(*(_xui_get_inbound(inbound_id, refresh=True) for inbound_id in _configured_inbound_ids()))
+    logger.info(f"3x-ui panel warmed up: {sum(1 for r in results if r)}/{len(results)} inbounds cached.")
+    return all(results)
+
 
+async def _xui_get_inbound_clients(inbound_id: int) -> list[ClientRecord] | None:
+    """Список клиентов инбаунда в виде компактных записей (без полного json.loads settings)."""
     get_inbound_path = f"/panel/api/inbounds/get/{inbound_id}"
     max_retries = 5
     retry_delay_sec = 2
@@ -201,10 +326,10 @@ async def _xui_get_inbound_clients(inbound_id: int) -> list[dict] | None:
         if inbound_data and inbound_data.get("success") and inbound_data.get("obj"):
             inbound_obj = inbound_data.get("obj")
             try:
-                settings = json.loads(inbound_obj.get("settings", "{}"))
-                clients = settings.get("clients", [])
+                clients = list(inbound_parser.iter_clients(inbound_obj.get("settings")))
+                client_index.sync_inbound(inbound_id, clients, credential_field=client_index.credential_field(inbound_obj.get("protocol")))
                 return clients
-            except json.JSONDecodeError:
+            except ValueError:
                 logger.error(f"Failed to parse JSON settings for inbound {inbound_id} (Attempt {attempt + 1}/{max_retries}).")
                 return []
             except Exception as e:
@@ -224,225 +349,379 @@ async def _xui_get_inbound_clients(inbound_id: int) -> list[dict] | None:
     return []
 
 
-async def _xui_add_vless_client(server_config: dict, user_telegram_id: int, user_username: str | None, total_traffic_gb: Union[int, None] = None) -> Tuple[Union[str, None], Union[str, None]]:
-    inbound_id = server_config.get("xui_vless_inbound_id")
-    if inbound_id is None:
-        logger.error(f"3x-ui VLESS inbound ID not configured for server {server_config.get('id', 'Unknown')}.")
-        return None, None
-
-    base_email_name = f"tg_{user_telegram_id}"
-    if user_username:
-        cleaned_username = ''.join(c if c.isalnum() else '_' for c in user_username).lower()
-        base_email_name += f"_{cleaned_username}"
-
-    random_suffix_bytes = os.urandom(10)
-    random_suffix = base64.urlsafe_b64encode(random_suffix_bytes).decode('utf-8').rstrip('=')
+def _max_clients_per_user() -> int:
+    return config.get_settings().max_keys_per_user
 
-    user_email = f"{base_email_name}_{random_suffix}@bot.local"
-
-    client_uuid = str(uuid.uuid4())
-
-    total_traffic_bytes = (total_traffic_gb * 1024 * 1024 * 1024) if total_traffic_gb is not None and total_traffic_gb > 0 else 0
+def generate_unique_email(inbound_ids: tuple[int, ...], make_email) -> str | None:
+    # Email проверяется по индексу клиентов: совпадение случайной части маловероятно, но дёшево исключается.
+    # 3x-ui требует уникальности email во всей панели, поэтому смотрим все инбаунды протокола сервера
+    for _ in range(5):
+        email = make_email()
+        if not any(client_index.contains(inbound_id, email) for inbound_id in inbound_ids):
+            return email
+        logger.warning(f"Generated client email {email} already exists in inbounds {inbound_ids}, regenerating.")
+    return None
 
-    new_client_data = {
-        "id": client_uuid,
-        "email": user_email,
-        "enable": True,
-        "totalGB": total_traffic_bytes,
+def build_client_link(server: ServerRecord, protocol: str, inbound_port: int, credential: str, email: str) -> str:
+    """Собирает ссылку клиента 3x-ui по UUID (VLESS) или паролю (Shadowsocks)."""
+    return link_templates.render(server, protocol, inbound_port, credential, email)
+
+@dataclass(slots=True)
+class ClientDraft:
+    """Клиент, подготовленный к добавлению: с ним addClient можно безопасно повторять."""
+    server: ServerRecord
+    user_telegram_id: int
+    protocol: str
+    inbound_id: int
+    email: str
+    credential: str
+    payload: dict
+
+def _total_traffic_bytes(total_traffic_gb: Union[int, None]) -> int:
+    return (total_traffic_gb * 1024 * 1024 * 1024) if total_traffic_gb is not None and total_traffic_gb > 0 else 0
+
+def refuse_if_over_limit(inbound_ids: tuple[int, ...], user_telegram_id: int) -> bool:
+    client_count = sum(client_index.count_for(inbound_id, user_telegram_id) for inbound_id in inbound_ids)
+    if client_count >= _max_clients_per_user():
+        logger.warning(f"User {user_telegram_id} already has {client_count} clients in inbounds {inbound_ids}. Refusing to add another one.")
+        return True
+    return False
+
+def new_credential(server: ServerRecord, protocol: str) -> str:
+    """UUID клиента VLESS или пароль клиента Shadowsocks."""
+    if protocol == "vless":
+        return str(uuid.uuid4())
+    # Ключ клиента Shadowsocks 2022 той же длины, что и ключ метода; для прочих методов это просто пароль
+    raw_salt = os.urandom(16 if server.shadowsocks.method == "2022-blake3-aes-128-gcm" else 32)
+    return base64.b64encode(raw_salt).decode('utf-8')
+
+def make_draft(server: ServerRecord, protocol: str, user_telegram_id: int, email: str, credential: str, total_traffic_gb: Union[int, None],
+               inbound_id: int | None = None, enable: bool = True) -> ClientDraft:
+    """Клиент для addClient с заданными email и UUID/паролем (по умолчанию — в основной инбаунд протокола)."""
+    payload = {
+        "email": email,
+        "enable": enable,
+        "totalGB": _total_traffic_bytes(total_traffic_gb),
         "expiryTime": 0,
         "limitIp": 0,
-        "flow": server_config.get("xui_vless_flow", ""),
         "tgId": str(user_telegram_id),
         "subId": "",
         "comment": "",
         "reset": 0
     }
+    if protocol == "vless":
+        payload.update({"id": credential, "flow": server.vless.flow})
+    else:
+        method = server.shadowsocks.method
+        payload.update({"method": "" if link_templates.is_ss2022(method) else method, "password": credential, "id": str(uuid.uuid4())})
+    return ClientDraft(server=server, user_telegram_id=user_telegram_id, protocol=protocol, inbound_id=inbound_id or server.inbound_id(protocol), email=email,
+                       credential=credential, payload=payload)
 
-    add_client_payload = {
-        "id": inbound_id,
-        "settings": json.dumps({"clients": [new_client_data]})
-    }
-
-    add_client_path = "/panel/inbound/addClient"
-
-    logger.info(f"Attempting to add VLESS client via 3x-ui API ({add_client_path}) for inbound {inbound_id}, email: {user_email}")
-    logger.debug(f"Payload for addClient: {add_client_payload}")
-
-    add_response_data = await _xui_api_request("POST", add_client_path, json_data=add_client_payload)
-
-    if add_response_data and add_response_data.get("success"):
-        logger.info(f"VLESS client added successfully via 3x-ui API. Email: {user_email}, UUID: {client_uuid}")
-
-        inbound_data_fresh = await _xui_api_request("GET", f"/panel/api/inbounds/get/{inbound_id}")
-
-        if not (inbound_data_fresh and inbound_data_fresh.get("success") and inbound_data_fresh.get("obj")):
-            logger.error(f"Failed to fetch inbound config {inbound_id} after adding client for link construction. Response: {inbound_data_fresh}")
-            return None, user_email
-
-        inbound_obj = inbound_data_fresh.get("obj")
-
-        server_address = server_config.get('ip')
-        if not server_address:
-            logger.error(f"Server IP not found in secrets.SERVERS config for ID {server_config.get('id', 'Unknown')}!")
-            server_address = inbound_obj.get("host")
-            if not server_address:
-                logger.error(f"Could not find server address from inbound object or secrets.SERVERS for ID {server_config.get('id', 'Unknown')}.")
-                return None, user_email
-
-        inbound_port = inbound_obj.get("port")
-        if not inbound_port:
-            logger.error(f"Could not find inbound port for ID {inbound_id} in API response.")
-            return None, user_email
-
-        public_key = server_config.get("xui_vless_public_key")
-        sni = server_config.get("xui_vless_sni")
-        short_id = server_config.get("xui_vless_short_id")
-        vless_flow = server_config.get("xui_vless_flow")
-        fingerprint = server_config.get("xui_vless_fingerprint") # Получаем fingerprint из secrets.py
-
-        if not all([public_key, sni, short_id, fingerprint]): # Добавляем fingerprint в проверку
-            logger.error(f"Missing Reality parameters (public_key, sni, short_id, or fingerprint) in secrets.py for server {server_config.get('id', 'Unknown')}. Cannot construct Reality link.")
-            return None, user_email
-
-        params = {
-            "type": "tcp", # Добавлено: Явно указываем тип транспорта
-            "security": "reality",
-            "flow": vless_flow, # Перемещено сюда для консистентности
-            "sni": sni,
-            "pbk": public_key,
-            "sid": short_id,
-            "fp": fingerprint, # Добавлено: Fingerprint
-            "spx": "/", # Добавлено: Service Path (url-encoded %2F)
-        }
-
-        # Фильтруем пустые параметры и формируем строку запроса
-        query_string_params = "&".join([f"{k}={quote(str(v))}" for k, v in params.items() if v is not None and v != ""])
-
-        tag = user_email # Используем user_email как тег
-
-        vless_link = f"vless://{client_uuid}@{server_address}:{inbound_port}"
-        if query_string_params:
-            vless_link += f"?{query_string_params}"
-        vless_link += f"#{quote(tag)}" # Используем quote для тега
+_ADD_CLIENT_ATTEMPTS = 4
+_ADD_CLIENT_RETRY_DELAY_SEC = 0.5
 
-        logger.info(f"Constructed VLESS Reality link for client {user_email}: {vless_link[:100]}...")
-        return vless_link, user_email
+async def _xui_add_client(draft: ClientDraft) -> bool | None:
+    """addClient с повторами. True — клиент в панели, False — панель отказала, None — исход неизвестен.
 
-    else:
-        logger.error(f"Failed to add VLESS client via new 3x-ui API. Response: {add_response_data}. Full response: {json.dumps(add_response_data) if add_response_data else 'None'}")
-        return None, user_email
-
-
-async def _xui_add_shadowsocks_client(server_config: dict, user_telegram_id: int, user_username: str | None, total_traffic_gb: Union[int, None] = None) -> Tuple[Union[str, None], Union[str, None]]:
-    inbound_id = server_config.get("xui_shadowsocks_inbound_id")
-    if inbound_id is None or not hasattr(secrets, 'XUI_SHADOWSOCKS_MASTER_KEY') or not secrets.XUI_SHADOWSOCKS_MASTER_KEY:
-        logger.error("Shadowsocks inbound_id or XUI_SHADOWSOCKS_MASTER_KEY is not configured in secrets.py.")
-        return None, None
-    cleaned_username = ""
-    if user_username:
-        cleaned_username = re.sub(r'[^a-zA-Z0-9_]', '', user_username)
-    random_suffix = base64.urlsafe_b64encode(os.urandom(4)).decode('utf-8').rstrip('=')
-    user_tag = f"ss_{cleaned_username}_{user_telegram_id}_{random_suffix}"
-    raw_salt = os.urandom(32)
-    user_salt_b64 = base64.b64encode(raw_salt).decode('utf-8')
-    total_traffic_bytes = (total_traffic_gb * 1024 * 1024 * 1024) if total_traffic_gb else 0
-    new_client_data = {
-        "email": user_tag,
-        "method": "",
-        "password": user_salt_b64,
-        "id": str(uuid.uuid4()),
-        "enable": True,
-        "limitIp": 0,
-        "totalGB": total_traffic_bytes,
-        "expiryTime": 0,
-        "tgId": str(user_telegram_id),
-        "subId": "",
-        "comment": "",
-        "reset": 0
-    }
+    Повтор с тем же email безопасен: ответ "Duplicate email" значит, что предыдущая попытка дошла до панели.
+    """
+    add_client_path = "/panel/inbound/addClient"
     add_client_payload = {
-        "id": inbound_id,
-        "settings": json.dumps({"clients": [new_client_data]})
+        "id": draft.inbound_id,
+        "settings": json.dumps({"clients": [draft.payload]})
     }
-    logger.info(f"Attempting to add SS client {user_tag} by providing a unique salt.")
-    add_response_data = await _xui_api_request("POST", "/panel/inbound/addClient", json_data=add_client_payload)
-    if add_response_data and add_response_data.get("success"):
-        logger.info("Client added successfully via API.")
-        inbound_data = await _xui_api_request("GET", f"/panel/api/inbounds/get/{inbound_id}")
-        port = inbound_data.get("obj", {}).get("port")
-        address = server_config.get("ip")
-        ss_method_name = "2022-blake3-aes-256-gcm"
-        master_key = secrets.XUI_SHADOWSOCKS_MASTER_KEY
-        credential_string = f"{ss_method_name}:{master_key}:{user_salt_b64}"
-        encoded_credentials = base64.b64encode(credential_string.encode('utf-8')).decode('utf-8')
-        final_encoded_credentials = quote(encoded_credentials)
-        final_encoded_tag = quote(user_tag)
-        ss_link = f"ss://{final_encoded_credentials}@{address}:{port}#{final_encoded_tag}"
-        logger.info(f"Correct Shadowsocks key created: {ss_link[:80]}...")
-        return ss_link, user_tag
-    else:
-        error_msg = add_response_data if add_response_data else "No response from panel."
-        logger.error(f"Failed to add SS client: {error_msg}")
-        return None, user_tag
-
-
-async def _xui_delete_vless_client(server_config: dict, client_email: str) -> bool:
-    inbound_id = server_config.get("xui_vless_inbound_id")
-    if inbound_id is None:
-        logger.error(f"3x-ui VLESS inbound ID not configured for server {server_config.get('id', 'Unknown')}. Cannot delete VLESS key via API.")
-        return False
+    logger.info(f"Attempting to add {draft.protocol} client via 3x-ui API ({add_client_path}) for inbound {draft.inbound_id}, email: {draft.email}")
+    logger.debug(f"Payload for addClient: {add_client_payload}")
 
-    if not client_email:
-        logger.error("Cannot delete VLESS client via 3x-ui API: client_email is missing.")
-        return False
+    for attempt in range(_ADD_CLIENT_ATTEMPTS):
+        add_response_data = await _xui_api_request("POST", add_client_path, json_data=add_client_payload)
+        if add_response_data and add_response_data.get("success"):
+            logger.info(f"{draft.protocol} client added successfully via 3x-ui API. Email: {draft.email}")
+            return True
+        error_msg = (add_response_data or {}).get("msg") or ""
+        if "duplicate email" in error_msg.lower():
+            logger.info(f"Client {draft.email} is already in inbound {draft.inbound_id}: an earlier attempt reached the panel.")
+            return True
+        if add_response_data is not None and "database is locked" not in error_msg.lower():
+            logger.error(f"Failed to add {draft.protocol} client via new 3x-ui API. Response: {add_response_data}. Full response: {json.dumps(add_response_data)}")
+            return False
+        if attempt < _ADD_CLIENT_ATTEMPTS - 1:
+            logger.warning(f"addClient for {draft.email} failed (attempt {attempt + 1}/{_ADD_CLIENT_ATTEMPTS}), retrying. Response: {add_response_data}")
+            await asyncio.sleep(_ADD_CLIENT_RETRY_DELAY_SEC * (attempt + 1))
+    logger.error(f"addClient for {draft.email} did not get a definite answer after {_ADD_CLIENT_ATTEMPTS} attempts.")
+    return None
 
-    api_path = f"/panel/api/inbounds/{inbound_id}/delClient/{client_email}"
+async def add_clients(drafts: list[ClientDraft], concurrency: int = 5) -> dict[str, bool | None]:
+    """Добавляет клиентов одного инбаунда одним addClient. Если панель отказала всей пачке
+    (например, часть клиентов уже добавлена прошлой попыткой), добавляет их по одному.
+    Возвращает email -> результат как у _xui_add_client.
+    """
+    if not drafts:
+        return {}
+    response_data = await _xui_api_request("POST", "/panel/inbound/addClient", json_data={
+        "id": drafts[0].inbound_id,
+        "settings": json.dumps({"clients": [draft.payload for draft in drafts]})
+    })
+    if response_data and response_data.get("success"):
+        logger.info(f"Added {len(drafts)} clients to inbound {drafts[0].inbound_id} in one request.")
+        return {draft.email: True for draft in drafts}
+    logger.warning(f"Bulk addClient for {len(drafts)} clients in inbound {drafts[0].inbound_id} failed ({response_data}), adding one by one.")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def add_one(draft: ClientDraft) -> bool | None:
+        async with semaphore:
+            return await _xui_add_client(draft)
+
+    results = await asyncio.gather(*(add_one(draft) for draft in drafts))
+    return {draft.email: result for draft, result in zip(drafts, results)}
+
+async def issue_client(draft: ClientDraft, user_telegram_id: int) -> Tuple[Union[str, None], Union[str, None]]:
+    """Добавляет подготовленного клиента с записью в журнал выдачи до запроса в панель."""
+    # Резервируем email до запроса: параллельный запрос того же пользователя увидит его в индексе
+    client_index.register(draft.inbound_id, draft.email, user_telegram_id, credential=draft.credential)
+    journal_id = await asyncio.to_thread(
+        db_manager.journal_begin, user_telegram_id, draft.server.id, draft.protocol, draft.inbound_id, draft.email, draft.credential
+    )
+
+    added = await _xui_add_client(draft)
+    if added is False:
+        client_index.forget(draft.inbound_id, draft.email)
+        await asyncio.to_thread(db_manager.journal_update, journal_id, status='rolled_back')
+        return None, draft.email
+    if added is None:
+        # Клиент мог появиться в панели: запись остаётся pending и разбирается при следующем запуске
+        return None, draft.email
+
+    inbound_meta = await _xui_get_inbound(draft.inbound_id)
+    if not inbound_meta or not inbound_meta.get("port"):
+        logger.error(f"Failed to fetch inbound config {draft.inbound_id} after adding client {draft.email} for link construction.")
+        return None, draft.email
+
+    key_link = build_client_link(draft.server, draft.protocol, inbound_meta["port"], draft.credential, draft.email)
+    logger.info(f"Constructed {draft.protocol} link for client {draft.email}: {key_link[:100]}...")
+    return key_link, draft.email
+
+async def issue_clients(drafts: list[ClientDraft], concurrency: int = 5) -> list[Tuple[Union[str, None], Union[str, None]]]:
+    """issue_client для клиентов одного инбаунда: журнал — одной транзакцией, панель — одним addClient.
+    Результаты в порядке drafts.
+    """
+    if not drafts:
+        return []
+    for draft in drafts:
+        client_index.register(draft.inbound_id, draft.email, draft.user_telegram_id, credential=draft.credential)
+    journal_ids = await asyncio.to_thread(db_manager.journal_begin_many, [{
+        "user_id": draft.user_telegram_id, "server_id": draft.server.id, "protocol": draft.protocol,
+        "inbound_id": draft.inbound_id, "email": draft.email, "credential": draft.credential
+    } for draft in drafts])
+
+    results = await add_clients(drafts, concurrency=concurrency)
+    inbound_meta = await _xui_get_inbound(drafts[0].inbound_id)
+    issued, rolled_back = [], []
+    for draft in drafts:
+        added = results.get(draft.email)
+        if added is False:
+            client_index.forget(draft.inbound_id, draft.email)
+            rolled_back.append(journal_ids[draft.email])
+        if not added or not inbound_meta or not inbound_meta.get("port"):
+            # Неизвестный исход оставляет запись pending — она разбирается при следующем запуске
+            issued.append((None, draft.email))
+            continue
+        issued.append((build_client_link(draft.server, draft.protocol, inbound_meta["port"], draft.credential, draft.email), draft.email))
+
+    def roll_back() -> None:
+        for journal_id in rolled_back:
+            db_manager.journal_update(journal_id, status='rolled_back')
+    if rolled_back:
+        await asyncio.to_thread(roll_back)
+    return issued
+
+async def rebuild_client_link(server: ServerRecord, protocol: str, credential: str, email: str, inbound_id: int | None = None) -> str | None:
+    """Ссылка для уже существующего клиента (порт берётся из кэша метаданных инбаунда)."""
+    inbound_meta = await _xui_get_inbound(inbound_id or server.inbound_id(protocol))
+    if not inbound_meta or not inbound_meta.get("port"):
+        return None
+    return build_client_link(server, protocol, inbound_meta["port"], credential, email)
+
+async def reuse_orphan(server: ServerRecord, protocol: str, user_telegram_id: int) -> Tuple[Union[str, None], Union[str, None]] | None:
+    """Клиент этого пользователя уже есть в панели, но не записан в базе — выдаём его же."""
+    for inbound_id in inbound_pool.inbound_ids(server, protocol):
+        orphan = client_index.claim_orphan(inbound_id, user_telegram_id)
+        if orphan:
+            break
+    else:
+        return None
+    key_link = await rebuild_client_link(server, protocol, orphan.credential, orphan.email, inbound_id)
+    if not key_link:
+        orphan.in_db = False
+        return None
+    # Как и при обычной выдаче, инбаунд клиента add_subscription возьмёт из записи журнала
+    await asyncio.to_thread(db_manager.journal_reuse, user_telegram_id, server.id, protocol, inbound_id, orphan.email, orphan.credential)
+    logger.info(f"Reusing existing {protocol} client {orphan.email} of user {user_telegram_id} in inbound {inbound_id}.")
+    return key_link, orphan.email
+
+@dataclass(slots=True)
+class RelinkResult:
+    checked: int = 0
+    updated: int = 0
+    unparsed: int = 0 # Ссылки, из которых не удалось достать UUID или пароль
+    failed_inbounds: list[int] = field(default_factory=list)
+
+def _relink_rows(server: ServerRecord, protocol: str, ports: dict[int, int], chunk_size: int, result: RelinkResult) -> None:
+    """ports — inbound_id -> порт доступных инбаундов протокола; ключи недоступных инбаундов не трогаем."""
+    primary_inbound_id = server.inbound_id(protocol)
+    for rows in db_manager.iter_active_key_chunks(server.id, protocol, chunk_size):
+        updates = []
+        for row in rows:
+            inbound_id = row.inbound_id or inbound_pool.locate(server, protocol, row.key_identifier) or primary_inbound_id
+            if inbound_id not in ports:
+                continue
+            result.checked += 1
+            credential = link_templates.extract_credential(protocol, row.key_data)
+            if not credential or not row.key_identifier:
+                result.unparsed += 1
+                continue
+            key_data = link_templates.get_template(server, protocol, ports[inbound_id]).render(credential, row.key_identifier)
+            if key_data != row.key_data:
+                updates.append((row.id, row.user_id, key_data))
+        db_manager.update_key_links(updates)
+        result.updated += len(updates)
+
+async def regenerate_key_links(server_id: int | None = None, chunk_size: int = 2000) -> RelinkResult:
+    """Пересобирает сохранённые ссылки ключей 3x-ui по текущей конфигурации серверов (новый IP, SNI, ключи Reality, транспорт)."""
+    servers = [server_registry.get(server_id)] if server_id is not None else list(server_registry.all_servers())
+    result = RelinkResult()
+    started = time.perf_counter()
+    for server in filter(None, servers):
+        for protocol in ("vless", "shadowsocks"):
+            ports = {}
+            for inbound_id in inbound_pool.inbound_ids(server, protocol):
+                # Порт берём из панели заново: его тоже могли поменять
+                inbound_meta = await _xui_get_inbound(inbound_id, refresh=True)
+                if not inbound_meta or not inbound_meta.get("port"):
+                    logger.error(f"Cannot regenerate {protocol} links of server {server.id}: inbound {inbound_id} is unavailable.")
+                    result.failed_inbounds.append(inbound_id)
+                    continue
+                ports[inbound_id] = inbound_meta["port"]
+            if ports:
+                await asyncio.to_thread(_relink_rows, server, protocol, ports, chunk_size, result)
+    logger.info(f"Key links regenerated in {time.perf_counter() - started:.2f}s: {result}")
+    return result
+
+async def client_exists(inbound_id: int, email: str) -> bool | None:
+    """Есть ли клиент в панели. None — панель недоступна."""
+    if client_index.is_synced(inbound_id):
+        return client_index.in_panel(inbound_id, email)
+    if not await _xui_get_inbound(inbound_id, refresh=True):
+        return None
+    return client_index.in_panel(inbound_id, email)
 
-    logger.info(f"Deleting VLESS client {client_email} from inbound {inbound_id} via 3x-ui API.")
+async def find_client_inbound(server: ServerRecord, protocol: str, email: str) -> int | None:
+    """Инбаунд протокола сервера, в котором лежит клиент, или None, если его нет ни в одном доступном."""
+    for inbound_id in inbound_pool.inbound_ids(server, protocol):
+        if await client_exists(inbound_id, email):
+            return inbound_id
+    return None
 
-    response_data = await _xui_api_request("POST", api_path)
+_INBOUND_COPY_FIELDS = ("listen", "protocol", "streamSettings", "sniffing", "allocate")
+# Создание инбаунда: один на (сервер, протокол), параллельные запросы ждут его и берут созданный
+_inbound_create_locks: dict[tuple[int, str], asyncio.Lock] = {}
 
-    if response_data and response_data.get("success"):
-        logger.info(f"VLESS client {client_email} deleted successfully via 3x-ui API.")
-        return True
-    else:
-        logger.error(f"Failed to delete VLESS client {client_email} from inbound {inbound_id} via 3x-ui API. Response: {response_data}")
-        error_msg = response_data.get("msg", "").lower() if response_data else ""
-        if "not found" in error_msg or "no such" in error_msg or "failed to get client" in error_msg:
-            logger.warning(f"3x-ui API reported client {client_email} not found during deletion. Considering deletion successful.")
-            return True
+async def _xui_clone_inbound(template_inbound_id: int, port: int) -> int | None:
+    """Создаёт инбаунд с настройками шаблона (Reality/TLS, транспорт, метод) на другом порту и без клиентов."""
+    template_data = await _xui_api_request("GET", f"/panel/api/inbounds/get/{template_inbound_id}")
+    if not (template_data and template_data.get("success") and template_data.get("obj")):
+        logger.error(f"Cannot clone inbound {template_inbound_id}: failed to fetch it. Response: {str(template_data)[:300]}")
+        return None
+    template = template_data["obj"]
+    # Клиентов шаблона не разбираем: в основном инбаунде их могут быть десятки тысяч
+    settings = inbound_parser.settings_without_clients(template.get("settings"))
+    settings["clients"] = []
+    payload = {field: template.get(field) for field in _INBOUND_COPY_FIELDS if template.get(field) is not None}
+    payload.update({
+        "up": 0, "down": 0, "total": 0, "expiryTime": 0, "enable": True, "port": port,
+        "remark": f"{template.get('remark') or 'inbound'}-{port}",
+        "settings": json.dumps(settings),
+    })
+    response_data = await _xui_api_request("POST", "/panel/api/inbounds/add", json_data=payload)
+    if response_data and response_data.get("success") and (response_data.get("obj") or {}).get("id"):
+        return response_data["obj"]["id"]
+    logger.error(f"Failed to clone inbound {template_inbound_id} to port {port}. Response: {str(response_data)[:300]}")
+    return None
 
-        return False
+async def _create_pool_inbound(server: ServerRecord, protocol: str) -> int | None:
+    for port in inbound_pool.free_spare_ports(server, protocol):
+        inbound_id = await _xui_clone_inbound(server.inbound_id(protocol), port)
+        if inbound_id is None:
+            # Порт мог оказаться занят — пробуем следующий
+            inbound_pool.reject_port(server, port)
+            continue
+        await asyncio.to_thread(inbound_pool.add_created, server, protocol, inbound_id, port)
+        # Пустой индекс клиентов и кэш порта нового инбаунда
+        await _xui_get_inbound(inbound_id, refresh=True)
+        return inbound_id
+    return None
 
-async def _xui_delete_shadowsocks_client(server_config: dict, client_email: str) -> bool:
-    inbound_id = server_config.get("xui_shadowsocks_inbound_id")
+async def _sync_pool_index(server: ServerRecord, protocol: str) -> None:
+    for inbound_id in inbound_pool.inbound_ids(server, protocol):
+        if not client_index.is_synced(inbound_id):
+            # Число клиентов считаем по индексу — он должен быть загружен из панели
+            await _xui_get_inbound(inbound_id, refresh=True)
+
+async def choose_inbound(server: ServerRecord, protocol: str) -> int | None:
+    """Инбаунд для нового клиента: первый, где клиентов меньше порога; если заполнены все — новый
+    инбаунд на свободном порту; если и портов нет — наименее заполненный.
+    """
+    inbound_ids = inbound_pool.inbound_ids(server, protocol)
+    if not inbound_pool.max_clients(server) or not inbound_ids:
+        return inbound_ids[0] if inbound_ids else None
+    await _sync_pool_index(server, protocol)
+    inbound_id = inbound_pool.pick(server, protocol)
+    if inbound_id is not None:
+        return inbound_id
+    async with _inbound_create_locks.setdefault((server.id, protocol), asyncio.Lock()):
+        inbound_id = inbound_pool.pick(server, protocol)
+        if inbound_id is None:
+            # Между воркерами (--workers) инбаунд создаёт один — тот, кто взял аренду
+            async with coordination.lock(f"inbound-create-{server.id}-{protocol}") as locked:
+                if locked and coordination.enabled():
+                    # Пока ждали, инбаунд мог создать другой воркер
+                    await asyncio.to_thread(inbound_pool.load)
+                    await _sync_pool_index(server, protocol)
+                    inbound_id = inbound_pool.pick(server, protocol)
+                if locked and inbound_id is None:
+                    inbound_id = await _create_pool_inbound(server, protocol)
     if inbound_id is None:
-        logger.error(f"3x-ui Shadowsocks inbound ID not configured for server {server_config.get('id', 'Unknown')}. Cannot delete Shadowsocks key via API.")
-        return False
+        inbound_id = inbound_pool.least_loaded(server, protocol)
+        logger.warning(f"All {protocol} inbounds of server {server.id} are full and no spare ports are left; using inbound {inbound_id}.")
+    return inbound_id
 
+
+async def delete_client(inbound_id: int, client_email: str) -> bool:
+    """Удаляет клиента из инбаунда. Клиент, которого в панели уже нет, считается удалённым."""
     if not client_email:
-        logger.error("Cannot delete Shadowsocks client via 3x-ui API: client_email is missing.")
+        logger.error(f"Cannot delete client from inbound {inbound_id} via 3x-ui API: client_email is missing.")
         return False
 
-    api_path = f"/panel/api/inbounds/{inbound_id}/delClient/{client_email}"
-
-    logger.info(f"Deleting Shadowsocks client {client_email} from inbound {inbound_id} via 3x-ui API.")
-
-    response_data = await _xui_api_request("POST", api_path)
+    logger.info(f"Deleting client {client_email} from inbound {inbound_id} via 3x-ui API.")
+    response_data = await _xui_api_request("POST", f"/panel/api/inbounds/{inbound_id}/delClient/{client_email}")
 
     if response_data and response_data.get("success"):
-        logger.info(f"Shadowsocks client {client_email} deleted successfully via 3x-ui API.")
+        logger.info(f"Client {client_email} deleted successfully from inbound {inbound_id} via 3x-ui API.")
+        client_index.forget(inbound_id, client_email)
         return True
-    else:
-        logger.error(f"Failed to delete Shadowsocks client {client_email} from inbound {inbound_id} via 3x-ui API. Response: {response_data}")
-        error_msg = response_data.get("msg", "").lower() if response_data else ""
-        if "not found" in error_msg or "no such" in error_msg or "failed to get client" in error_msg:
-            logger.warning(f"3x-ui API reported client {client_email} not found during deletion. Considering deletion successful.")
-            return True
+    logger.error(f"Failed to delete client {client_email} from inbound {inbound_id} via 3x-ui API. Response: {response_data}")
+    error_msg = response_data.get("msg", "").lower() if response_data else ""
+    if "not found" in error_msg or "no such" in error_msg or "failed to get client" in error_msg:
+        logger.warning(f"3x-ui API reported client {client_email} not found during deletion. Considering deletion successful.")
+        client_index.forget(inbound_id, client_email)
+        return True
+    return False
 
-        return False
+async def inbound_reachable(inbound_id: int) -> bool:
+    """Панель отвечает и инбаунд в ней есть (запрос в обход кэша метаданных)."""
+    return await _xui_get_inbound(inbound_id, refresh=True) is not None
 
-async def _xui_get_client_traffic(server_config: dict, client_email: str) -> Union[dict, None]:
+async def get_client_traffic(client_email: str) -> Union[dict, None]:
 
     if not client_email:
         logger.error("Cannot get client traffic via 3x-ui API: client_email is missing.")
@@ -455,166 +734,56 @@ async def _xui_get_client_traffic(server_config: dict, client_email: str) -> Uni
     response_data = await _xui_api_request("GET", api_path)
 
     if response_data and response_data.get("success") and response_data.get("obj"):
-        traffic_data_map = response_data.get("obj", {})
-        client_traffic = traffic_data_map.get(client_email)
+        traffic_obj = response_data.get("obj", {})
+        # 3x-ui отдаёт объект статистики клиента напрямую, старые версии — словарь по email
+        client_traffic = traffic_obj if "email" in traffic_obj else traffic_obj.get(client_email)
         if client_traffic:
             logger.debug(f"Traffic data received for {client_email}: Up={client_traffic.get('up')}, Down={client_traffic.get('down')}, Total={client_traffic.get('total')}")
             return {
                 "up": client_traffic.get("up", 0),
                 "down": client_traffic.get("down", 0),
                 "total": client_traffic.get("total", 0),
+                "enable": client_traffic.get("enable", True),
             }
         else:
             logger.warning(f"Traffic data for client {client_email} not found in API response obj for email {client_email}.")
             return None
     else:
-        logger.error(f"Failed to get traffic for client {client_email} via 3x-ui API. Response: {response_data}. Msg: {response_data.get('msg')}")
+        logger.error(f"Failed to get traffic for client {client_email} via 3x-ui API. Response: {response_data}.")
         return None
 
-async def create_key(server_id: int, protocol: str, user_telegram_id: int, user_username: str | None, total_traffic_gb: Union[int, None] = None) -> Tuple[Union[str, None], Union[str, None]]:
-
-    server_config = _find_server_config(server_id)
-    if not server_config:
-        logger.error(f"Server config not found for ID: {server_id}")
-        return None, None
-
-    if protocol == "outline":
-        outline_api_url = server_config.get("outline_api_url")
-        if not outline_api_url:
-            logger.error(f"Outline API URL not configured for server {server_id}")
-            return None, None
-
-        key_name = f"tg_{user_telegram_id}"
-        if user_username:
-            cleaned_username = ''.join(c if c.isalnum() else '_' for c in user_username).lower()
-            key_name += f"_{cleaned_username}"
-        key_name += f"_{int(time.time())}"
-
-        logger.info(f"Creating Outline key via API: {outline_api_url}")
-        try:
-            response = requests.post(f"{outline_api_url}/access-keys", json={"name": key_name}, verify=False, timeout=15)
-            response.raise_for_status()
-
-            if response.status_code == 201:
-                key_data_json = response.json()
-                key_url = key_data_json.get("accessUrl")
-                key_id = key_data_json.get("id")
-
-                if key_url and key_id is not None:
-                    logger.info(f"Outline key created successfully. ID: {key_id}, Name: {key_name}")
-                    return key_url, str(key_id)
-                else:
-                    logger.error(f"Outline API returned unexpected data format. Response: {response.text}")
-                    return None, None
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error connecting to Outline API for server {server_id} during key creation: {e}")
-            return None, None
-        except Exception as e:
-            logger.error(f"An unexpected error occurred during Outline key creation: {e}", exc_info=True)
-            return None, None
-
-    elif protocol == "vless":
-        inbound_id = server_config.get("xui_vless_inbound_id")
-        if inbound_id is None:
-            logger.error(f"3x-ui VLESS inbound ID not configured for server {server_id}. Cannot create VLESS key via API.")
-            return None, None
-
-        if not all([server_config.get("xui_vless_public_key"), server_config.get("xui_vless_sni"), server_config.get("xui_vless_short_id")]):
-            logger.error(f"Missing required Reality parameters (public_key, sni, or short_id) in secrets.py for server {server_id}. Cannot create VLESS Reality key.")
-            return None, None
-
-        # Передаем user_username в функцию добавления клиента
-        key_data, key_identifier = await _xui_add_vless_client(server_config, user_telegram_id, user_username, total_traffic_gb=total_traffic_gb)
-
-        if key_data and key_identifier:
-            logger.info(f"VLESS key created successfully via 3x-ui API for server {server_id}.")
-            return key_data, key_identifier
-        else:
-            logger.error(f"Failed to create VLESS key via 3x-ui API for server {server_id}.")
-            return None, key_identifier if key_identifier else None
-
-    elif protocol == "shadowsocks":
-        inbound_id = server_config.get("xui_shadowsocks_inbound_id")
-        if inbound_id is None:
-            logger.error(f"3x-ui Shadowsocks inbound ID not configured for server {server_id}. Cannot create Shadowsocks key via API.")
-            return None, None
-
-        if not server_config.get("xui_shadowsocks_method"):
-            logger.error(f"Missing required Shadowsocks method in secrets.py for server {server_id}. Cannot create Shadowsocks key.")
-            return None, None
-
-        key_data, key_identifier = await _xui_add_shadowsocks_client(server_config, user_telegram_id, user_username, total_traffic_gb=total_traffic_gb)
-
-        if key_data and key_identifier:
-            logger.info(f"Shadowsocks key created successfully via 3x-ui API for server {server_id}.")
-            return key_data, key_identifier
-        else:
-            logger.error(f"Failed to create Shadowsocks key via 3x-ui API for server {server_id}.")
-            return None, key_identifier if key_identifier else None
-
-
-    else:
-        logger.error(f"Unknown protocol '{protocol}' requested for key creation.")
-        return None, None
-
-async def delete_key(server_id: int, protocol: str, key_identifier: str, key_data: str = None) -> bool:
+async def list_inbounds() -> list[dict] | None:
+    """Все инбаунды панели одним запросом: settings с клиентами и статистика трафика (clientStats)."""
+    response_data = await _xui_api_request("GET", "/panel/api/inbounds/list")
+    if response_data and response_data.get("success") and isinstance(response_data.get("obj"), list):
+        return response_data["obj"]
+    logger.error(f"Failed to list 3x-ui inbounds. Response: {str(response_data)[:300]}")
+    return None
 
-    server_config = _find_server_config(server_id)
-    if not server_config:
-        logger.error(f"Server config not found for ID: {server_id}")
-        return False
+# Каким полем клиента панель идентифицирует его в updateClient/{clientId}
+_CLIENT_ID_FIELDS = {"vless": "id", "vmess": "id", "trojan": "password"}
 
-    if protocol == "outline":
-        outline_api_url = server_config.get("outline_api_url")
-        if not outline_api_url:
-            logger.error(f"Outline API URL not configured for server {server_id}")
-            return False
+async def _xui_update_client(inbound_id: int, protocol: str, client: dict) -> bool:
+    client_id = client.get(_CLIENT_ID_FIELDS.get(protocol, "email"))
+    payload = {"id": inbound_id, "settings": json.dumps({"clients": [client]})}
+    response_data = await _xui_api_request("POST", f"/panel/api/inbounds/updateClient/{client_id}", json_data=payload)
+    if response_data and response_data.get("success"):
+        return True
+    logger.error(f"Failed to update client {client.get('email')} in inbound {inbound_id}. Response: {response_data}")
+    return False
 
-        if not key_identifier:
-            logger.error(f"Cannot delete Outline key: key_identifier is missing for server {server_id}.")
-            return False
+async def update_clients(updates: list[tuple[int, str, dict]], concurrency: int = 10) -> list[bool]:
+    """Обновляет клиентов (inbound_id, protocol, client) в панели, не больше concurrency запросов одновременно.
 
-        logger.info(f"Deleting Outline key via API. ID: {key_identifier}")
-        try:
-            target_key_id = int(key_identifier)
-            response = requests.delete(f"{outline_api_url}/access-keys/{target_key_id}", verify=False, timeout=15)
-            response.raise_for_status()
-
-            if response.status_code == 204:
-                logger.info(f"Outline key {key_identifier} deleted successfully via API.")
-                return True
-        except ValueError:
-            logger.error(f"Invalid Outline key_identifier format for deletion: {key_identifier}. Expected integer ID.")
-            return False
-        except requests.exceptions.HTTPError as e:
-            if e.response.status_code == 404:
-                logger.warning(f"Outline key {key_identifier} not found on the server (already deleted?). Status: 404")
-                return True
-            else:
-                logger.error(f"HTTP error during Outline key deletion {key_identifier}: {e.response.status_code} - {e.response.text}")
-                return False
-        except requests.exceptions.RequestException as e:
-            logger.error(f"Error connecting to Outline API for server {server_id} during key deletion: {e}")
-            return False
-        except Exception as e:
-            logger.error(f"An unexpected error occurred during Outline key deletion: {e}", exc_info=True)
-            return False
+    updateClient в 3x-ui меняет одного клиента за вызов, поэтому пакет — это ограниченная параллельность.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
 
-    elif protocol == "vless":
-        if not key_identifier:
-            logger.error(f"Cannot delete VLESS key: key_identifier (email) is missing for server {server_id}.")
-            return False
-        return await _xui_delete_vless_client(server_config, key_identifier)
+    async def update_one(inbound_id: int, protocol: str, client: dict) -> bool:
+        async with semaphore:
+            return await _xui_update_client(inbound_id, protocol, client)
 
-    elif protocol == "shadowsocks": # <-- НОВЫЙ ПРОТОКОЛ SHADOWSOCKS
-        if not key_identifier:
-            logger.error(f"Cannot delete Shadowsocks key: key_identifier (email) is missing for server {server_id}.")
-            return False
-        return await _xui_delete_shadowsocks_client(server_config, key_identifier)
-
-    else:
-        logger.error(f"Unknown protocol '{protocol}' requested for key deletion.")
-        return None, None
+    return await asyncio.gather(*(update_one(*update) for update in updates))
 
 def format_bytes(byte_count: Union[int, None]) -> str:
     if byte_count is None:
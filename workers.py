@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""Режим нескольких процессов-воркеров: python main.py --workers N.
+
+Главный процесс один получает обновления (getUpdates: Telegram отдаёт их только одному
+получателю) и раскладывает их по очередям воркеров по id пользователя. Все обновления
+пользователя обрабатывает один и тот же воркер, поэтому порядок его нажатий, лимиты Telegram
+на чат и кэши его ключей остаются локальными. Воркер — обычное приложение бота без Updater
+в отдельном процессе со своим event loop и пулом соединений к общей базе (Postgres или
+SQLite в режиме WAL); то, что воркеры делят между собой, лежит в базе (см. coordination).
+
+Упавший воркер перезапускается, его очередь сохраняется. При остановке (SIGTERM/SIGINT)
+главный процесс перестаёт получать обновления, подтверждает уже разложенные и кладёт в
+очереди маркер конца: воркер обрабатывает очередь, дожидается выдачи ключей (lifecycle)
+и выходит.
+"""
+import asyncio
+import logging
+import multiprocessing
+import signal
+import time
+from queue import Empty
+
+from telegram import Bot, Update
+from telegram.error import TelegramError
+
+import secrets
+
+logger = logging.getLogger(__name__)
+
+_POLL_TIMEOUT_SEC = 10
+# Сверх SHUTDOWN_DRAIN_TIMEOUT_SEC на обработку остатка очереди и закрытие ресурсов
+_STOP_GRACE_SEC = 15
+# Маркер конца очереди воркера
+_STOP = None
+
+
+def shard_for(user_id: int | None, count: int) -> int:
+    """Номер воркера для обновления пользователя; обновления без пользователя — воркеру 0."""
+    return user_id % count if user_id is not None else 0
+
+
+class WorkerPool:
+    """Процессы-воркеры и их очереди. target(index, count, queue, ready, *args) — функция воркера."""
+
+    def __init__(self, count: int, target=None, args: tuple = ()):
+        self.count = count
+        self._context = multiprocessing.get_context("spawn")
+        self._target = target or worker_main
+        self._args = args
+        self.queues = [self._context.Queue() for _ in range(count)]
+        # Воркеры присылают сюда свой номер, когда готовы обрабатывать обновления
+        self.ready = self._context.Queue()
+        self.processes: list[multiprocessing.Process | None] = [None] * count
+
+    def _start(self, index: int) -> None:
+        process = self._context.Process(
+            target=self._target, args=(index, self.count, self.queues[index], self.ready, *self._args), name=f"worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+
+    def start(self) -> None:
+        for index in range(self.count):
+            self._start(index)
+
+    def wait_ready(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        for _ in range(self.count):
+            try:
+                self.ready.get(timeout=max(0.0, deadline - time.monotonic()))
+            except Empty:
+                return False
+        return True
+
+    def restart_dead(self) -> None:
+        for index, process in enumerate(self.processes):
+            if process is not None and not process.is_alive():
+                logger.error(f"Worker {index} exited with code {process.exitcode}, restarting it.")
+                self._start(index)
+
+    def put(self, user_id: int | None, data: dict) -> None:
+        self.queues[shard_for(user_id, self.count)].put(data)
+
+    def stop(self, timeout: float) -> None:
+        """Маркер конца в каждую очередь; воркеры, не успевшие выйти за timeout, убиваются."""
+        for queue in self.queues:
+            queue.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for process in self.processes:
+            if process is not None:
+                process.join(max(0.0, deadline - time.monotonic()))
+        for index, process in enumerate(self.processes):
+            if process is not None and process.is_alive():
+                logger.warning(f"Worker {index} did not stop in {timeout:.0f}s, killing it.")
+                process.kill()
+                process.join()
+        for queue in self.queues:
+            queue.close()
+            queue.join_thread()
+
+
+async def _poll(bot: Bot, pool: WorkerPool, state: dict) -> None:
+    while True:
+        try:
+            updates = await bot.get_updates(offset=state["offset"], timeout=_POLL_TIMEOUT_SEC, allowed_updates=Update.ALL_TYPES)
+        except TelegramError as e:
+            logger.error(f"getUpdates failed: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            user = update.effective_user
+            pool.put(user.id if user else None, update.to_dict())
+            state["offset"] = update.update_id + 1
+        pool.restart_dead()
+
+
+async def _dispatch(token: str, pool: WorkerPool) -> None:
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    state = {"offset": None}
+    async with Bot(token) as bot:
+        await bot.delete_webhook()
+        poller = asyncio.create_task(_poll(bot, pool, state))
+        await stop.wait()
+        logger.info("Stopping: no more updates are fetched.")
+        poller.cancel()
+        await asyncio.gather(poller, return_exceptions=True)
+        if state["offset"] is not None:
+            # Подтверждаем разложенные по очередям обновления, чтобы Telegram не прислал их снова
+            try:
+                await bot.get_updates(offset=state["offset"], timeout=0, limit=1)
+            except TelegramError as e:
+                logger.warning(f"Failed to confirm dispatched updates: {e}")
+
+
+def run(count: int, token: str) -> None:
+    """Главный процесс: запускает воркеры и раздаёт им обновления до SIGTERM/SIGINT."""
+    pool = WorkerPool(count)
+    pool.start()
+    try:
+        asyncio.run(_dispatch(token, pool))
+    finally:
+        pool.stop(getattr(secrets, "SHUTDOWN_DRAIN_TIMEOUT_SEC", 20) + _STOP_GRACE_SEC)
+
+
+def worker_main(index: int, count: int, queue, ready, setup=None) -> None:
+    """Точка входа процесса-воркера. setup — корутина-функция, возвращающая ApplicationBuilder
+    для приложения (benchmarks подставляют так имитации Bot API и панели)."""
+    # Ctrl+C и SIGTERM от systemd получает вся группа процессов; воркер останавливает
+    # главный процесс маркером в очереди, после того как раздал все полученные обновления
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(_serve(index, count, queue, ready, setup))
+
+
+async def _serve(index: int, count: int, queue, ready, setup) -> None:
+    import coordination
+    import main
+    import startup
+
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(f'%(asctime)s - worker {index} - %(name)s - %(levelname)s - %(message)s'))
+    coordination.configure(index)
+    profiler = startup.StartupProfiler(enabled=False, process_started=time.perf_counter())
+    settings = main.load_configuration(profiler)
+    builder = await setup() if setup else None
+    application = main.build_application(settings, profiler, worker_count=count, builder=builder)
+
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+    logger.info(f"Worker {index} of {count} is ready.")
+    ready.put(index)
+
+    loop = asyncio.get_running_loop()
+    while True:
+        data = await loop.run_in_executor(None, queue.get)
+        if data is _STOP:
+            break
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+    await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+    logger.info(f"Worker {index} stopped.")